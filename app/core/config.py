@@ -22,9 +22,92 @@ class Settings(BaseSettings):
     redis_url: str
     empresa_db: str
     
-    # INITIAL PROMPT for the chatbot
-    INITIAL_PROMPT: str = """
-    Aquí está el menú en formato JSON:
+    # Redis connection pools (one per client type and process): size, timeouts, health checks and retries
+    redis_max_connections: int = 50
+    redis_pool_timeout_seconds: float = 5.0 # Wait for a free connection before failing
+    redis_socket_timeout_seconds: float = 10.0 # Must be above the 5 s blocking reads of the queue workers
+    redis_connect_timeout_seconds: float = 3.0
+    redis_health_check_interval_seconds: int = 30
+    redis_retry_attempts: int = 3
+    redis_retry_backoff_base_seconds: float = 0.05
+    redis_retry_backoff_cap_seconds: float = 1.0
+    # Redis Cluster: redis_url points to any node and empresa_db is not used (a cluster only has db 0)
+    redis_cluster: bool = False
+    
+    # Ingest mode for /openai/message: "sync" answers inside the webhook, "queue" acks and processes in background workers
+    ingest_mode: str = "sync"
+    queue_workers: int = 4
+    queue_visibility_timeout_ms: int = 60000
+    queue_max_deliveries: int = 5
+    
+    # Messages a user sends within this window are merged into a single turn (0 disables it)
+    coalesce_window_ms: int = 1500
+    coalesce_max_wait_ms: int = 5000
+    
+    # Token budget of the context sent to the model; older turns are folded into a rolling summary
+    context_token_budget: int = 9000
+    context_keep_turns: int = 6
+    
+    # Cache of replies to menu and FAQ questions (in-process LRU, optionally shared through Redis)
+    response_cache_max_entries: int = 1024
+    response_cache_ttl_seconds: int = 3600
+    response_cache_redis: bool = False
+    
+    # Stream the completions and send every paragraph to WhatsApp as soon as it is complete
+    stream_responses: bool = False
+    
+    # Session keys expire after this long without activity; the conversation starts over after the idle reset
+    session_ttl_seconds: int = 86400
+    session_idle_reset_seconds: int = 300
+    
+    # Serialization of the history entries and order data stored in Redis: "orjson", "msgpack" or "json",
+    # compressed with zstd above the size threshold (0 disables the compression)
+    session_codec: str = "orjson"
+    session_compress_min_bytes: int = 1024
+    
+    # Sessions cached in each process, kept coherent through Redis keyspace notifications (0 disables it)
+    session_cache_max_entries: int = 10000
+    
+    # Twilio API client shared by the process: pooled keep-alive connections, timeouts and retries with backoff
+    twilio_max_connections: int = 20
+    twilio_timeout_seconds: float = 10.0
+    twilio_retry_attempts: int = 3
+    twilio_retry_backoff_base_seconds: float = 0.25
+    twilio_retry_backoff_cap_seconds: float = 4.0
+    # Another Messages API to send to, like the fake server of bench/fake_twilio.py (empty: Twilio)
+    twilio_api_base_url: str = ""
+    
+    # Outbound WhatsApp messages: sent in order per user, throttled per sending number,
+    # optionally merging the messages queued for the same user into one send
+    outbound_messages_per_second: float = 10
+    outbound_burst: int = 20
+    outbound_merge_messages: bool = False
+    
+    # Voice notes are streamed into memory through a pooled client, up to this size
+    audio_max_bytes: int = 16 * 1024 * 1024
+    audio_download_timeout_seconds: float = 30.0
+    audio_download_max_connections: int = 20
+    # Voice notes are shrunk before the transcription (mono, 16 kHz, silence trimmed, Opus) in worker processes; needs ffmpeg
+    audio_preprocess: bool = True
+    audio_preprocess_workers: int = 2
+    audio_silence_threshold_dbfs: float = -40.0
+    audio_bitrate: str = "24k"
+    # Notes longer than this are split at pauses and the chunks transcribed concurrently (0 disables it)
+    transcription_chunk_seconds: int = 20
+    transcription_max_parallel: int = 4
+    
+    # Finished and idle conversations are moved out of Redis into gzip JSONL segments, written in batches
+    archive_enabled: bool = True
+    archive_dir: str = "archive"
+    archive_batch_size: int = 100
+    archive_flush_interval_seconds: float = 10
+    archive_segment_max_bytes: int = 64 * 1024 * 1024
+    # Sessions without activity for this long are archived and removed by the sweeper (before their TTL)
+    archive_idle_seconds: int = 6 * 3600
+    archive_sweep_interval_seconds: int = 300
+    
+    # MENU of the restaurant in JSON format, loaded into the menu catalog
+    MENU_JSON: str = """
     {
         "categories": [
             {
@@ -464,7 +547,10 @@ class Settings(BaseSettings):
             }
         ]
     }
+    """
     
+    # INITIAL PROMPT for the chatbot
+    INITIAL_PROMPT: str = """
     Eres un camarero en un restaurante, te llamas Juan. Presentate y di que trabajas en El Mundo del Campero. También pregunta al cliente en que mesa se encuentra.
     Junto con ese mensaje de bienvenida, tienes que incluir dos cosas, 
     1. Politica de privacidad y cookies (No escribas esta linea. Solo el texto):
@@ -478,7 +564,10 @@ class Settings(BaseSettings):
     Puedes decir algun plato de alguna categoria, pero no muestres el menu entero. 
     Responde de manera profesional (utiliza emoticonos para ser mas agradable).
     Antes de ofrecer algo, comprueba que exista en el menu. NO ofrezcas nada que no esté en el menu.
-    Debes utilizar el JSON del menú para responder a los clientes. No puedes salirte del JSON. 
+    El menú no está en este mensaje: consúltalo siempre con las herramientas del menú antes de responder.
+    Usa list_menu_categories para las categorías, get_category_items para los platos de una categoría,
+    find_menu_item para buscar un plato o bebida por su nombre y check_extra para comprobar un extra de un plato.
+    No puedes salirte de lo que devuelven las herramientas. 
     Recuerda que los articulos del menú, tienen la opcion de "available" para saber si estan disponibles o no.
     
     Toma el pedido de los clientes.
@@ -513,6 +602,8 @@ class Settings(BaseSettings):
     ```
     
     Solo escribe el resumen del pedido cuando el cliente de por terminado el pedido.
+    Cuando el cliente de por terminado el pedido, llama primero a submit_order con el numero de mesa, los platos
+    (con sus extras y exclusiones) y las bebidas, y despues escribe el resumen del pedido.
     Manten siempre el mismo formato para el resumen del pedido. No lo cambies. Nunca.
     Siempre el mismo formato. Para platos, extras, bebidas...
     
@@ -524,8 +615,8 @@ class Settings(BaseSettings):
     Con los extras, si el cliente pide algo que no está en el menú, responde que no está disponible.
     Los extras unicamente se pueden añadir a los platos que tienen extras disponibles.
     Y unicamente los extras que estan en el menú.
-    NO ACEPTES NI PLATOS NI EXTRAS QUE NO ESTEN EN EL JSON.
-    Cuando te digan quiero X plato con Y extra, debes confirmar que ese plato tiene ese extra asociado. Si no lo tiene, responde que no está disponible.
+    NO ACEPTES NI PLATOS NI EXTRAS QUE NO ESTEN EN EL MENÚ.
+    Cuando te digan quiero X plato con Y extra, debes confirmar con check_extra que ese plato tiene ese extra asociado. Si no lo tiene, responde que no está disponible.
     Si te piden quitar algo que lleve el plato, como quiar el queso de una hamburguesa, responde que si se puede hacer.
     Si te dicen que quites el queso, tomate o alguna otra cosa de lo que pida, responde que si se puede hacer. Y muestralo asi en el resumen:
     ```
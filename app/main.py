@@ -1,8 +1,42 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
+from app.core.config import settings
 from app.routes import openai_routes, payment_routes, printer_routes
+from app.services.archive_service import conversation_archiver
+from app.services.audio_service import audio_preprocessor
+from app.services.openai_service import media_client
+from app.services.outbound_service import outbound_dispatcher
+from app.services.queue_service import message_queue
+from app.services.redis_service import pool_stats
+from app.services.session_service import session_manager
+from app.services.twilio_service import twilio_service
+from app.shared.metrics import metrics
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Start the background workers when incoming messages are queued
+    workers = []
+    if settings.ingest_mode == "queue":
+        workers = message_queue.start_workers(openai_routes.process_queued_message, settings.queue_workers)
+    await session_manager.cache.start()
+    # Finished conversations are archived in batches; idle ones are swept out of Redis periodically
+    await conversation_archiver.start(session_manager.archive_idle_sessions, settings.archive_sweep_interval_seconds)
+    await audio_preprocessor.start()
+
+    yield
 
-app = FastAPI(title="My API")
+    await message_queue.stop_workers(workers)
+    await session_manager.cache.stop()
+    await conversation_archiver.stop()
+    # Messages still queued are sent before the Twilio connections are closed
+    await outbound_dispatcher.stop()
+    await twilio_service.close()
+    await media_client.aclose()
+    audio_preprocessor.shutdown()
+
+app = FastAPI(title="My API", lifespan=lifespan)
 
 # Incluir rutas
 app.include_router(openai_routes.router)
@@ -11,4 +45,20 @@ app.include_router(printer_routes.router)
 
 @app.get("/")
 def read_root():
-    return {"message": "Proyecto realizado por ElectroSolucion y ***"}
\ No newline at end of file
+    return {"message": "Proyecto realizado por ElectroSolucion y ***"}
+
+@app.get("/metrics")
+def read_metrics():
+    return {
+        "counters": metrics.snapshot(),
+        "openai_prompt_cache_hit_rate": metrics.ratio("openai_cached_prompt_tokens", "openai_prompt_tokens"),
+        "response_cache_hit_rate": metrics.ratio("response_cache_hits", "response_cache_lookups"),
+        "audio_size_ratio": metrics.ratio("audio_bytes_out", "audio_bytes_in"),
+        "session_cache": {
+            "enabled": session_manager.cache.enabled,
+            "entries": len(session_manager.cache.entries),
+            "hit_rate": metrics.ratio("session_cache_hits", "session_cache_lookups")
+        },
+        "archive_pending": len(conversation_archiver.pending),
+        "redis_pools": pool_stats()
+    }
\ No newline at end of file
@@ -1,11 +1,14 @@
-import os
-import shutil
+import asyncio
 from typing import Optional
 
 from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel, ValidationError
 
-from app.services.openai_service import download_audio_from_twilio, process_incoming_message, transcribe_audio_with_whisper
+from app.core.config import settings
+from app.services.audio_service import audio_preprocessor
+from app.services.coalesce_service import message_coalescer
+from app.services.openai_service import download_audio_from_twilio, process_incoming_message, transcribe_audio_chunks
+from app.services.queue_service import message_queue
 from app.services.session_service import session_manager
 
 router = APIRouter(prefix="/openai", tags=["OpenAI"])
@@ -15,57 +18,103 @@ class MessageRequest(BaseModel):
     message: str  # Twilio's "Body"
     session_id: Optional[str] = None  # Optional session ID
 
+async def read_twilio_form(data: dict) -> MessageRequest:
+    """
+    Turns the form data of an incoming Twilio message into a MessageRequest,
+    transcribing the voice note if one was sent.
+    """
+    # Check if an audio file was sent in the form data
+    media_url = data.get("MediaUrl0") # Twilio's "MediaUrl0"
+    
+    if media_url:
+        # Audio processing flow: the note stays in memory, owned by this request
+        audio, filename = await download_audio_from_twilio(media_url, data.get("From"))
+        
+        # Shrink it before the upload (mono, 16 kHz, without the silence at both ends)
+        # and split it at its pauses if it is long, decoding it only once
+        chunks = await audio_preprocessor.prepare(audio, filename, settings.transcription_chunk_seconds * 1000)
+        
+        # Transcribe the audio, the chunks in parallel
+        transcribed_text = await transcribe_audio_chunks(chunks)
+        
+        # Now you can use the transcribed text as the user message
+        user_message = transcribed_text
+        
+    else:
+        # Text processing flow
+        user_message = data.get("Body") # Twilio's "Body"
+
+    # Map the data to the MessageRequest model
+    return MessageRequest(
+        user_id = data.get("From"), # Twilio's "From"
+        message = user_message, # Twilio's "Body"
+        session_id = None  # Optional session ID
+    )
+
+def _turn_handler(message_request: MessageRequest):
+    return lambda merged_message: process_incoming_message(
+        user_id = message_request.user_id,
+        message = merged_message,
+        session_id = message_request.session_id
+    )
+
+async def process_twilio_form(data: dict) -> dict:
+    """
+    Runs the message flow for the form data of an incoming Twilio message.
+    """
+    message_request = await read_twilio_form(data)
+    
+    # Messages sent in a quick burst are answered as a single turn
+    return await message_coalescer.submit(message_request.user_id, message_request.message, _turn_handler(message_request))
+
+async def _log_client_errors(data: dict, awaitable):
+    """Client errors are final, so they are logged instead of raised to avoid redelivering the job."""
+    try:
+        return await awaitable
+    except HTTPException as e:
+        if e.status_code >= 500:
+            raise
+        print(f"Queued message from {data.get('From')} rejected: {e.detail}")
+    except ValidationError as e:
+        print(f"Queued message from {data.get('From')} rejected: {e.errors()}")
+
+async def process_queued_message(data: dict) -> Optional[asyncio.Task]:
+    """
+    Handler for the background workers. The message joins the user's coalescing window and the
+    returned task finishes the job, so the worker takes the next message while the window is open
+    (a burst larger than the pool of workers is still merged into one turn).
+    """
+    message_request = await _log_client_errors(data, read_twilio_form(data))
+    if message_request is None:
+        return None
+    
+    turn = message_coalescer.enqueue(message_request.user_id, message_request.message, _turn_handler(message_request))
+    return asyncio.ensure_future(_log_client_errors(data, turn))
+
 @router.post("/message")
 async def get_openai_response(request: Request) -> dict:
     """
     Handles the complete message flow for incoming Twilio messages.
+    In queue mode the message is only validated and queued, and the workers answer it.
     """
     try:
         # Process the data sent in the form
         form_data = await request.form()
         data = dict(form_data)
         
-        # Check if an audio file was sent in the form data
-        media_url = data.get("MediaUrl0") # Twilio's "MediaUrl0"
-        
-        if media_url:
-            # Audio processing flow
-            temp_audio_path = None
-            try:
-                # Download the audio file
-                temp_audio_path = await download_audio_from_twilio(media_url, data.get("From"))
-                
-                # Transcribe the audio file
-                transcribed_text = await transcribe_audio_with_whisper(temp_audio_path)
-                
-                # Now you can use the transcribed text as the user message
-                user_message = transcribed_text
-                
-            finally:
-                # Clean up temporary files in the audio directory
-                audio_dir = os.path.join(os.path.dirname(__file__), '../services/audio_files')
-                if os.path.exists(audio_dir):
-                    shutil.rmtree(audio_dir)
-                    os.makedirs(audio_dir)
+        if settings.ingest_mode == "queue":
+            # Validate the form before acknowledging it to Twilio
+            if not data.get("From") or not (data.get("Body") or data.get("MediaUrl0")):
+                raise HTTPException(status_code=422, detail="Missing From, Body or MediaUrl0")
             
-        else:
-            # Text processing flow
-            user_message = data.get("Body") # Twilio's "Body"
-
-        # Map the data to the MessageRequest model
-        message_request = MessageRequest(
-            user_id = data.get("From"), # Twilio's "From"
-            message = user_message, # Twilio's "Body"
-            session_id = None  # Optional session ID
-        )
-        
-        response_data = process_incoming_message(
-            user_id = message_request.user_id,
-            message = message_request.message,
-            session_id = message_request.session_id
-        )
+            # Twilio retries reuse the MessageSid, so the same turn is only queued once
+            await message_queue.enqueue(data, dedupe_id=data.get("MessageSid"))
+            return {"status": "queued"}
         
-        return response_data
+        return await process_twilio_form(data)
+    
+    except HTTPException:
+        raise
     
     except ValidationError as e:
         raise HTTPException(status_code=422, detail=e.errors())
@@ -74,15 +123,14 @@ async def get_openai_response(request: Request) -> dict:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/session/{session_id}/history")
-def get_session_history(session_id: str) -> dict:
+async def get_session_history(session_id: str) -> dict:
     """
     Get the session history for a given session ID
     """
-    # Get the session history
-    history = session_manager.get_session(session_id)
-    
-    # Check if the session exists
-    if not history:
+    # Get the session history; a session that exists but has no turns yet has an empty one
+    try:
+        history = await session_manager.get_session(session_id)
+    except ValueError:
         raise HTTPException(status_code=404, detail="Session not found")
     
     return {
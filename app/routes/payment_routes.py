@@ -10,20 +10,21 @@ from fastapi.responses import HTMLResponse
 from fastapi import APIRouter, HTTPException, Request
 
 from app.core.config import settings
+from app.services.outbound_service import outbound_dispatcher
 from app.services.payment_service import PaymentServiceRedsys, create_stripe_payment_link, send_payment_confirmation
+from app.services.pricing_service import pricing_engine
 from app.services.session_service import session_manager
-from app.services.twilio_service import TwilioService
 from app.shared.data_store import pending_tickets_store
 
 router = APIRouter(prefix="/payment", tags=["payment"])
 payment_service_redsys = PaymentServiceRedsys()
 
 @router.post("/create-payment-link")
-def create_payment_link(request: Dict, user_id: str, session_id: str) -> Dict[str, str]:
+async def create_payment_link(request: Dict, user_id: str, session_id: str) -> Dict[str, str]:
     """
     Crea un link de pago para un pedido con los productos, cantidades, extras y exclusiones especificados.
     """
-    return create_stripe_payment_link(request, user_id, session_id)
+    return await create_stripe_payment_link(request, user_id, session_id)
 
 @router.post("/webhook")
 async def stripe_webhook(request: Request) -> Dict[str, str]:
@@ -36,7 +37,7 @@ async def stripe_webhook(request: Request) -> Dict[str, str]:
 
     try:
         event = create_stripe_event(payload, sig_header, endpoint_secret)  # ver más abajo
-        handle_stripe_event(event)
+        await handle_stripe_event(event)
         return {"status": "success"}
 
     except ValueError:
@@ -52,7 +53,7 @@ def create_stripe_event(payload: bytes, sig_header: str, endpoint_secret: str):
         payload, sig_header, endpoint_secret
     )
 
-def handle_stripe_event(event) -> None:
+async def handle_stripe_event(event) -> None:
     """
     Maneja la lógica principal de Stripe Webhook.
     """
@@ -63,19 +64,35 @@ def handle_stripe_event(event) -> None:
         user_id = session.get("metadata", {}).get("user_id")
 
         # Enviar mensaje de confirmación
-        TwilioService().send_whatsapp_message(user_id, "¡Gracias por tu pedido! 🎉 Tu pago se ha completado.")
-        session_manager.clear_session(session_id)
+        await outbound_dispatcher.send(user_id, "¡Gracias por tu pedido! 🎉 Tu pago se ha completado.")
+        await session_manager.clear_session(session_id, archive_reason="paid")
         
     else:
         # Manejar otros tipos de eventos si lo necesitas
         print(f"Evento de Stripe no manejado: {event['type']}")
 
+async def get_verified_amount(order_id: str, user_id: str) -> float:
+    """
+    Devuelve el importe a cobrar del pedido guardado en la sesión, recalculado con los precios de la carta.
+    El importe de la URL no se usa, ya que se puede modificar.
+    """
+    session_id = await session_manager.get_session_by_user(user_id)
+    order_data = await session_manager.get_order_data(session_id) if session_id else None
+    if not order_data or order_data.get("order_id") != order_id:
+        raise HTTPException(status_code=404, detail="Pedido no encontrado")
+    
+    priced_order, _ = pricing_engine.price_order(order_data)
+    return priced_order["total"]
+
 @router.post("/start", response_class=HTMLResponse)
-def start_payment(order_id: str, amount: float, user_id: str):
+async def start_payment(order_id: str, amount: float, user_id: str):
     """
     Genera el formulario de pago para Redsys.
     """
     try:
+        # Cobrar el total del pedido guardado, no el de la URL
+        amount = await get_verified_amount(order_id, user_id)
+        
         # Aquí pasamos correctamente ambos parámetros a la función
         form_parameters =  payment_service_redsys.prepare_payment_request(order_id, amount, user_id)
         form_html = f"""
@@ -157,7 +174,7 @@ async def handle_user_cancellation(decoded_params: dict) -> Dict[str, str]:
             "Parece que cancelaste el pago. ¿Olvidaste añadir algo a tu pedido o deseas cancelar tu pedido?"
         )
         try:
-            TwilioService().send_whatsapp_message(f"whatsapp:{whatsapp_number}", message)
+            await outbound_dispatcher.send(f"whatsapp:{whatsapp_number}", message)
         except Exception as twilio_error:
             raise HTTPException(status_code=500, detail=f"Error enviando mensaje por WhatsApp: {twilio_error}")
 
@@ -206,10 +223,10 @@ async def payment_response_success(body: bytes):
             raise HTTPException(status_code=400, detail="No se encontró un número de WhatsApp")
         
         # Obtener la sesión del usuario
-        session_id = session_manager.get_session_by_user(f"whatsapp:{whatsapp_number}")
+        session_id = await session_manager.get_session_by_user(f"whatsapp:{whatsapp_number}")
         
         # Enviar email de confirmación a la empresa 
-        order_data = session_manager.get_order_data(session_id) 
+        order_data = await session_manager.get_order_data(session_id) 
         
         # Enviar email de confirmación a la empresa
         try:
@@ -224,19 +241,15 @@ async def payment_response_success(body: bytes):
         except Exception as print_error:
             raise HTTPException(status_code=500, detail=f"Error imprimiendo el ticket: {print_error}")
         
-        # Limpiar los datos del pedido
-        session_manager.clear_order_data(session_id)
+        # Archivar la conversación con su pedido y limpiar la sesión del usuario (y los datos del pedido)
+        await session_manager.clear_session(session_id, archive_reason="paid")
 
         # Enviar mensaje de confirmación vía Twilio
         try:
-            TwilioService().send_whatsapp_message(f"whatsapp:{whatsapp_number}", "¡Gracias por tu pedido! 🎉 Tu pago se ha completado.")
+            await outbound_dispatcher.send(f"whatsapp:{whatsapp_number}", "¡Gracias por tu pedido! 🎉 Tu pago se ha completado.")
         except Exception as twilio_error:
             raise HTTPException(status_code=500, detail=f"Error enviando mensaje por WhatsApp: {twilio_error}")
 
-        # Limpiar la sesión del usuario
-        session_id = session_manager.get_session_by_user(f"whatsapp:{whatsapp_number}")
-        session_manager.clear_session(session_id)
-
         return {"status": "success", "message": "Pago realizado con éxito"}
 
     except Exception as e:
@@ -301,21 +314,21 @@ async def payment_response_failure(body: bytes):
 
         # Enviar mensaje de error vía Twilio
         try:
-            TwilioService().send_whatsapp_message(f"whatsapp:{whatsapp_number}", error_message)
+            await outbound_dispatcher.send(f"whatsapp:{whatsapp_number}", error_message)
         except Exception as twilio_error:
             raise HTTPException(status_code=500, detail=f"Error enviando mensaje por WhatsApp: {twilio_error}")
 
         # Obtener la sesión del usuario
-        session_id = session_manager.get_session_by_user(f"whatsapp:{whatsapp_number}")
+        session_id = await session_manager.get_session_by_user(f"whatsapp:{whatsapp_number}")
         
         # Obtener los datos del pedido 
-        order_data = session_manager.get_order_data(session_id)
+        order_data = await session_manager.get_order_data(session_id)
         
         # Generate a new order ID
         new_order_id = generate_new_order_id()
         
         # Actualizar el ID del pedido en la sesión
-        session_manager.update_order_data(session_id, {"order_id": new_order_id})
+        await session_manager.update_order_data(session_id, {"order_id": new_order_id})
         
         # Generate the payment link with the new order ID
         params = {
@@ -329,7 +342,7 @@ async def payment_response_failure(body: bytes):
         payment_url = f"{base_url}?{query_string}"
         
         try:
-            TwilioService().send_whatsapp_message(
+            await outbound_dispatcher.send(
                 f"whatsapp:{whatsapp_number}",
                 f"Puede reintentar el pago en el siguiente enlace:\n{payment_url}"
             )
@@ -344,13 +357,13 @@ async def payment_response_failure(body: bytes):
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.get("/payment-form", response_class=HTMLResponse)
-def render_payment_form(order_id: str, amount: float, user_id: str):
+async def render_payment_form(order_id: str, amount: float, user_id: str):
     """
     Renderiza el formulario de pago generado por Redsys.
     """
     try:
         # Llama a `start_payment` para generar el formulario
-        form_html = start_payment(order_id, amount, user_id)
+        form_html = await start_payment(order_id, amount, user_id)
         return HTMLResponse(content=form_html, status_code=200)
     except Exception as e:
         return HTMLResponse(content=f"<h1>Error generando el formulario: {str(e)}</h1>", status_code=500)
\ No newline at end of file
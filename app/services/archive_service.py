@@ -0,0 +1,214 @@
+import asyncio
+import glob
+import gzip
+import json
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+from app.shared.metrics import metrics
+
+
+class ConversationArchiver:
+    """
+    Moves finished and idle conversations out of Redis into append-only segment files.
+    `submit()` only queues the record in memory; a background task writes the queue in batches.
+    Every batch is one gzip member appended to the current segment (`segment-<writer>-<n>.jsonl.gz`,
+    the concatenated members read back as a single JSONL file), and every record gets one line in
+    the index of the writer with the byte range of its batch. Each process writes its own segments
+    and index, so workers never append to the same file.
+    """
+    def __init__(self, directory: str, enabled: bool = True, batch_size: int = 100,
+                 flush_interval_seconds: float = 10, segment_max_bytes: int = 64 * 1024 * 1024):
+        self.directory = directory
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self.segment_max_bytes = segment_max_bytes
+        self.writer_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.segment_number = 0
+        self.pending: List[Dict] = []
+        self._file_lock = threading.Lock()  # Writes run in a worker thread
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def submit(self, record: Dict):
+        """Queues a conversation for the next batch."""
+        if not self.enabled:
+            return
+        record.setdefault("archived_at", datetime.now().isoformat())
+        self.pending.append(record)
+        metrics.increment("archive_records_queued")
+        if len(self.pending) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self, sweep: Optional[Callable[[], Awaitable[int]]] = None, sweep_interval_seconds: float = 300):
+        """Starts the flush task and, with `sweep`, a task that calls it periodically to archive idle conversations."""
+        if not self.enabled:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks.append(asyncio.create_task(self._flush_loop()))
+        if sweep is not None:
+            self._tasks.append(asyncio.create_task(self._sweep_loop(sweep, sweep_interval_seconds)))
+
+    async def stop(self):
+        """Stops the background tasks and writes what is still queued."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error writing the conversation archive, {len(self.pending)} conversations lost: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # The batch stays queued and is retried on the next flush
+                print(f"Error writing the conversation archive: {e}")
+
+    async def _sweep_loop(self, sweep: Callable[[], Awaitable[int]], interval_seconds: float):
+        while True:
+            await asyncio.sleep(interval_seconds)
+            try:
+                archived = await sweep()
+                if archived:
+                    print(f"Archived {archived} idle conversations")
+            except Exception as e:
+                print(f"Error archiving idle conversations: {e}")
+
+    async def flush(self) -> int:
+        """Writes the queued records as one batch. Returns how many were written."""
+        if not self.pending:
+            return 0
+        batch, self.pending = self.pending, []
+        try:
+            await asyncio.to_thread(self._write_batch, batch)
+        except Exception:
+            self.pending[:0] = batch
+            raise
+        metrics.increment("archive_records_written", len(batch))
+        metrics.increment("archive_batches_written")
+        return len(batch)
+
+    def _segment_path(self) -> str:
+        """Current segment of this writer, moving to the next one once it reaches `segment_max_bytes`."""
+        while True:
+            path = os.path.join(self.directory, f"segment-{self.writer_id}-{self.segment_number:05d}.jsonl.gz")
+            if not os.path.exists(path) or os.path.getsize(path) < self.segment_max_bytes:
+                return path
+            self.segment_number += 1
+
+    def _write_batch(self, batch: List[Dict]):
+        with self._file_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._segment_path()
+            lines = "".join(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n" for record in batch)
+            member = gzip.compress(lines.encode("utf-8"))
+            with open(path, "ab") as segment:
+                offset = segment.tell()
+                segment.write(member)
+                segment.flush()
+                os.fsync(segment.fileno())
+
+            # The index is written after the segment: an index line always points to data on disk
+            index = "".join(
+                json.dumps({
+                    "user_id": record.get("user_id"),
+                    "order_ids": record.get("order_ids", []),
+                    "session_id": record.get("session_id"),
+                    "reason": record.get("reason"),
+                    "archived_at": record["archived_at"],
+                    "segment": os.path.basename(path),
+                    "offset": offset,
+                    "length": len(member),
+                    "line": line,
+                }, ensure_ascii=False) + "\n"
+                for line, record in enumerate(batch)
+            )
+            with open(os.path.join(self.directory, f"index-{self.writer_id}.jsonl"), "a", encoding="utf-8") as index_file:
+                index_file.write(index)
+                index_file.flush()
+                os.fsync(index_file.fileno())
+
+
+class ArchiveReader:
+    """
+    Looks up archived conversations by user, order ID or archive date. Only the index files are scanned;
+    the segments are read at the byte range of the matching batches and nothing else is decompressed.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _index(self) -> Iterator[Dict]:
+        for path in sorted(glob.glob(os.path.join(self.directory, "index-*.jsonl"))):
+            with open(path, encoding="utf-8") as index_file:
+                for line in index_file:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue  # Line cut by a crash while it was written
+
+    def _read(self, entries: List[Dict]) -> List[Dict]:
+        batches: Dict[Tuple[str, int], List[str]] = {}
+        records = []
+        for entry in entries:
+            key = (entry["segment"], entry["offset"])
+            if key not in batches:
+                with open(os.path.join(self.directory, entry["segment"]), "rb") as segment:
+                    segment.seek(entry["offset"])
+                    batches[key] = gzip.decompress(segment.read(entry["length"])).decode("utf-8").splitlines()
+            records.append(json.loads(batches[key][entry["line"]]))
+        return records
+
+    def find_by_user(self, user_id: str) -> List[Dict]:
+        """Archived conversations of a user, oldest first."""
+        entries = [entry for entry in self._index() if entry["user_id"] == user_id]
+        return self._read(sorted(entries, key=lambda entry: entry["archived_at"]))
+
+    def find_by_order(self, order_id: str) -> List[Dict]:
+        """Archived conversations that placed the order."""
+        return self._read([entry for entry in self._index() if order_id in entry["order_ids"]])
+
+    def find_by_date(self, start: datetime, end: datetime) -> List[Dict]:
+        """Conversations archived from `start` (included) to `end` (excluded), oldest first."""
+        entries = [entry for entry in self._index() if start <= datetime.fromisoformat(entry["archived_at"]) < end]
+        return self._read(sorted(entries, key=lambda entry: entry["archived_at"]))
+
+# Global instance of the ConversationArchiver
+conversation_archiver = ConversationArchiver(
+    settings.archive_dir,
+    enabled=settings.archive_enabled,
+    batch_size=settings.archive_batch_size,
+    flush_interval_seconds=settings.archive_flush_interval_seconds,
+    segment_max_bytes=settings.archive_segment_max_bytes
+)
+
+if __name__ == "__main__":
+    # python -m app.services.archive_service user whatsapp:+34600000000
+    # python -m app.services.archive_service order ORD-20250101-0001
+    # python -m app.services.archive_service date 2025-01-01
+    import sys
+    if len(sys.argv) != 3 or sys.argv[1] not in ("user", "order", "date"):
+        print("Usage: python -m app.services.archive_service user|order|date <id or YYYY-MM-DD>")
+        sys.exit(2)
+    reader = ArchiveReader(settings.archive_dir)
+    if sys.argv[1] == "date":
+        day = datetime.fromisoformat(sys.argv[2])
+        found = reader.find_by_date(day, day + timedelta(days=1))
+    else:
+        found = reader.find_by_user(sys.argv[2]) if sys.argv[1] == "user" else reader.find_by_order(sys.argv[2])
+    for record in found:
+        print(json.dumps(record, ensure_ascii=False, indent=2))
+    print(f"{len(found)} conversations")
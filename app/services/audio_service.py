@@ -0,0 +1,215 @@
+import asyncio
+import io
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from pydub import AudioSegment
+from pydub.silence import detect_leading_silence, detect_silence
+
+from app.core.config import settings
+from app.shared.metrics import metrics
+
+# Decoder of each container, so pydub does not have to run ffprobe to find it (one process less per note)
+DECODERS = {"ogg": "opus", "webm": "opus", "mp3": "mp3", "m4a": "aac"}
+
+# Opus encoder effort (0-10): the default of 10 takes twice as long for a similar size on speech
+OPUS_COMPRESSION_LEVEL = 2
+
+# Kept before and after the speech when the silence is trimmed, not to clip the first and last words
+SILENCE_PADDING_MS = 200
+
+# Shortest pause where a long note can be split into chunks for the transcription
+MIN_SPLIT_SILENCE_MS = 300
+
+
+def _decode(audio: bytes, filename: str) -> AudioSegment:
+    """Decodes a voice note to 16 kHz mono samples."""
+    extension = os.path.splitext(filename)[1].lstrip(".").lower()
+    try:
+        segment = AudioSegment.from_file(io.BytesIO(audio), format=extension, codec=DECODERS.get(extension))
+    except Exception:
+        # Another codec in the same container (Vorbis in ogg): let ffprobe find it
+        segment = AudioSegment.from_file(io.BytesIO(audio), format=extension)
+    return segment.set_channels(1).set_frame_rate(16000)
+
+def _encode(segment: AudioSegment, bitrate: str) -> bytes:
+    output = io.BytesIO()
+    segment.export(output, format="ogg", codec="libopus", bitrate=bitrate, parameters=["-compression_level", str(OPUS_COMPRESSION_LEVEL)])
+    return output.getvalue()
+
+def _trim_silence(segment: AudioSegment, silence_threshold_dbfs: float) -> AudioSegment:
+    start = detect_leading_silence(segment, silence_threshold=silence_threshold_dbfs)
+    end = len(segment) - detect_leading_silence(segment.reverse(), silence_threshold=silence_threshold_dbfs)
+    if end <= start:  # Nothing but silence: left whole, Whisper will say so
+        return segment
+    return segment[max(0, start - SILENCE_PADDING_MS):min(len(segment), end + SILENCE_PADDING_MS)]
+
+def _split_points(segment: AudioSegment, chunk_ms: int, silence_threshold_dbfs: float) -> List[int]:
+    """
+    Cuts of at most `chunk_ms` apart, each in the middle of the last pause of its chunk
+    so no word is cut in two (at `chunk_ms` if there is none in the second half of the chunk).
+    """
+    pauses = [(start + end) // 2 for start, end in
+              detect_silence(segment, min_silence_len=MIN_SPLIT_SILENCE_MS, silence_thresh=silence_threshold_dbfs, seek_step=10)]
+    cuts = [0]
+    while len(segment) - cuts[-1] > chunk_ms:
+        candidates = [pause for pause in pauses if cuts[-1] + chunk_ms // 2 <= pause <= cuts[-1] + chunk_ms]
+        cuts.append(candidates[-1] if candidates else cuts[-1] + chunk_ms)
+    cuts.append(len(segment))
+    return cuts
+
+def prepare_audio(audio: bytes, filename: str, preprocess: bool, chunk_ms: int, silence_threshold_dbfs: float, bitrate: str) -> List[Tuple[bytes, str]]:
+    """
+    Turns a voice note into the files sent for transcription, decoding it only once. Runs in the
+    workers of `AudioPreprocessor`. With `preprocess` the note is downmixed to mono, resampled to
+    16 kHz, trimmed of its leading and trailing silence and encoded as Opus at `bitrate`. A note
+    longer than `chunk_ms` (0: never) is split at its pauses and every chunk is encoded that way.
+    Otherwise the note is returned as it is, in a list of one.
+    """
+    segment = _decode(audio, filename)
+    if preprocess:
+        segment = _trim_silence(segment, silence_threshold_dbfs)
+
+    name = os.path.splitext(filename)[0]
+    if not chunk_ms or len(segment) <= chunk_ms:
+        return [(_encode(segment, bitrate), f"{name}.ogg")] if preprocess else [(audio, filename)]
+
+    cuts = _split_points(segment, chunk_ms, silence_threshold_dbfs)
+    return [(_encode(segment[start:end], bitrate), f"{name}_{i}.ogg") for i, (start, end) in enumerate(zip(cuts, cuts[1:]))]
+
+
+class AudioPreprocessor:
+    """
+    Shrinks the voice notes before they are uploaded for transcription and splits the long ones
+    (see `prepare_audio`).
+    The work runs in a pool of worker processes, so decoding and encoding never block the event loop.
+    Notes that fail to process, or would not get smaller, are sent as they are. Needs ffmpeg.
+    """
+    def __init__(self, enabled: bool, workers: int):
+        self.available = shutil.which(AudioSegment.converter) is not None
+        self.enabled = enabled and self.available  # The splitting for the transcription only needs ffmpeg
+        if not self.available:
+            print("Audio pre-processing and splitting disabled, ffmpeg is not installed")
+        self.workers = workers
+        self.executor: Optional[ProcessPoolExecutor] = None
+
+    async def start(self):
+        """Starts the worker processes, so the first voice note does not wait for them."""
+        if not self.available or self.executor is not None:
+            return
+        # Spawned, not forked: the app process has threads and open connections
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, time.sleep, 0.1) for _ in range(self.workers)])
+
+    async def prepare(self, audio: bytes, filename: str, chunk_ms: int) -> List[Tuple[bytes, str]]:
+        """
+        Pre-processes the note and splits it into chunks of at most `chunk_ms` in one job (see
+        `prepare_audio`). Returns the original note, in a list of one, if that fails or a note
+        that is not split would not get smaller.
+        """
+        if not self.available or not (self.enabled or chunk_ms):
+            return [(audio, filename)]
+        await self.start()
+
+        start = time.perf_counter()
+        try:
+            chunks = await asyncio.get_running_loop().run_in_executor(
+                self.executor, prepare_audio, audio, filename, self.enabled, chunk_ms, settings.audio_silence_threshold_dbfs, settings.audio_bitrate
+            )
+        except Exception as e:
+            metrics.increment("audio_preprocess_failures")
+            print(f"Error pre-processing audio {filename}, sending it as is: {e}")
+            return [(audio, filename)]
+
+        metrics.increment("audio_preprocessed")
+        metrics.increment("audio_preprocess_ms", round((time.perf_counter() - start) * 1000))
+        if len(chunks) == 1 and len(chunks[0][0]) >= len(audio):
+            metrics.increment("audio_preprocess_kept_original")
+            chunks = [(audio, filename)]
+        if len(chunks) > 1:
+            metrics.increment("audio_chunks", len(chunks))
+        metrics.increment("audio_bytes_in", len(audio))
+        metrics.increment("audio_bytes_out", sum(len(chunk) for chunk, _ in chunks))
+        return chunks
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+# Global instance of the AudioPreprocessor
+audio_preprocessor = AudioPreprocessor(settings.audio_preprocess, settings.audio_preprocess_workers)
+
+def make_sample_corpus(directory: str) -> List[str]:
+    """
+    Writes synthetic voice notes (tones and noise between silences, 48 kHz stereo) to `directory`,
+    for when there is no corpus of real notes at hand.
+    """
+    from pydub.generators import Sine, WhiteNoise
+
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for seconds, extension, bitrate in [(5, "ogg", "64k"), (20, "ogg", "64k"), (60, "ogg", "32k"), (20, "mp3", "128k")]:
+        voice = AudioSegment.silent(duration=0, frame_rate=48000)
+        for i in range(seconds * 2):
+            tone = Sine(180 + 40 * (i % 5), sample_rate=48000).to_audio_segment(duration=350, volume=-18)
+            noise = WhiteNoise(sample_rate=48000).to_audio_segment(duration=350, volume=-35)
+            voice += tone.overlay(noise) + AudioSegment.silent(duration=150, frame_rate=48000)
+        note = AudioSegment.silent(duration=1500, frame_rate=48000) + voice + AudioSegment.silent(duration=2000, frame_rate=48000)
+        path = os.path.join(directory, f"sample_{seconds}s.{extension}")
+        note.set_channels(2).export(path, format=extension, codec="libopus" if extension == "ogg" else None, bitrate=bitrate)
+        paths.append(path)
+    return paths
+
+def benchmark(paths: List[str], uplink_mbps: float = 5.0, whisper: bool = False) -> List[Dict]:
+    """
+    Pre-processes every note and reports the bytes saved and the change of latency per note:
+    the processing time minus the upload time saved at `uplink_mbps`, or, with `whisper`,
+    the processing time plus the measured difference of the transcription calls.
+    """
+    results = []
+    for path in paths:
+        with open(path, "rb") as audio_file:
+            audio = audio_file.read()
+        filename = os.path.basename(path)
+        start = time.perf_counter()
+        [(processed, processed_filename)] = prepare_audio(audio, filename, True, 0, settings.audio_silence_threshold_dbfs, settings.audio_bitrate)
+        preprocess_ms = (time.perf_counter() - start) * 1000
+
+        if whisper:
+            from app.services.openai_service import transcribe_audio_with_whisper
+
+            async def transcription_ms(data: bytes, name: str) -> float:
+                start = time.perf_counter()
+                await transcribe_audio_with_whisper(data, name)
+                return (time.perf_counter() - start) * 1000
+            saved_ms = asyncio.run(transcription_ms(audio, filename)) - asyncio.run(transcription_ms(processed, processed_filename))
+        else:
+            saved_ms = (len(audio) - len(processed)) * 8 / (uplink_mbps * 1000)
+
+        results.append({
+            "note": filename,
+            "bytes_in": len(audio),
+            "bytes_out": len(processed),
+            "saved": round(1 - len(processed) / len(audio), 3),
+            "preprocess_ms": round(preprocess_ms, 1),
+            "latency_change_ms": round(preprocess_ms - saved_ms, 1),
+        })
+    return results
+
+if __name__ == "__main__":
+    # python -m app.services.audio_service [corpus dir] [--whisper]: bytes and latency saved per note
+    # (without a corpus dir, synthetic notes are written to audio_corpus/; --whisper calls the real API)
+    import sys
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    corpus = args[0] if args else "audio_corpus"
+    paths = sorted(os.path.join(corpus, name) for name in os.listdir(corpus)) if os.path.isdir(corpus) else make_sample_corpus(corpus)
+    print(f"{'note':<22}{'bytes in':>10}{'bytes out':>11}{'saved':>8}{'prep ms':>10}{'latency Δ ms':>14}")
+    for result in benchmark(paths, whisper="--whisper" in sys.argv):
+        print(f"{result['note']:<22}{result['bytes_in']:>10}{result['bytes_out']:>11}{result['saved']:>8.1%}"
+              f"{result['preprocess_ms']:>10}{result['latency_change_ms']:>14}")
@@ -0,0 +1,78 @@
+import asyncio
+from typing import Awaitable, Callable, Dict
+
+from app.core.config import settings
+
+
+class MessageCoalescer:
+    """
+    Merges the messages a user sends in a short burst into a single turn.
+    Every message restarts the user's window; when it closes the buffered messages
+    are joined and the handler runs once. All the callers of the burst get the same result.
+    Turns of the same user run one after the other, so the session history keeps its order.
+    """
+    def __init__(self, window_ms: int, max_wait_ms: int):
+        self.window = window_ms / 1000
+        self.max_wait = max_wait_ms / 1000
+        self._buffers: Dict[str, dict] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+
+    async def submit(self, user_id: str, message: str, handler: Callable[[str], Awaitable[dict]]) -> dict:
+        """Buffers a message and waits for the result of the merged turn."""
+        if self.window <= 0:
+            return await handler(message)
+        return await self.enqueue(user_id, message, handler)
+
+    def enqueue(self, user_id: str, message: str, handler: Callable[[str], Awaitable[dict]]) -> asyncio.Future:
+        """Buffers a message and returns a future with the result of the merged turn, without waiting for it."""
+        loop = asyncio.get_running_loop()
+        if self.window <= 0:
+            return asyncio.ensure_future(handler(message))
+
+        buffer = self._buffers.get(user_id)
+        if buffer is None:
+            buffer = {
+                "messages": [],
+                "future": loop.create_future(),
+                "timer": None,
+                "deadline": loop.time() + self.max_wait,
+                "handler": handler
+            }
+            self._buffers[user_id] = buffer
+
+        buffer["messages"].append(message)
+
+        # Restart the window, but never wait past the deadline of the first message
+        if buffer["timer"]:
+            buffer["timer"].cancel()
+        delay = min(self.window, max(buffer["deadline"] - loop.time(), 0))
+        buffer["timer"] = loop.call_later(delay, self._flush, user_id)
+
+        # Shielded: a caller that stops waiting does not cancel the turn of the others
+        return asyncio.shield(buffer["future"])
+
+    def _flush(self, user_id: str):
+        """Closes the user's window and runs the merged turn."""
+        buffer = self._buffers.pop(user_id, None)
+        if buffer is None:
+            return
+
+        previous = self._running.get(user_id)
+        task = asyncio.create_task(self._run(buffer, previous))
+        self._running[user_id] = task
+        task.add_done_callback(lambda done: self._running.pop(user_id, None) if self._running.get(user_id) is done else None)
+
+    async def _run(self, buffer: dict, previous: asyncio.Task = None):
+        # Wait for the previous turn of the same user to finish
+        if previous:
+            await asyncio.wait([previous])
+
+        merged_message = "\n".join(buffer["messages"])
+        try:
+            result = await buffer["handler"](merged_message)
+            buffer["future"].set_result(result)
+        except Exception as e:
+            buffer["future"].set_exception(e)
+
+# Global instance of the MessageCoalescer
+message_coalescer = MessageCoalescer(settings.coalesce_window_ms, settings.coalesce_max_wait_ms)
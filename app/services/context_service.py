@@ -0,0 +1,86 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+# Words and single punctuation marks, the units the estimation is based on
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+# Tokens the chat format adds around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of a text without calling any tokenizer service.
+    Every word counts as one token per 4 characters (rounded up) and every punctuation mark as one.
+    """
+    return sum((len(piece) + 3) // 4 for piece in TOKEN_PATTERN.findall(text))
+
+def count_message_tokens(message: Dict[str, str]) -> int:
+    """Estimates the tokens of a chat message, including the format overhead."""
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+def split_history(history: List[Dict[str, str]]) -> Tuple[Optional[str], List[Dict[str, str]]]:
+    """Splits the session history into the initial prompt and the conversation turns."""
+    system_prompt = None
+    turns = []
+    for entry in history:
+        if "user" in entry and "bot" in entry:
+            turns.append(entry)
+        elif "bot" in entry and system_prompt is None:  # Initial prompt of the session
+            system_prompt = entry["bot"]
+
+    return system_prompt, turns
+
+def turn_messages(turn: Dict[str, str]) -> List[Dict[str, str]]:
+    """Converts a history turn into chat messages."""
+    return [
+        {"role": "user", "content": turn["user"]},
+        {"role": "assistant", "content": turn["bot"]},
+    ]
+
+def summary_message(summary: str) -> Dict[str, str]:
+    """Chat message carrying the rolling summary of the folded turns."""
+    return {"role": "system", "content": f"Resumen de la conversación anterior con este cliente:\n{summary}"}
+
+def build_context(system_prompt: str, turns: List[Dict[str, str]], summary: Optional[str], user_message: str, budget: int, keep_turns: int) -> List[Dict[str, str]]:
+    """
+    Builds the chat messages within a token budget.
+    The system prompt, the rolling summary, the last `keep_turns` turns and the new
+    message are always sent; older turns are added, newest first, while they fit.
+    """
+    head = [{"role": "system", "content": system_prompt}]
+    if summary:
+        head.append(summary_message(summary))
+    tail = {"role": "user", "content": user_message}
+
+    remaining = budget - sum(count_message_tokens(message) for message in head) - count_message_tokens(tail)
+    window = []
+    for position, turn in enumerate(reversed(turns)):
+        messages = turn_messages(turn)
+        cost = sum(count_message_tokens(message) for message in messages)
+        if position >= keep_turns and cost > remaining:
+            break
+
+        window = messages + window
+        remaining -= cost
+
+    return head + window + [tail]
+
+def select_turns_to_fold(system_prompt: str, turns: List[Dict[str, str]], summary: Optional[str], budget: int, keep_turns: int) -> int:
+    """
+    Returns how many of the oldest turns should be folded into the summary:
+    none while the whole conversation fits the budget, otherwise all but the last `keep_turns`.
+    """
+    if len(turns) <= keep_turns:
+        return 0
+
+    total = count_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+    if summary:
+        total += count_message_tokens(summary_message(summary))
+    for turn in turns:
+        total += sum(count_message_tokens(message) for message in turn_messages(turn))
+
+    if total <= budget:
+        return 0
+
+    return len(turns) - keep_turns
@@ -0,0 +1,190 @@
+import json
+import unicodedata
+from typing import Dict, List, Optional
+
+from app.core.config import settings
+
+
+def normalize_name(name: str) -> str:
+    """
+    Normalizes a menu name for lookups: lowercase, without accents and with single spaces.
+    Example: "  Hamburguesa  Clásica" -> "hamburguesa clasica"
+    """
+    decomposed = unicodedata.normalize("NFKD", name)
+    without_accents = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(without_accents.lower().split())
+
+
+class MenuCatalog:
+    """
+    In-memory menu of the restaurant: categories, items, extras and availability,
+    indexed by normalized name.
+    """
+    def __init__(self, menu: Dict):
+        self.categories: Dict[str, Dict] = {}
+        self.items: Dict[str, Dict] = {}
+
+        for category in menu.get("categories", []):
+            items = []
+            for raw_item in category.get("items", []):
+                item = {
+                    "name": raw_item["name"],
+                    "category": category["name"],
+                    "ingredients": raw_item.get("ingredients", ""),
+                    "price": raw_item["price"],
+                    "allergens": raw_item.get("allergens", []),
+                    "available": raw_item.get("available", True),
+                    "extras": {
+                        normalize_name(extra["name"]): {
+                            "name": extra["name"],
+                            "price": extra["price"],
+                            "available": extra.get("available", True)
+                        }
+                        for extra in raw_item.get("extras", [])
+                    }
+                }
+                items.append(item)
+                self.items[normalize_name(item["name"])] = item
+
+            self.categories[normalize_name(category["name"])] = {"name": category["name"], "items": items}
+
+    @classmethod
+    def from_json(cls, menu_json: str) -> "MenuCatalog":
+        return cls(json.loads(menu_json))
+
+    def list_categories(self) -> List[Dict]:
+        """Returns the categories with the number of available items."""
+        return [
+            {"name": category["name"], "available_items": sum(1 for item in category["items"] if item["available"])}
+            for category in self.categories.values()
+        ]
+
+    def get_category(self, name: str) -> Optional[Dict]:
+        return self.categories.get(normalize_name(name))
+
+    def get_item(self, name: str) -> Optional[Dict]:
+        return self.items.get(normalize_name(name))
+
+    def find_items(self, query: str) -> List[Dict]:
+        """Returns the item with that exact name, or else every item whose name contains the query."""
+        item = self.get_item(query)
+        if item:
+            return [item]
+
+        normalized_query = normalize_name(query)
+        return [item for name, item in self.items.items() if normalized_query in name]
+
+    def get_extra(self, item_name: str, extra_name: str) -> Optional[Dict]:
+        item = self.get_item(item_name)
+        if not item:
+            return None
+        return item["extras"].get(normalize_name(extra_name))
+
+
+def describe_item(item: Dict) -> Dict:
+    """Item as it is shown to the model."""
+    return {
+        "name": item["name"],
+        "category": item["category"],
+        "ingredients": item["ingredients"],
+        "price": item["price"],
+        "allergens": item["allergens"],
+        "available": item["available"],
+        "extras": list(item["extras"].values())
+    }
+
+# Tool definitions the model can call to look up the menu
+MENU_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "list_menu_categories",
+            "description": "Lista las categorías del menú (bebidas, entrantes, hamburguesas...).",
+            "parameters": {"type": "object", "properties": {}, "additionalProperties": False}
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_category_items",
+            "description": "Devuelve los platos o bebidas de una categoría con sus ingredientes, precio, alérgenos, disponibilidad y extras.",
+            "parameters": {
+                "type": "object",
+                "properties": {"category": {"type": "string", "description": "Nombre de la categoría"}},
+                "required": ["category"],
+                "additionalProperties": False
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "find_menu_item",
+            "description": "Busca un plato o bebida por su nombre (o parte del nombre) y devuelve sus datos.",
+            "parameters": {
+                "type": "object",
+                "properties": {"name": {"type": "string", "description": "Nombre del plato o bebida"}},
+                "required": ["name"],
+                "additionalProperties": False
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "check_extra",
+            "description": "Comprueba si un extra se puede añadir a un plato y devuelve su precio.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "item": {"type": "string", "description": "Nombre del plato"},
+                    "extra": {"type": "string", "description": "Nombre del extra"}
+                },
+                "required": ["item", "extra"],
+                "additionalProperties": False
+            }
+        }
+    }
+]
+
+def run_menu_tool(catalog: MenuCatalog, name: str, arguments: str) -> Dict:
+    """
+    Runs a menu tool called by the model and returns its result.
+    """
+    try:
+        args = json.loads(arguments or "{}")
+    except json.JSONDecodeError:
+        return {"error": "Argumentos no válidos"}
+
+    if name == "list_menu_categories":
+        return {"categories": catalog.list_categories()}
+
+    if name == "get_category_items":
+        category = catalog.get_category(args.get("category", ""))
+        if not category:
+            return {"error": "Categoría no encontrada", "categories": [c["name"] for c in catalog.list_categories()]}
+        return {"category": category["name"], "items": [describe_item(item) for item in category["items"]]}
+
+    if name == "find_menu_item":
+        items = catalog.find_items(args.get("name", ""))
+        if not items:
+            return {"error": "No está en el menú"}
+        return {"items": [describe_item(item) for item in items]}
+
+    if name == "check_extra":
+        item = catalog.get_item(args.get("item", ""))
+        if not item:
+            return {"valid": False, "reason": "El plato no está en el menú"}
+        if not item["available"]:
+            return {"valid": False, "reason": "Ese plato no está disponible ahora"}
+        extra = item["extras"].get(normalize_name(args.get("extra", "")))
+        if not extra:
+            return {"valid": False, "reason": "Ese extra no está disponible para este plato", "extras": list(item["extras"].values())}
+        if not extra["available"]:
+            return {"valid": False, "reason": "Ese extra no está disponible ahora"}
+        return {"valid": True, "item": item["name"], "extra": extra["name"], "price": extra["price"]}
+
+    return {"error": f"Herramienta desconocida: {name}"}
+
+# Global instance of the MenuCatalog
+menu_catalog = MenuCatalog.from_json(settings.MENU_JSON)
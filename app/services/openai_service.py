@@ -1,39 +1,71 @@
-import os
-import time
+import asyncio
+import json
+import httpx
 import openai
-import requests
 
-from typing import Dict, Optional
+from types import SimpleNamespace
+
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 from urllib.parse import urlencode
 from fastapi import HTTPException
-from requests.auth import HTTPBasicAuth
+from pydantic import ValidationError
 
 from app.core.config import settings
 from app.routes.payment_routes import create_payment_link
-from app.services.order_parser_service import parse_bot_message_redsys
-from app.services.session_service import session_manager
-from app.services.twilio_service import TwilioService
+from app.services.context_service import build_context, select_turns_to_fold, split_history
+from app.services.menu_service import MENU_TOOLS, menu_catalog, run_menu_tool
+from app.services.order_parser_service import ORDER_TOOL, StructuredOrder, build_order_data, parse_bot_message_redsys
+from app.services.outbound_service import outbound_dispatcher
+from app.services.pricing_service import format_corrections, pricing_engine
+from app.services.prompt_service import prompt_registry
+from app.services.response_cache_service import response_cache
+from app.services.session_service import BLOCKED_MESSAGE, session_manager
+from app.services.stream_service import PARAGRAPH_SEPARATOR, ParagraphStream
+from app.shared.metrics import metrics
 
 openai.api_key = settings.openai_api_key
-client = openai.Client(
+client = openai.AsyncOpenAI(
     api_key=settings.openai_api_key,
 )
 
-def build_prompt(history: list[dict], user_message: str) -> str:
+# Pooled client for the voice notes hosted by Twilio; their URLs redirect to the media storage
+media_client = httpx.AsyncClient(
+    auth=(settings.twilio_account_sid, settings.twilio_auth_token),
+    follow_redirects=True,
+    timeout=settings.audio_download_timeout_seconds,
+    limits=httpx.Limits(max_connections=settings.audio_download_max_connections)
+)
+
+# File extension of the voice note formats, so Whisper knows what it gets
+AUDIO_EXTENSIONS = {"audio/ogg": "ogg", "audio/mpeg": "mp3", "audio/mp4": "m4a", "audio/wav": "wav", "audio/webm": "webm"}
+
+# Background tasks kept referenced until they finish
+background_tasks = set()
+
+# Max rounds of tool calls in a single turn
+MAX_TOOL_ROUNDS = 5
+
+# Tools offered to the model: menu lookups and the final order
+CHAT_TOOLS = MENU_TOOLS + [ORDER_TOOL]
+
+def build_prompt(history: list[dict], user_message: str, summary: Optional[str] = None, summarized_count: int = 0, prompt_id: Optional[str] = None) -> list[dict]:
     """
-    # Build the prompt using the history and the user's message
+    Build the chat messages using the history and the user's message.
+    The restaurant prompt goes first as an unchanged system message, so every turn
+    shares the same prefix and the provider can reuse its prompt cache.
+    Turns already folded into the summary are replaced by it, and the rest are
+    windowed to the configured token budget.
+    The prompt text is resolved from its version ID, unless an old session still stores a copy.
     """
-    lines = []
-    for entry in history:
-        # Verify if the entry has both user and bot messages
-        if "user" in entry and "bot" in entry:
-            lines.append(f"Usuario: {entry['user']}\nBot: {entry['bot']}")
-        elif "bot" in entry:  # Only bot messages 
-            lines.append(entry["bot"])
-
-    # Add the user's message
-    lines.append(f"Usuario: {user_message}\nBot:")
-    return "\n".join(lines)
+    system_prompt, turns = split_history(history)
+    return build_context(
+        system_prompt or prompt_registry.resolve(prompt_id),
+        turns[summarized_count:],
+        summary,
+        user_message,
+        settings.context_token_budget,
+        settings.context_keep_turns
+    )
 
 def validate_history(history: list[dict]) -> bool:
     """
@@ -48,24 +80,264 @@ def validate_history(history: list[dict]) -> bool:
     
     return True
 
-def generate_response(prompt: str):
+async def _as_result(value):
+    """
+    Wrap an already known value so it can be gathered with other coroutines
+    """
+    return value
+
+def record_usage(usage) -> None:
+    """
+    Record the prompt tokens served from the provider cache and the uncached ones
+    """
+    if usage is None:
+        return
+    
+    details = usage.prompt_tokens_details
+    cached_tokens = (details.cached_tokens or 0) if details else 0
+    metrics.increment("openai_requests")
+    metrics.increment("openai_prompt_tokens", usage.prompt_tokens)
+    metrics.increment("openai_cached_prompt_tokens", cached_tokens)
+    metrics.increment("openai_uncached_prompt_tokens", usage.prompt_tokens - cached_tokens)
+    metrics.increment("openai_completion_tokens", usage.completion_tokens)
+
+def run_tool(tool_call, submitted_orders: list) -> dict:
     """
-    Generate a response from the OpenAI API
+    Answer a tool call of the model. Valid orders sent with submit_order are collected in `submitted_orders`.
     """
+    if tool_call.function.name != ORDER_TOOL["function"]["name"]:
+        return run_menu_tool(menu_catalog, tool_call.function.name, tool_call.function.arguments)
+    
     try:
-        response = openai.chat.completions.create(
+        order = StructuredOrder.model_validate_json(tool_call.function.arguments)
+    except ValidationError as e:
+        return {"error": f"Pedido no válido: {e.errors(include_url=False)}"}
+    
+    submitted_orders.append(order)
+    return {"status": "ok", "message": "Pedido registrado. Muestra ahora el resumen del pedido al cliente."}
+
+async def generate_response(messages: list[dict]) -> Tuple[str, Optional[StructuredOrder]]:
+    """
+    Generate a response from the OpenAI API.
+    The model looks up the menu through tool calls, which are answered from the
+    menu catalog until it writes the final reply. When the order is finished the
+    model also submits it as a structured object, which is returned with the reply.
+    """
+    submitted_orders = []
+    try:
+        messages = list(messages)
+        for _ in range(MAX_TOOL_ROUNDS):
+            response = await client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                tools=CHAT_TOOLS,
+            )
+            record_usage(response.usage)
+            
+            reply = response.choices[0].message
+            if not reply.tool_calls:
+                return reply.content, (submitted_orders[-1] if submitted_orders else None)
+            
+            # Answer the menu lookups and let the model continue
+            messages.append({
+                "role": "assistant",
+                "content": reply.content,
+                "tool_calls": [tool_call.model_dump() for tool_call in reply.tool_calls],
+            })
+            for tool_call in reply.tool_calls:
+                result = run_tool(tool_call, submitted_orders)
+                messages.append({
+                    "role": "tool",
+                    "tool_call_id": tool_call.id,
+                    "content": json.dumps(result, ensure_ascii=False),
+                })
+        
+        # Too many lookups, force a final answer
+        response = await client.chat.completions.create(
             model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant."},
-                {"role": "user", "content": prompt},
-            ],
+            messages=messages,
+            tools=CHAT_TOOLS,
+            tool_choice="none",
         )
+        record_usage(response.usage)
 
-        return response.choices[0].message.content
+        return response.choices[0].message.content, (submitted_orders[-1] if submitted_orders else None)
     except Exception as e:
-        return f"Error: {e}"
+        return f"Error: {e}", None
     
-def process_incoming_message(user_id: str, message: str, session_id: Optional[str] = None) -> Dict[str, str]:
+async def summarize_turns(summary: Optional[str], turns: list[dict]) -> str:
+    """
+    Fold conversation turns into the rolling summary of the session
+    """
+    conversation = "\n".join(f"Cliente: {turn['user']}\nCamarero: {turn['bot']}" for turn in turns)
+    response = await client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {
+                "role": "system",
+                "content": (
+                    "Resume la conversación entre un camarero y un cliente para poder continuarla. "
+                    "Conserva el número de mesa, los platos, bebidas, extras, exclusiones y cantidades pedidos "
+                    "o descartados, y cualquier preferencia del cliente. Responde solo con el resumen, en menos de 150 palabras."
+                ),
+            },
+            {"role": "user", "content": f"Resumen anterior:\n{summary or '-'}\n\nNuevos mensajes:\n{conversation}"},
+        ],
+    )
+    record_usage(response.usage)
+    
+    return response.choices[0].message.content
+
+async def update_rolling_summary(session_id: str, summary: Optional[str], summarized_count: int, turns: list[dict]):
+    """
+    Fold the given turns, which follow the already summarized ones, into the session summary
+    """
+    try:
+        new_summary = await summarize_turns(summary, turns)
+        await session_manager.update_summary(session_id, new_summary, summarized_count + len(turns), summarized_count)
+    except Exception as e:
+        print(f"Error updating the summary of session {session_id}: {e}")
+
+def build_payment_url(order_data: dict, user_id: str) -> str:
+    """
+    Build the payment form link of an order
+    """
+    # Params for the payment link
+    params = {
+        "order_id": order_data.get("order_id"),  # Extrae el ID del pedido
+        "amount": float(order_data.get("total", 0)),  # Extrae el total, asegurándose de que sea float
+        "user_id": user_id
+    }
+    
+    # Generate the payment link
+    base_url = f"{settings.url_local.rstrip('/')}/payment/payment-form"
+    query_string = urlencode(params)      
+    return f"{base_url}?{query_string}"
+
+async def prepare_order(order_data: dict, user_id: str, session_id: str) -> Tuple[Optional[dict], Optional[str], list]:
+    """
+    Check the order against the menu, store it in the session and build its payment link.
+    Returns the priced order (None if nothing valid is left), the payment link and the corrections made.
+    """
+    # Check the order against the menu and recompute the prices instead of trusting the model
+    order_data, corrections = pricing_engine.price_order(order_data)
+    if not order_data["dishes"] and not order_data["drinks"]:
+        return None, None, corrections
+    
+    # Add user phone number to the order data
+    order_data["user_id"] = user_id
+    
+    # Add the order data to the session
+    await session_manager.add_order_data(session_id, order_data)
+    
+    return order_data, build_payment_url(order_data, user_id), corrections
+
+async def stream_response(messages: list[dict], paragraphs: ParagraphStream, user_id: str, session_id: str) -> Tuple[str, Optional[asyncio.Task]]:
+    """
+    Generate a response from the OpenAI API as a stream, feeding the text to `paragraphs`
+    so every paragraph is sent as soon as it is complete.
+    The order is prepared (priced, stored and linked to a payment URL) in a task started as
+    soon as the model submits it, or as soon as the items of a summary written without
+    submit_order are complete, while the rest of the reply is still streaming.
+    Returns the full reply and that task, if any.
+    """
+    order_task = None
+    messages = list(messages)
+    
+    try:
+        for round_number in range(MAX_TOOL_ROUNDS + 1):
+            stream = await client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                tools=CHAT_TOOLS,
+                tool_choice="none" if round_number == MAX_TOOL_ROUNDS else "auto",
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            
+            content = ""
+            tool_calls = {}
+            # Text of the round held back until it is a whole paragraph: a short preamble of a tool call
+            # ("voy a mirar la carta") is dropped with the round, like generate_response does
+            held = ""
+            streaming = False
+            async for chunk in stream:
+                if chunk.usage:
+                    record_usage(chunk.usage)
+                if not chunk.choices:
+                    continue
+                
+                delta = chunk.choices[0].delta
+                for tool_call in delta.tool_calls or []:
+                    call = tool_calls.setdefault(tool_call.index, {"id": "", "name": "", "arguments": ""})
+                    call["id"] = tool_call.id or call["id"]
+                    if tool_call.function:
+                        call["name"] += tool_call.function.name or ""
+                        call["arguments"] += tool_call.function.arguments or ""
+                
+                if delta.content:
+                    content += delta.content
+                    if streaming:
+                        paragraphs.feed(delta.content)
+                    else:
+                        held += delta.content
+                        if PARAGRAPH_SEPARATOR in held and not tool_calls:
+                            paragraphs.feed(held)
+                            held, streaming = "", True
+                    
+                    # The summary was written without submit_order: prepare it as soon as its items are complete
+                    summary = paragraphs.completed_summary() if order_task is None else None
+                    if summary:
+                        order_task = asyncio.create_task(prepare_order(parse_bot_message_redsys(summary), user_id, session_id))
+            
+            if not tool_calls:
+                paragraphs.feed(held)
+                
+                # The stream ended before the closing divider of the summary
+                if order_task is None and paragraphs.summary_started:
+                    order_task = asyncio.create_task(prepare_order(parse_bot_message_redsys(paragraphs.text), user_id, session_id))
+                return paragraphs.text, order_task
+            
+            # Text already sent in this round stays; the text of the next round starts a paragraph of its own
+            if streaming:
+                paragraphs.end_paragraph()
+            
+            # Answer the tool calls and let the model continue
+            messages.append({
+                "role": "assistant",
+                "content": content or None,
+                "tool_calls": [
+                    {"id": call["id"], "type": "function", "function": {"name": call["name"], "arguments": call["arguments"]}}
+                    for call in tool_calls.values()
+                ],
+            })
+            for call in tool_calls.values():
+                submitted_orders = []
+                tool_call = SimpleNamespace(id=call["id"], function=SimpleNamespace(name=call["name"], arguments=call["arguments"]))
+                result = run_tool(tool_call, submitted_orders)
+                messages.append({
+                    "role": "tool",
+                    "tool_call_id": call["id"],
+                    "content": json.dumps(result, ensure_ascii=False),
+                })
+                
+                # Start preparing the order while the summary is streamed
+                if submitted_orders:
+                    if order_task is not None:
+                        order_task.cancel()
+                    order_task = asyncio.create_task(prepare_order(build_order_data(submitted_orders[-1]), user_id, session_id))
+    
+    except Exception as e:
+        if order_task is not None:
+            order_task.cancel()
+        
+        # Nothing was sent yet: answer with the error like the non streaming flow
+        if not paragraphs.sent_paragraphs:
+            paragraphs.pending = paragraphs.text = f"Error: {e}"
+            return paragraphs.text, None
+        raise
+
+async def process_incoming_message(user_id: str, message: str, session_id: Optional[str] = None) -> Dict[str, str]:
     """
     Orchestrates the entire message flow:
     1. Obtain/create the session.
@@ -76,65 +348,114 @@ def process_incoming_message(user_id: str, message: str, session_id: Optional[st
     6. Return the necessary data for the endpoint.
     """
     try:
+        # Look up the active session and check the message limit concurrently
+        existing_session_id, rate_limit = await asyncio.gather(
+            session_manager.get_session_by_user(user_id) if not session_id else _as_result(session_id),
+            session_manager.check_rate_limit(user_id),
+        )
+        
+        # Blocked users get the notice right away, without calling the model, once per block
+        if not rate_limit.allowed:
+            if rate_limit.notify:
+                try:
+                    await outbound_dispatcher.send(user_id, BLOCKED_MESSAGE)
+                except Exception as twilio_error:
+                    raise HTTPException(status_code=500, detail=f"Error sending error message: {twilio_error}")
+            raise HTTPException(status_code=429, detail="Message limit exceeded or user is blocked")
+        
+        # The conversation starts over after a few minutes without messages
+        if existing_session_id:
+            idle_seconds = await session_manager.get_idle_seconds(existing_session_id)
+            if idle_seconds is None or idle_seconds > session_manager.idle_reset_seconds:
+                await session_manager.clear_session(existing_session_id, archive_reason="idle_reset")
+        
         # Get the active session ID or create a new one
-        active_session_id = session_id or session_manager.get_session_by_user(user_id)
+        active_session_id = existing_session_id
         if not active_session_id:
-            active_session_id = session_manager.create_session(user_id)
-        
-        # Check if the user is within the message limit
-        within_limit, message_count = session_manager.is_within_limit(user_id)
+            active_session_id = await session_manager.create_session(user_id)
         
         # Validate the session history
-        history = session_manager.get_session(active_session_id)
+        history, (summary, summarized_count), prompt_id = await asyncio.gather(
+            session_manager.get_session(active_session_id),
+            session_manager.get_summary(active_session_id),
+            session_manager.get_prompt_id(active_session_id),
+        )
         if not validate_history(history):
             raise HTTPException(status_code=400, detail="Invalid session history")
         
         # Initialize the payment link
         payment_url = None
+        order_task = None
+        paragraphs = None
 
-        # Build the prompt and generate the response
-        prompt = build_prompt(history, message)
-        bot_response = generate_response(prompt)
+        # Menu and FAQ questions are answered from the cache when possible
+        _, turns = split_history(history)
+        stage = "welcome" if not turns and not summarized_count else "ordering"
+        cache_key = response_cache.make_key(message, stage)
+        cached_response = await response_cache.get(cache_key) if cache_key else None
         
-        # Check if the bot response contains the order summary
-        if "Resumen del Pedido:" in bot_response:
-            # Parse the order data from the bot response
-            order_data = parse_bot_message_redsys(bot_response)
-            
-            # Add user phone number to the order data
-            order_data["user_id"] = user_id
-            
-            # Add the order data to the session
-            session_manager.add_order_data(active_session_id, order_data)
-            
-            # Extract the order ID and total
-            order_id = order_data.get("order_id")  # Extrae el ID del pedido
-            amount = float(order_data.get("total", 0))  # Extrae el total, asegurándose de que sea float
-
-            # Params for the payment link
-            params = {
-                "order_id": order_id,
-                "amount": amount,
-                "user_id": user_id
-            }
-            
-            # Generate the payment link
-            base_url = f"{settings.url_local.rstrip('/')}/payment/payment-form"
-            query_string = urlencode(params)      
-            payment_url = f"{base_url}?{query_string}"
+        if cached_response is not None:
+            bot_response, structured_order = cached_response, None
+        elif settings.stream_responses:
+            # Stream the reply, sending every paragraph as soon as it is complete
+            messages = build_prompt(history, message, summary, summarized_count, prompt_id)
+            paragraphs = ParagraphStream(lambda text: outbound_dispatcher.send(user_id, text))
+            try:
+                bot_response, order_task = await stream_response(messages, paragraphs, user_id, active_session_id)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Error sending message: {e}")
+            structured_order = None
+        else:
+            # Build the prompt and generate the response
+            messages = build_prompt(history, message, summary, summarized_count, prompt_id)
+            bot_response, structured_order = await generate_response(messages)
+        
+        # Cache the reply unless it carries an order or an error
+        if cache_key and cached_response is None and structured_order is None and order_task is None \
+                and "Resumen del Pedido" not in bot_response and not bot_response.startswith("Error:"):
+            await response_cache.set(cache_key, bot_response)
+        
+        # Build the order data from the structured order submitted by the model
+        if order_task is None:
+            if structured_order is not None:
+                order_task = prepare_order(build_order_data(structured_order), user_id, active_session_id)
+            elif "Resumen del Pedido:" in bot_response:
+                # Fallback: the model wrote the summary without submitting the order
+                order_task = prepare_order(parse_bot_message_redsys(bot_response), user_id, active_session_id)
+        
+        corrections_message = None
+        if order_task is not None:
+            order_data, payment_url, corrections = await order_task
+            if corrections:
+                corrections_message = format_corrections(corrections, order_data or {})
+                bot_response += "\n\n" + corrections_message
             
         try:
-            TwilioService().send_whatsapp_message(user_id, bot_response)
+            # Queue every message of the turn before waiting, so the dispatcher can merge them
+            if paragraphs is not None:
+                # Send the rest of the streamed reply, after the paragraphs already sent
+                await paragraphs.finish(corrections_message)
+                reply_sent = None
+            else:
+                reply_sent = outbound_dispatcher.enqueue(user_id, bot_response)
             
-            # Check if the user has less than 10 messages left
-            if message_count >= session_manager.max_messages_per_hour - 5:
-                warning_message = f"Te quedan {session_manager.max_messages_per_hour - message_count} mensajes antes de alcanzar el límite. El limite se puede reestablecer finalizando una compra o en el lapso de una hora."
-                TwilioService().send_whatsapp_message(user_id, warning_message)
+            # Check if the user has less than 5 messages left
+            warning_sent = None
+            if rate_limit.remaining < 5:
+                warning_message = f"Te quedan {rate_limit.remaining} mensajes antes de alcanzar el límite. El limite se puede reestablecer finalizando una compra o en el lapso de una hora."
+                warning_sent = outbound_dispatcher.enqueue(user_id, warning_message)
             
+            payment_sent = None
             if payment_url is not None:
                 payment_message = f"Puedes pagar tu pedido en el siguiente enlace: \n\n{payment_url}"
+                payment_sent = outbound_dispatcher.enqueue(user_id, payment_message)
+            
+            for sent in (reply_sent, warning_sent):
+                if sent is not None:
+                    await sent
+            if payment_sent is not None:
                 try:
-                    TwilioService().send_whatsapp_message(user_id, payment_message)
+                    await payment_sent
                 except Exception as e:
                     raise HTTPException(status_code=500, detail=f"Error sending payment link: {e}")
             
@@ -143,18 +464,33 @@ def process_incoming_message(user_id: str, message: str, session_id: Optional[st
 
         try:
             # Add the message to the session
-            session_manager.add_to_session(active_session_id, user_id, message, bot_response)
+            await session_manager.add_to_session(active_session_id, user_id, message, bot_response)
         except ValueError as e:
             # Send an error message to the user via Twilio
             error_message = str(e)
             try:
-                TwilioService().send_whatsapp_message(user_id, error_message)
+                await outbound_dispatcher.send(user_id, error_message)
                 
             except Exception as twilio_error:
                 raise HTTPException(status_code=500, detail=f"Error sending error message: {twilio_error}")
             
             raise HTTPException(status_code=400, detail=str(e))
 
+        # Fold the oldest turns into the summary once the conversation outgrows the token budget
+        system_prompt, turns = split_history(history)
+        pending_turns = turns[summarized_count:] + [{"user": message, "bot": bot_response}]
+        fold_count = select_turns_to_fold(
+            system_prompt or prompt_registry.resolve(prompt_id),
+            pending_turns,
+            summary,
+            settings.context_token_budget,
+            settings.context_keep_turns
+        )
+        if fold_count:
+            task = asyncio.create_task(update_rolling_summary(active_session_id, summary, summarized_count, pending_turns[:fold_count]))
+            background_tasks.add(task)
+            task.add_done_callback(background_tasks.discard)
+
         # Return the session ID and the bot response
         return {
             "session_id": active_session_id,
@@ -167,7 +503,7 @@ def process_incoming_message(user_id: str, message: str, session_id: Optional[st
     except Exception as e:
         raise HTTPException(status_code=500, detail="Internal server error")
     
-def manage_payment_link_stripe(bot_response: str, session_id: str, order_data: dict, user_id: str) -> str:
+async def manage_payment_link_stripe(bot_response: str, session_id: str, order_data: dict, user_id: str) -> str:
     """
     Manage the payment link in the bot response
     """
@@ -177,73 +513,90 @@ def manage_payment_link_stripe(bot_response: str, session_id: str, order_data: d
     bot_response = "\n".join([line for line in lines if payment_link_prefix not in line])
 
     # Obtener el enlace existente en la sesión
-    existing_payment_link = session_manager.get_payment_link(session_id)
+    existing_payment_link = await session_manager.get_payment_link(session_id)
     if existing_payment_link:
-        session_manager.clear_payment_link(session_id)
+        await session_manager.clear_payment_link(session_id)
 
     # Crear un nuevo enlace de pago
-    payment_link_response = create_payment_link(order_data, user_id, session_id)
-    session_manager.add_payment_link(session_id, payment_link_response["url"])
+    payment_link_response = await create_payment_link(order_data, user_id, session_id)
+    await session_manager.add_payment_link(session_id, payment_link_response["url"])
 
     # Agregar el nuevo enlace al bot_response
     bot_response += f"\n\nPuedes pagar tu pedido en el siguiente enlace: {payment_link_response['url']}"
     
     return bot_response
 
-async def download_audio_from_twilio(media_url: str, user_id: str) -> str:
+async def download_audio_from_twilio(media_url: str, user_id: str) -> Tuple[bytes, str]:
     """
-    Downloads an audio file from Twilio's MediaUrl and saves it in a specific directory within the project.
+    Downloads an audio file from Twilio's MediaUrl into memory, streaming it up to `settings.audio_max_bytes`.
+    Nothing is written to disk, so concurrent requests never share files.
     :param media_url: URL of the audio file.
-    :return: Path to the downloaded file.
+    :return: The audio and a file name with its format, for the transcription.
     """
     try:
-        response = requests.get(
-            media_url,
-            auth=HTTPBasicAuth(settings.twilio_account_sid, settings.twilio_auth_token)
-        )
-        response.raise_for_status()
-        
-        # Define the directory to save the audio files
-        audio_dir = os.path.join(os.path.dirname(__file__), 'audio_files')
-        os.makedirs(audio_dir, exist_ok=True)
-        
-        # Define the file path
-        user_id_just_numbers = user_id.replace("whatsapp:+", "")
-        unique_filename = f"downloaded_audio_{user_id_just_numbers}_{int(time.time())}.mp3"
-        file_path = os.path.join(audio_dir, unique_filename)
-        
-        try:
-            # Save the file
-            with open(file_path, 'wb') as audio_file:
-                audio_file.write(response.content)
+        async with media_client.stream("GET", media_url) as response:
+            response.raise_for_status()
+            
+            # Reject oversized notes before reading them when the size is announced
+            content_length = int(response.headers.get("Content-Length") or 0)
+            if content_length > settings.audio_max_bytes:
+                raise HTTPException(status_code=413, detail=f"Audio too large: {content_length} bytes")
+            
+            audio = bytearray()
+            async for chunk in response.aiter_bytes():
+                audio += chunk
+                if len(audio) > settings.audio_max_bytes:
+                    raise HTTPException(status_code=413, detail=f"Audio larger than {settings.audio_max_bytes} bytes")
             
-            return file_path
+            content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
         
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error saving audio file: {e}")
+        user_id_just_numbers = user_id.replace("whatsapp:+", "")
+        filename = f"voice_note_{user_id_just_numbers}.{AUDIO_EXTENSIONS.get(content_type, 'ogg')}"
+        metrics.increment("audio_downloaded_bytes", len(audio))
+        return bytes(audio), filename
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error downloading audio from twilio: {e}")
         
-async def transcribe_audio_with_whisper(audio_path: str) -> str:
+async def transcribe_audio_with_whisper(audio: bytes, filename: str) -> str:
     """
-    Transcribe the audio file using OpenAI's Whisper API.
-    :param audio_path: Path to the audio file.
+    Transcribe the audio using OpenAI's Whisper API.
+    :param audio: Audio file contents.
+    :param filename: File name, its extension tells the audio format.
     :return: Transcribed text.
     """
     try:
-        # Open the audio file
-        with open(audio_path, "rb") as audio_file:
-            # Prepare the data for the Whisper API
-            response = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-            )
-            
-            # Return the transcribed text
-            transcribed_text = response.text
-            
-            return transcribed_text
+        # Prepare the data for the Whisper API
+        response = await client.audio.transcriptions.create(
+            model="whisper-1",
+            file=(filename, audio),
+        )
+        
+        # Return the transcribed text
+        transcribed_text = response.text
+        
+        return transcribed_text
     
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error transcribing audio: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error transcribing audio: {e}")
+
+async def transcribe_audio_chunks(chunks: List[Tuple[bytes, str]], transcribe: Callable[[bytes, str], Awaitable[str]] = transcribe_audio_with_whisper) -> str:
+    """
+    Transcribes the chunks of a voice note (see `AudioPreprocessor.prepare`), `settings.transcription_max_parallel`
+    at a time, and joins the texts in the order of the chunks. A note in one chunk takes a single call.
+    :param transcribe: Transcription backend, Whisper unless a stand-in is given (bench/fake_transcriber.py).
+    :return: Transcribed text.
+    """
+    if len(chunks) == 1:
+        return await transcribe(*chunks[0])
+    
+    semaphore = asyncio.Semaphore(settings.transcription_max_parallel)
+    
+    async def transcribe_chunk(chunk: bytes, chunk_filename: str) -> str:
+        async with semaphore:
+            return await transcribe(chunk, chunk_filename)
+    
+    texts = await asyncio.gather(*[transcribe_chunk(chunk, chunk_filename) for chunk, chunk_filename in chunks])
+    return " ".join(text.strip() for text in texts if text.strip())
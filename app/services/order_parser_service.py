@@ -1,6 +1,131 @@
 import re
 from datetime import datetime
 import uuid
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+class OrderExtra(BaseModel):
+    name: str
+    price: float = Field(ge=0)
+    quantity: int = Field(ge=1)
+
+class OrderExclusion(BaseModel):
+    name: str
+
+class OrderDish(BaseModel):
+    name: str
+    price: float = Field(ge=0)
+    quantity: int = Field(ge=1)
+    extras: List[OrderExtra] = []
+    exclusions: List[OrderExclusion] = []
+
+class OrderDrink(BaseModel):
+    name: str
+    price: float = Field(ge=0)
+    quantity: int = Field(ge=1)
+
+class StructuredOrder(BaseModel):
+    """
+    Pedido final tal y como lo envía el modelo con la herramienta submit_order.
+    """
+    table_number: Optional[int]
+    dishes: List[OrderDish]
+    drinks: List[OrderDrink]
+
+def _priced_line_schema(description: str) -> dict:
+    return {
+        "type": "object",
+        "description": description,
+        "properties": {
+            "name": {"type": "string"},
+            "price": {"type": "number", "description": "Precio unitario en euros"},
+            "quantity": {"type": "integer"}
+        },
+        "required": ["name", "price", "quantity"],
+        "additionalProperties": False
+    }
+
+# Tool the model calls with the final order, before writing the "Resumen del Pedido"
+ORDER_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "submit_order",
+        "description": "Registra el pedido final del cliente cuando lo da por terminado. Llámala antes de escribir el resumen del pedido.",
+        "strict": True,
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "table_number": {"type": ["integer", "null"], "description": "Número de mesa"},
+                "dishes": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "name": {"type": "string"},
+                            "price": {"type": "number", "description": "Precio unitario en euros"},
+                            "quantity": {"type": "integer"},
+                            "extras": {"type": "array", "items": _priced_line_schema("Extra del plato")},
+                            "exclusions": {
+                                "type": "array",
+                                "items": {
+                                    "type": "object",
+                                    "properties": {"name": {"type": "string"}},
+                                    "required": ["name"],
+                                    "additionalProperties": False
+                                }
+                            }
+                        },
+                        "required": ["name", "price", "quantity", "extras", "exclusions"],
+                        "additionalProperties": False
+                    }
+                },
+                "drinks": {"type": "array", "items": _priced_line_schema("Bebida")}
+            },
+            "required": ["table_number", "dishes", "drinks"],
+            "additionalProperties": False
+        }
+    }
+}
+
+def generate_order_id() -> str:
+    """
+    Genera un número de pedido único de 12 caracteres: timestamp reducido y sufijo de UUID.
+    """
+    # Generar un timestamp reducido (8 caracteres)
+    now = datetime.now()
+    timestamp = now.strftime("%y%m%d%H")  # Año, mes, día, hora (8 caracteres)
+
+    # Generar un número único a partir de UUID
+    uuid_numeric = int(uuid.uuid4().int)  # Convertir UUID a un entero
+    uuid_suffix = str(uuid_numeric)[-4:]  # Tomar los últimos 4 dígitos
+
+    # Combinar timestamp reducido y sufijo
+    return timestamp + uuid_suffix
+
+def build_order_data(order: StructuredOrder) -> dict:
+    """
+    Construye los datos del pedido a partir del pedido estructurado del modelo, sin parsear texto.
+    Calcula el total y genera un número de pedido único.
+    """
+    dishes = [dish.model_dump() for dish in order.dishes]
+    drinks = [drink.model_dump() for drink in order.drinks]
+
+    total_price = 0.0
+    for dish in dishes:
+        total_price += dish["price"] * dish["quantity"]
+        for extra in dish["extras"]:
+            total_price += extra["price"] * extra["quantity"]
+    for drink in drinks:
+        total_price += drink["price"] * drink["quantity"]
+
+    return {
+        "order_id": generate_order_id(),
+        "table_number": order.table_number,
+        "dishes": dishes,
+        "drinks": drinks,
+        "total": round(total_price, 2),  # Redondear el total a 2 decimales
+    }
 
 def parse_bot_message_stripe(message: str) -> dict:
     """
@@ -159,16 +284,8 @@ def parse_bot_message_redsys(message: str) -> dict:
         # Añadir el costo de la bebida al total
         total_price += float(drink_price) * int(quantity)
 
-    # Generar un timestamp reducido (8 caracteres)
-    now = datetime.now()
-    timestamp = now.strftime("%y%m%d%H")  # Año, mes, día, hora (8 caracteres)
-
-    # Generar un número único a partir de UUID
-    uuid_numeric = int(uuid.uuid4().int)  # Convertir UUID a un entero
-    uuid_suffix = str(uuid_numeric)[-4:]  # Tomar los últimos 4 dígitos
-
-    # Combinar timestamp reducido y sufijo
-    order_id = timestamp + uuid_suffix
+    # Generar un número de pedido único
+    order_id = generate_order_id()
 
     # Retornar los datos parseados
     return {
@@ -0,0 +1,157 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Tuple
+
+from app.core.config import settings
+from app.services.twilio_service import twilio_service
+from app.shared.metrics import metrics
+
+# Longest WhatsApp message body accepted by Twilio
+WHATSAPP_MAX_LENGTH = 1600
+
+# Between two messages merged into one send
+MERGE_SEPARATOR = "\n\n"
+
+
+class TokenBucket:
+    """Send rate of one sending number: `rate` sends per second on average, bursts of up to `capacity`."""
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()  # Waiters take the tokens in arrival order
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                metrics.increment("outbound_throttled")
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OutboundDispatcher:
+    """
+    Sends the outbound WhatsApp messages of one sending number.
+    Every recipient has a FIFO queue drained by its own task, so the messages of a user arrive
+    in the order they were queued while different users are served concurrently; all the sends
+    share the token bucket of the number. With `merge`, messages waiting in a queue are joined
+    into one send as long as the result fits in the WhatsApp length limit.
+    """
+    def __init__(self, send: Callable[[str, str], Awaitable[Any]], rate_per_second: float, burst: int,
+                 merge: bool = False, max_length: int = WHATSAPP_MAX_LENGTH):
+        self.send_message = send
+        self.bucket = TokenBucket(rate_per_second, burst)
+        self.merge = merge
+        self.max_length = max_length
+        self.queues: Dict[str, Deque[Tuple[str, asyncio.Future]]] = {}
+        self.workers: Dict[str, asyncio.Task] = {}
+
+    def enqueue(self, to_phone: str, message: str) -> asyncio.Future:
+        """Queues a message and returns a future with the result of its send."""
+        future = asyncio.get_running_loop().create_future()
+        # Callers that stop waiting after an earlier error do not get "exception never retrieved"
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self.queues.setdefault(to_phone, deque()).append((message, future))
+        if to_phone not in self.workers:
+            self.workers[to_phone] = asyncio.create_task(self._drain(to_phone))
+        metrics.increment("outbound_queued")
+        return future
+
+    async def send(self, to_phone: str, message: str) -> Any:
+        """Queues a message and waits until it is sent; raises the error of the send."""
+        return await self.enqueue(to_phone, message)
+
+    def _take(self, queue: Deque[Tuple[str, asyncio.Future]]) -> Tuple[str, List[asyncio.Future]]:
+        message, future = queue.popleft()
+        futures = [future]
+        while self.merge and queue and len(message) + len(MERGE_SEPARATOR) + len(queue[0][0]) <= self.max_length:
+            next_message, next_future = queue.popleft()
+            message += MERGE_SEPARATOR + next_message
+            futures.append(next_future)
+            metrics.increment("outbound_merged")
+        return message, futures
+
+    async def _drain(self, to_phone: str):
+        queue = self.queues[to_phone]
+        try:
+            while queue:
+                message, futures = self._take(queue)
+                await self.bucket.acquire()
+                try:
+                    result = await self.send_message(to_phone, message)
+                except Exception as e:
+                    metrics.increment("outbound_failed")
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    metrics.increment("outbound_sent")
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(result)
+        finally:
+            # No await since the queue was seen empty: nothing was queued in between
+            del self.workers[to_phone]
+            if not queue:
+                del self.queues[to_phone]
+
+    async def stop(self):
+        """Waits until every queued message has been sent."""
+        while self.workers:
+            await asyncio.gather(*list(self.workers.values()), return_exceptions=True)
+
+# Global instance of the OutboundDispatcher
+outbound_dispatcher = OutboundDispatcher(
+    twilio_service.send_whatsapp_message_async,
+    settings.outbound_messages_per_second,
+    settings.outbound_burst,
+    merge=settings.outbound_merge_messages
+)
+
+async def benchmark(recipients: int = 50, messages_per_recipient: int = 5, rate_per_second: float = 50, merge: bool = False) -> Dict[str, float]:
+    """
+    Sends through the fake Twilio server (bench/fake_twilio.py) with a dispatcher limited to
+    `rate_per_second` and checks that every recipient got its messages in order.
+    """
+    from bench.fake_twilio import FakeTwilioServer
+
+    server = FakeTwilioServer()
+    await server.start()
+    settings.twilio_api_base_url = server.base_url
+    twilio_service.async_client = None  # Recreated against the fake server
+    dispatcher = OutboundDispatcher(twilio_service.send_whatsapp_message_async, rate_per_second, burst=1, merge=merge)
+    try:
+        start = time.perf_counter()
+        futures = [
+            dispatcher.enqueue(f"whatsapp:+3460000{r:04d}", f"message {i}")
+            for i in range(messages_per_recipient) for r in range(recipients)
+        ]
+        await asyncio.gather(*futures)
+        elapsed = time.perf_counter() - start
+    finally:
+        await twilio_service.close()
+        await server.stop()
+
+    received: Dict[str, List[str]] = {}
+    for message in server.messages:
+        received.setdefault(message["to"], []).extend(message["body"].split(MERGE_SEPARATOR))
+    expected = [f"message {i}" for i in range(messages_per_recipient)]
+    return {
+        "queued": len(futures),
+        "sends": len(server.messages),
+        "seconds": round(elapsed, 3),
+        "sends_per_second": round(len(server.messages) / elapsed, 1),
+        "in_order": all(bodies == expected for bodies in received.values()) and len(received) == recipients,
+    }
+
+if __name__ == "__main__":
+    # python -m app.services.outbound_service: throughput and per-user ordering against the fake Twilio server
+    for merge in (False, True):
+        print(f"merge={merge}: {asyncio.run(benchmark(merge=merge))}")
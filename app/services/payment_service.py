@@ -10,25 +10,28 @@ from fastapi import HTTPException
 
 from app.core.config import settings
 from app.services.email_service import EmailService
+from app.services.pricing_service import pricing_engine, to_cents
 from app.services.session_service import session_manager
 
 stripe.api_key = settings.stripe_secret_key
 stripe.api_version = "2024-09-30.acacia"
 
-def create_stripe_payment_link(order_data: Dict, user_id: str, session_id: str) -> Dict[str, str]:
+async def create_stripe_payment_link(order_data: Dict, user_id: str, session_id: str) -> Dict[str, str]:
     """
     Build the line items for the order, including dishes and drinks,
     create Stripe Products/Prices, and generate a Payment Link.
     """
     try:
+        # Charge the catalog prices, not the ones written by the model
+        order_data, _ = pricing_engine.price_order(order_data)
         line_items = []
 
         # Procesar platos (dishes)
         for dish in order_data.get("dishes", []):
             # Crear producto principal y precio
-            product = stripe.Product.create(name=dish["name"])
-            price = stripe.Price.create(
-                unit_amount=int(dish["price"] * 100),  # Convertir a céntimos
+            product = await stripe.Product.create_async(name=dish["name"])
+            price = await stripe.Price.create_async(
+                unit_amount=to_cents(dish["price"]),  # Convertir a céntimos
                 currency="eur",
                 product=product.id
             )
@@ -39,9 +42,9 @@ def create_stripe_payment_link(order_data: Dict, user_id: str, session_id: str)
 
             # Procesar extras
             for extra in dish.get("extras", []):
-                extra_product = stripe.Product.create(name=f"{dish['name']} - {extra['name']}")
-                extra_price = stripe.Price.create(
-                    unit_amount=int(extra["price"] * 100),
+                extra_product = await stripe.Product.create_async(name=f"{dish['name']} - {extra['name']}")
+                extra_price = await stripe.Price.create_async(
+                    unit_amount=to_cents(extra["price"]),
                     currency="eur",
                     product=extra_product.id
                 )
@@ -52,10 +55,10 @@ def create_stripe_payment_link(order_data: Dict, user_id: str, session_id: str)
 
             # Procesar exclusiones
             for exclusion in dish.get("exclusions", []):
-                exclusion_product = stripe.Product.create(
+                exclusion_product = await stripe.Product.create_async(
                     name=f"{dish['name']} - Sin {exclusion['name']}",
                 )
-                exclusion_price = stripe.Price.create(
+                exclusion_price = await stripe.Price.create_async(
                     unit_amount=0,  # Exclusiones sin costo
                     currency="eur",
                     product=exclusion_product.id
@@ -68,9 +71,9 @@ def create_stripe_payment_link(order_data: Dict, user_id: str, session_id: str)
         # Procesar bebidas (drinks)
         for drink in order_data.get("drinks", []):
             # Crear producto principal y precio
-            product = stripe.Product.create(name=drink["name"])
-            price = stripe.Price.create(
-                unit_amount=int(drink["price"] * 100),  # Convertir a céntimos
+            product = await stripe.Product.create_async(name=drink["name"])
+            price = await stripe.Price.create_async(
+                unit_amount=to_cents(drink["price"]),  # Convertir a céntimos
                 currency="eur",
                 product=product.id
             )
@@ -80,7 +83,7 @@ def create_stripe_payment_link(order_data: Dict, user_id: str, session_id: str)
             })
 
         # Crear el Payment Link
-        payment_link = stripe.PaymentLink.create(
+        payment_link = await stripe.PaymentLink.create_async(
             line_items=line_items,
             metadata={
                 "user_id": user_id,
@@ -89,7 +92,7 @@ def create_stripe_payment_link(order_data: Dict, user_id: str, session_id: str)
         )
 
         # Guardar el enlace de pago en la sesión
-        session_manager.add_payment_link(session_id, payment_link.url)
+        await session_manager.add_payment_link(session_id, payment_link.url)
 
         return {"url": payment_link.url}
 
@@ -123,7 +126,7 @@ class PaymentServiceRedsys:
                 "transaction_type": STANDARD_PAYMENT,
                 "currency": EUR,
                 "order": order_id.zfill(12),  # Redsys requiere un ID de 12 caracteres
-                "amount": D(amount).quantize(D(".01"), ROUND_HALF_UP),  # Convertimos el monto a dos decimales
+                "amount": D(str(amount)).quantize(D(".01"), ROUND_HALF_UP),  # Convertimos el monto a dos decimales
                 "merchant_url": settings.redsys_notification_url,  # URL de notificación para Redsys
                 "merchant_data": f"{user_id}",  # Datos adicionales para el comercio
                 "merchant_name": "ElectroSolucion",
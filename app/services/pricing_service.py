@@ -0,0 +1,180 @@
+import re
+from decimal import Decimal as D, ROUND_HALF_UP
+from typing import Dict, List, Optional, Tuple
+
+from app.services.menu_service import MenuCatalog, menu_catalog, normalize_name
+
+CENT = D("0.01")
+
+# Words the customer or the model use for the portion of items priced by size ("price": {"half": ..., "full": ...})
+HALF_PORTION_WORDS = {"media", "half", "mitad"}
+PORTION_WORDS = HALF_PORTION_WORDS | {"racion", "entera", "completa", "full", "de"}
+PARENTHESES_PATTERN = re.compile(r"\(.*?\)")
+
+
+def to_decimal(price) -> D:
+    """Converts a price to Decimal without carrying binary float errors."""
+    return D(str(price))
+
+def to_cents(price) -> int:
+    """Converts a price in euros to cents, rounding half up."""
+    return int((to_decimal(price) * 100).quantize(D("1"), ROUND_HALF_UP))
+
+def format_price(price: D) -> str:
+    return f"{price.quantize(CENT, ROUND_HALF_UP)}€"
+
+
+class PricingEngine:
+    """
+    Validates an order against the menu catalog and recomputes its prices and total.
+    Item and extra prices are converted to Decimal once, so every lookup is a dict access.
+    """
+    def __init__(self, catalog: MenuCatalog):
+        self.catalog = catalog
+        self.item_prices: Dict[str, Dict[str, D]] = {}
+        self.extra_prices: Dict[Tuple[str, str], D] = {}
+
+        for name, item in catalog.items.items():
+            # Items priced by size keep one price per portion, the rest a single "full" price
+            if isinstance(item["price"], dict):
+                self.item_prices[name] = {portion: to_decimal(price) for portion, price in item["price"].items()}
+            else:
+                self.item_prices[name] = {"full": to_decimal(item["price"])}
+            for extra_name, extra in item["extras"].items():
+                self.extra_prices[(name, extra_name)] = to_decimal(extra["price"])
+
+    def _find_item(self, name: str) -> Optional[Dict]:
+        """Looks up an item by name, ignoring portion words like "(media)" or "ración de"."""
+        item = self.catalog.get_item(name)
+        if item is None:
+            words = normalize_name(PARENTHESES_PATTERN.sub(" ", name)).split()
+            while words and words[0] in PORTION_WORDS:
+                words.pop(0)
+            while words and words[-1] in PORTION_WORDS:
+                words.pop()
+            item = self.catalog.get_item(" ".join(words))
+        return item
+
+    def _unit_price(self, item: Dict, line: Dict) -> D:
+        """Catalog price of an order line, choosing the portion for items priced by size."""
+        prices = self.item_prices[normalize_name(item["name"])]
+        if len(prices) == 1:
+            return next(iter(prices.values()))
+
+        words = set(normalize_name(line.get("name", "")).replace("(", " ").replace(")", " ").split())
+        if words & HALF_PORTION_WORDS and "half" in prices:
+            return prices["half"]
+        try:
+            quoted = to_decimal(line.get("price"))
+            if quoted in prices.values():
+                return quoted
+        except Exception:
+            pass
+        return prices.get("full", max(prices.values()))
+
+    def _line_name(self, item: Dict, line: Dict) -> str:
+        """Catalog name of the item, keeping the portion written in the order for items priced by size."""
+        if len(self.item_prices[normalize_name(item["name"])]) > 1:
+            return line["name"]
+        return item["name"]
+
+    def _resolve_item(self, line: Dict, corrections: List[str]):
+        """Returns the catalog item of an order line, or None if it can not be served."""
+        item = self._find_item(line.get("name", ""))
+        if item is None:
+            corrections.append(f"{line.get('name')} no está en la carta y se ha quitado del pedido.")
+            return None
+        if not item["available"]:
+            corrections.append(f"{item['name']} no está disponible y se ha quitado del pedido.")
+            return None
+        return item
+
+    def _quantity(self, line: Dict) -> int:
+        try:
+            return max(int(line.get("quantity", 1)), 1)
+        except (TypeError, ValueError):
+            return 1
+
+    def _check_price(self, line: Dict, name: str, price: D, corrections: List[str]):
+        try:
+            quoted = to_decimal(line.get("price"))
+        except Exception:
+            quoted = None
+        if quoted != price:
+            corrections.append(f"El precio de {name} es {format_price(price)}.")
+
+    def price_order(self, order_data: Dict) -> Tuple[Dict, List[str]]:
+        """
+        Returns the order with every dish, extra and drink resolved against the catalog and
+        the total recomputed, plus the list of corrections made. Unknown or unavailable items
+        and extras are removed and wrong prices are replaced by the catalog ones.
+        """
+        corrections = []
+        total = D("0")
+
+        dishes = []
+        for dish in order_data.get("dishes", []):
+            item = self._resolve_item(dish, corrections)
+            if item is None:
+                continue
+
+            item_key = normalize_name(item["name"])
+            price = self._unit_price(item, dish)
+            quantity = self._quantity(dish)
+            self._check_price(dish, item["name"], price, corrections)
+            total += price * quantity
+
+            extras = []
+            for extra in dish.get("extras", []):
+                extra_key = normalize_name(extra.get("name", ""))
+                catalog_extra = item["extras"].get(extra_key)
+                if catalog_extra is None or not catalog_extra["available"]:
+                    corrections.append(f"{extra.get('name')} no es un extra disponible para {item['name']} y se ha quitado.")
+                    continue
+
+                extra_price = self.extra_prices[(item_key, extra_key)]
+                extra_quantity = self._quantity(extra)
+                self._check_price(extra, catalog_extra["name"], extra_price, corrections)
+                total += extra_price * extra_quantity
+                extras.append({"name": catalog_extra["name"], "price": float(extra_price), "quantity": extra_quantity})
+
+            dishes.append({
+                "name": self._line_name(item, dish),
+                "price": float(price),
+                "quantity": quantity,
+                "extras": extras,
+                "exclusions": [{"name": exclusion["name"]} for exclusion in dish.get("exclusions", [])],
+            })
+
+        drinks = []
+        for drink in order_data.get("drinks", []):
+            item = self._resolve_item(drink, corrections)
+            if item is None:
+                continue
+
+            price = self._unit_price(item, drink)
+            quantity = self._quantity(drink)
+            self._check_price(drink, item["name"], price, corrections)
+            total += price * quantity
+            drinks.append({"name": self._line_name(item, drink), "price": float(price), "quantity": quantity})
+
+        priced_order = dict(order_data)
+        priced_order.update({
+            "dishes": dishes,
+            "drinks": drinks,
+            "total": float(total.quantize(CENT, ROUND_HALF_UP)),
+        })
+        return priced_order, corrections
+
+def format_corrections(corrections: List[str], order_data: Dict) -> str:
+    """Message for the customer with the corrections made to the order."""
+    lines = ["⚠️ Hemos revisado tu pedido con la carta:"]
+    lines += [f"- {correction}" for correction in corrections]
+    if order_data.get("dishes") or order_data.get("drinks"):
+        lines.append(f"*Total a pagar*: {format_price(to_decimal(order_data['total']))}")
+    else:
+        lines.append("No queda ningún producto válido en el pedido. ¿Qué te gustaría pedir?")
+    return "\n".join(lines)
+
+# Global instance of the PricingEngine
+pricing_engine = PricingEngine(menu_catalog)
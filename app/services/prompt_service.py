@@ -0,0 +1,43 @@
+import hashlib
+from typing import Dict, Optional
+
+from app.core.config import settings
+
+
+def make_prompt_id(prompt: str) -> str:
+    """Version ID of a prompt: the hash of its text, the same in every process serving it."""
+    return "prompt-" + hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class PromptRegistry:
+    """
+    Process-local registry of the system prompts, by version ID.
+    Sessions store only the ID of the prompt they were started with and the text is
+    resolved here when the chat messages are built.
+    """
+    def __init__(self, prompt: str):
+        self.prompts: Dict[str, str] = {}
+        self.current_id = self.register(prompt)
+
+    def register(self, prompt: str) -> str:
+        prompt_id = make_prompt_id(prompt)
+        self.prompts[prompt_id] = prompt
+        return prompt_id
+
+    @property
+    def current(self) -> str:
+        return self.prompts[self.current_id]
+
+    def resolve(self, prompt_id: Optional[str]) -> str:
+        """
+        Returns the text of a prompt version. Versions this process does not know
+        (the prompt changed in a deploy) fall back to the current prompt.
+        """
+        if prompt_id and prompt_id in self.prompts:
+            return self.prompts[prompt_id]
+        if prompt_id:
+            print(f"Unknown prompt version {prompt_id}, using {self.current_id}")
+        return self.current
+
+# Global instance of the PromptRegistry
+prompt_registry = PromptRegistry(settings.INITIAL_PROMPT)
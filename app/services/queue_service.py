@@ -0,0 +1,203 @@
+import asyncio
+import json
+import os
+import socket
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import redis.asyncio as redis
+
+from app.core.config import settings
+from app.services.redis_service import get_redis
+
+# Queues a job unless its dedupe key was seen, in one step: a crash between the two writes would
+# either lose the job for good or queue a Twilio retry twice.
+# KEYS[1]: stream, KEYS[2]: dedupe key (same slot as the stream). ARGV: payload, dedupe TTL seconds
+ENQUEUE_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return false
+end
+local entry_id = redis.call('XADD', KEYS[1], '*', 'payload', ARGV[1])
+redis.call('SET', KEYS[2], 1, 'EX', ARGV[2])
+return entry_id
+"""
+
+
+class MessageQueue:
+    """
+    Durable job queue backed by a Redis stream and a consumer group.
+    Jobs are acknowledged only after the handler finishes (at-least-once delivery),
+    jobs idle for longer than the visibility timeout are reclaimed by another worker,
+    and jobs that keep failing are moved to a dead-letter list.
+    """
+    def __init__(self, redis_client: Optional[redis.Redis] = None, stream: str = "queue:incoming", group: str = "workers"):
+        self.redis_client = redis_client or get_redis()
+        self.stream = stream
+        self.group = group
+        self.dead_letter_key = f"{stream}:dead"
+        self.visibility_timeout_ms = settings.queue_visibility_timeout_ms
+        self.max_deliveries = settings.queue_max_deliveries
+        self.dedupe_ttl = 24 * 60 * 60 # Twilio retries arrive within minutes, keep the ids for a day
+        self.consumer_prefix = f"{socket.gethostname()}-{os.getpid()}"
+        self._group_ready = False
+        self._stop_event = asyncio.Event()
+        self._deferred: Set[asyncio.Task] = set()  # Jobs accepted by the handler that are still running
+        self.enqueue_script = self.redis_client.register_script(ENQUEUE_SCRIPT)
+
+    async def ensure_group(self):
+        """Creates the stream and the consumer group if they do not exist yet."""
+        if self._group_ready:
+            return
+
+        try:
+            await self.redis_client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+        self._group_ready = True
+
+    async def enqueue(self, payload: Dict[str, str], dedupe_id: Optional[str] = None) -> Optional[str]:
+        """Adds a job to the stream. Returns the entry ID, or None if the job was already queued."""
+        await self.ensure_group()
+        if not dedupe_id:
+            return await self.redis_client.xadd(self.stream, {"payload": json.dumps(payload)})
+
+        # The stream name in braces puts the dedupe key on the slot of the stream, for the script on a cluster
+        seen_key = f"{{{self.stream}}}:seen:{dedupe_id}"
+        return await self.enqueue_script(keys=[self.stream, seen_key], args=[json.dumps(payload), self.dedupe_ttl])
+
+    async def claim(self, consumer: str, count: int = 1, block_ms: int = 5000) -> List:
+        """
+        Returns the next jobs for a consumer. Jobs whose visibility timeout expired are
+        reclaimed first, then new jobs are read from the stream.
+        """
+        reclaimed = await self.redis_client.xautoclaim(
+            self.stream,
+            self.group,
+            consumer,
+            min_idle_time=self.visibility_timeout_ms,
+            start_id="0-0",
+            count=count
+        )
+        entries = reclaimed[1] if reclaimed else []
+        if entries:
+            return entries
+
+        response = await self.redis_client.xreadgroup(self.group, consumer, {self.stream: ">"}, count=count, block=block_ms)
+        return response[0][1] if response else []
+
+    async def ack(self, entry_id: str):
+        """Acknowledges a finished job and removes it from the stream."""
+        # A cluster does not run MULTI across nodes: there the commands are only pipelined
+        pipe = self.redis_client.pipeline(transaction=not settings.redis_cluster)
+        pipe.xack(self.stream, self.group, entry_id)
+        pipe.xdel(self.stream, entry_id)
+        await pipe.execute()
+
+    async def dead_letter(self, entry_id: str, fields: Optional[Dict[str, str]], error: str):
+        """Moves a job to the dead-letter list."""
+        dead_job = {
+            "id": entry_id,
+            "payload": (fields or {}).get("payload"),
+            "error": error
+        }
+        pipe = self.redis_client.pipeline(transaction=not settings.redis_cluster)
+        pipe.rpush(self.dead_letter_key, json.dumps(dead_job))
+        pipe.xack(self.stream, self.group, entry_id)
+        pipe.xdel(self.stream, entry_id)
+        await pipe.execute()
+
+    async def delivery_count(self, entry_id: str) -> int:
+        """Returns how many times a pending job has been delivered."""
+        pending = await self.redis_client.xpending_range(self.stream, self.group, min=entry_id, max=entry_id, count=1)
+        return pending[0]["times_delivered"] if pending else 1
+
+    async def _keep_visible(self, consumer: str, entry_id: str):
+        """Resets the idle time of a job while it is running so no other worker reclaims it."""
+        interval = self.visibility_timeout_ms / 3000
+        while True:
+            await asyncio.sleep(interval)
+            await self.redis_client.xclaim(self.stream, self.group, consumer, min_idle_time=0, message_ids=[entry_id], justid=True)
+
+    async def process(self, consumer: str, entry_id: str, fields: Optional[Dict[str, str]], handler: Callable[[Dict], Awaitable]):
+        """Runs the handler for a single job, acknowledging it on success."""
+        # The entry was deleted from the stream while it was pending
+        if not fields:
+            await self.ack(entry_id)
+            return
+
+        deliveries = await self.delivery_count(entry_id)
+        if deliveries > self.max_deliveries:
+            await self.dead_letter(entry_id, fields, "Max deliveries exceeded")
+            return
+
+        heartbeat = asyncio.create_task(self._keep_visible(consumer, entry_id))
+        try:
+            result = await handler(json.loads(fields["payload"]))
+        except Exception as e:
+            heartbeat.cancel()
+            await self._failed(entry_id, fields, deliveries, e)
+            return
+
+        # A handler that returns a future accepted the job and finishes it in the background:
+        # the worker moves on and the job is acknowledged (or retried) when the future is done
+        if asyncio.isfuture(result):
+            task = asyncio.create_task(self._finish(entry_id, fields, deliveries, result, heartbeat))
+            self._deferred.add(task)
+            task.add_done_callback(self._deferred.discard)
+            return
+
+        heartbeat.cancel()
+        await self.ack(entry_id)
+
+    async def _finish(self, entry_id: str, fields: Dict[str, str], deliveries: int, future: asyncio.Future, heartbeat: asyncio.Task):
+        try:
+            await future
+        except Exception as e:
+            await self._failed(entry_id, fields, deliveries, e)
+            return
+        finally:
+            heartbeat.cancel()
+
+        await self.ack(entry_id)
+
+    async def _failed(self, entry_id: str, fields: Dict[str, str], deliveries: int, error: Exception):
+        print(f"Error processing queued job {entry_id}: {error}")
+        if deliveries >= self.max_deliveries:
+            await self.dead_letter(entry_id, fields, str(error))
+        # Otherwise the job stays pending and is retried after the visibility timeout
+
+    async def run_worker(self, name: str, handler: Callable[[Dict], Awaitable]):
+        """Consumes jobs until the queue is stopped."""
+        consumer = f"{self.consumer_prefix}-{name}"
+        await self.ensure_group()
+
+        while not self._stop_event.is_set():
+            try:
+                entries = await self.claim(consumer)
+            except Exception as e:
+                print(f"Error reading from queue {self.stream}: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            for entry_id, fields in entries:
+                await self.process(consumer, entry_id, fields, handler)
+
+    def start_workers(self, handler: Callable[[Dict], Awaitable], count: int) -> List[asyncio.Task]:
+        """Starts a pool of worker coroutines."""
+        self._stop_event.clear()
+        return [asyncio.create_task(self.run_worker(str(i), handler)) for i in range(count)]
+
+    async def stop_workers(self, workers: List[asyncio.Task]):
+        """
+        Stops the worker coroutines and waits for the jobs they handed off to finish.
+        Unfinished jobs stay pending and are redelivered.
+        """
+        self._stop_event.set()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        await asyncio.gather(*self._deferred, return_exceptions=True)
+
+# Global instance of the MessageQueue
+message_queue = MessageQueue()
@@ -0,0 +1,107 @@
+from typing import Dict, Optional, Tuple, Union
+
+import redis.asyncio as aioredis
+from redis.asyncio.cluster import RedisCluster as AsyncRedisCluster
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import EqualJitterBackoff
+from redis.exceptions import ConnectionError
+
+from app.core.config import settings
+
+# Pools shared by every client of the process, by (kind, decode_responses)
+pools: Dict[Tuple[str, bool], aioredis.BlockingConnectionPool] = {}
+
+# Cluster clients of the process (settings.redis_cluster), by (kind, decode_responses); each keeps its own per-node pools
+clusters: Dict[Tuple[str, bool], AsyncRedisCluster] = {}
+
+
+def _connection_kwargs(socket_timeout) -> Dict:
+    """
+    Connection settings shared by the pools.
+    Only connection errors are retried: a timeout may come after the command already ran,
+    and retrying it could apply a write twice.
+    """
+    return {
+        "db": settings.empresa_db,
+        "max_connections": settings.redis_max_connections,
+        "timeout": settings.redis_pool_timeout_seconds,
+        "socket_timeout": socket_timeout,
+        "socket_connect_timeout": settings.redis_connect_timeout_seconds,
+        "socket_keepalive": True,
+        "health_check_interval": settings.redis_health_check_interval_seconds,
+        "retry": AsyncRetry(
+            EqualJitterBackoff(cap=settings.redis_retry_backoff_cap_seconds, base=settings.redis_retry_backoff_base_seconds),
+            settings.redis_retry_attempts
+        ),
+        "retry_on_error": [ConnectionError],
+    }
+
+def _cluster_kwargs() -> Dict:
+    """
+    Cluster clients take the same settings, except the database (a cluster only has db 0)
+    and the wait for a free connection: their per-node pools fail as soon as they are full.
+    """
+    kwargs = _connection_kwargs(settings.redis_socket_timeout_seconds)
+    del kwargs["db"], kwargs["timeout"]
+    return kwargs
+
+def get_redis(decode_responses: bool = True) -> Union[aioredis.Redis, AsyncRedisCluster]:
+    """Async client on the shared blocking pool of the process, or the cluster client."""
+    key = ("async", decode_responses)
+    if settings.redis_cluster:
+        if key not in clusters:
+            clusters[key] = AsyncRedisCluster.from_url(settings.redis_url, decode_responses=decode_responses, **_cluster_kwargs())
+        return clusters[key]
+
+    if key not in pools:
+        pools[key] = aioredis.BlockingConnectionPool.from_url(
+            settings.redis_url,
+            decode_responses=decode_responses,
+            **_connection_kwargs(settings.redis_socket_timeout_seconds)
+        )
+    return aioredis.Redis(connection_pool=pools[key])
+
+def get_pubsub_redis() -> Optional[aioredis.Redis]:
+    """
+    Async client for long lived subscriptions. Its reads wait for messages without a socket
+    timeout; the health checks detect dead connections instead.
+    None on a cluster: the async cluster client has no pub/sub and keyspace events are per node.
+    """
+    if settings.redis_cluster:
+        return None
+
+    key = ("pubsub", True)
+    if key not in pools:
+        pools[key] = aioredis.BlockingConnectionPool.from_url(
+            settings.redis_url,
+            decode_responses=True,
+            **_connection_kwargs(None)
+        )
+    return aioredis.Redis(connection_pool=pools[key])
+
+def pool_stats() -> Dict[str, Dict[str, int]]:
+    """Connections created, in use and idle of every pool, to size `redis_max_connections`."""
+    stats = {}
+    for (kind, decode_responses), pool in pools.items():
+        in_use = len(pool._in_use_connections)
+        idle = len(pool._available_connections)
+        created = in_use + idle
+        stats[f"{kind}{'' if decode_responses else '_binary'}"] = {
+            "max": pool.max_connections,
+            "created": created,
+            "in_use": in_use,
+            "idle": idle,
+            "utilization": round(in_use / pool.max_connections, 4),
+        }
+
+    for (kind, decode_responses), client in clusters.items():
+        for node in client.get_nodes():
+            created, idle, max_connections = len(node._connections), len(node._free), node.max_connections
+            stats[f"{kind}{'' if decode_responses else '_binary'}@{node.name}"] = {
+                "max": max_connections,
+                "created": created,
+                "in_use": created - idle,
+                "idle": idle,
+                "utilization": round((created - idle) / max_connections, 4),
+            }
+    return stats
@@ -0,0 +1,126 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from app.core.config import settings
+from app.services.menu_service import menu_catalog, normalize_name
+from app.services.redis_service import get_redis
+from app.shared.metrics import metrics
+
+# Model whose replies are cached; part of the version so a model change invalidates the cache
+CACHED_MODEL = "gpt-4o-mini"
+
+# Words that start the menu and FAQ questions worth caching ("qué bebidas tenéis", "se puede pagar en efectivo")
+QUESTION_WORDS = {
+    "que", "cual", "cuales", "cuanto", "cuanta", "cuantos", "como", "donde", "hay",
+    "teneis", "tienen", "tienes", "se", "puedo", "podemos", "aceptan", "aceptais", "menu", "carta"
+}
+MAX_CACHEABLE_WORDS = 10
+NON_WORD_PATTERN = re.compile(r"[^\w\s]")
+
+# Once the conversation has started, replies depend on the basket and the history ("cuánto es en total",
+# "qué extras tiene"): only these questions, whose answer is the same for every diner, are cached then.
+# They are matched against the whole normalized text.
+CATEGORY_NAMES = "|".join(sorted(re.escape(name) for name in menu_catalog.categories))
+FAQ_PATTERNS = [re.compile(pattern) for pattern in [
+    r"(que|cual es|me ensenas|me pasas|puedo ver|podemos ver|teneis|tienen) (el menu|la carta)",
+    r"que (hay|teneis|tienen) (en el menu|en la carta|de comer|para comer)",
+    rf"(que|cuales) ({CATEGORY_NAMES}) (hay|teneis|tienen|tienes)",
+    rf"(que|cuales) ({CATEGORY_NAMES}|platos) (hay|teneis|tienen) sin (gluten|lactosa)",
+    r"(aceptais|aceptan|se puede pagar|puedo pagar|podemos pagar)( con| en)? (la |el )?(tarjeta|efectivo|bizum)",
+    r"(como|con que) (se paga|puedo pagar|podemos pagar|pago)",
+]]
+
+
+def prompt_version() -> str:
+    """Hash of everything a cached reply depends on besides the user text: prompt, menu and model."""
+    content = f"{CACHED_MODEL}\n{settings.INITIAL_PROMPT}\n{settings.MENU_JSON}"
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+def normalize_message(message: str) -> str:
+    """Lowercase text without accents, punctuation or repeated spaces."""
+    return normalize_name(NON_WORD_PATTERN.sub(" ", message))
+
+
+class ResponseCache:
+    """
+    Cache of bot replies to menu and FAQ questions, keyed by the normalized user text,
+    the conversation stage and the prompt/menu version. Only replies that do not depend on
+    the session are cached. An in-process LRU with TTLs sits in front of an optional Redis
+    tier shared by all the workers.
+    """
+    def __init__(self, max_entries: int, ttl_seconds: int, use_redis: bool):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version = prompt_version()
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.redis_client = get_redis() if use_redis else None
+
+    def make_key(self, message: str, stage: str) -> Optional[str]:
+        """
+        Returns the cache key of a message, or None if the reply can not be cached.
+        In the welcome stage (no history, no order) short questions without numbers (tables,
+        quantities) are cached; later on, only the questions of `FAQ_PATTERNS`.
+        """
+        normalized = normalize_message(message)
+        words = normalized.split()
+        if stage == "welcome":
+            if not words or len(words) > MAX_CACHEABLE_WORDS or any(char.isdigit() for char in normalized):
+                return None
+            if "?" not in message and words[0] not in QUESTION_WORDS:
+                return None
+        elif not any(pattern.fullmatch(normalized) for pattern in FAQ_PATTERNS):
+            return None
+
+        digest = hashlib.sha256(f"{stage}\n{normalized}".encode("utf-8")).hexdigest()[:32]
+        return f"response_cache:{self.version}:{digest}"
+
+    async def get(self, key: str) -> Optional[str]:
+        metrics.increment("response_cache_lookups")
+        entry = self.entries.get(key)
+        if entry is not None:
+            expires_at, response = entry
+            if expires_at > time.monotonic():
+                self.entries.move_to_end(key)
+                metrics.increment("response_cache_hits")
+                return response
+            del self.entries[key]
+
+        if self.redis_client is not None:
+            try:
+                response = await self.redis_client.get(key)
+            except Exception as e:
+                print(f"Error reading the response cache: {e}")
+                response = None
+            if response is not None:
+                self._store_local(key, response)
+                metrics.increment("response_cache_hits")
+                metrics.increment("response_cache_redis_hits")
+                return response
+
+        metrics.increment("response_cache_misses")
+        return None
+
+    async def set(self, key: str, response: str):
+        self._store_local(key, response)
+        if self.redis_client is not None:
+            try:
+                await self.redis_client.set(key, response, ex=self.ttl_seconds)
+            except Exception as e:
+                print(f"Error writing the response cache: {e}")
+
+    def _store_local(self, key: str, response: str):
+        self.entries[key] = (time.monotonic() + self.ttl_seconds, response)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            metrics.increment("response_cache_evictions")
+
+# Global instance of the ResponseCache
+response_cache = ResponseCache(
+    settings.response_cache_max_entries,
+    settings.response_cache_ttl_seconds,
+    settings.response_cache_redis
+)
@@ -0,0 +1,131 @@
+import asyncio
+from collections import OrderedDict
+from typing import Any, Optional
+
+import redis.asyncio as redis
+
+from app.shared.metrics import metrics
+
+# Key families cached in process; their keyspace notifications invalidate the local copies
+CACHED_KEY_PATTERNS = ["session:*", "user_session:*"]
+
+# Keyspace events needed: K keyspace channel, g generic (del, expire), $ strings, l lists, h hashes, x expired, e evicted
+REQUIRED_EVENTS = "Kg$lhxe"
+
+# Returned by get() when the key is not cached, since None is a valid cached value
+MISSING = object()
+
+
+class SessionCache:
+    """
+    In-process LRU cache of session keys (meta hash, history, user mapping), in front of Redis.
+    It stays coherent across workers through keyspace notifications: every change to a cached
+    key, by any process, evicts the local copy. Without notifications the cache stays disabled.
+
+    Reads that overlap an invalidation of the same key are not cached: `begin()` returns the
+    epoch before the read and `put()` drops the value if the key was invalidated after it.
+    """
+    def __init__(self, redis_client: redis.Redis, db: int, max_entries: int):
+        self.redis_client = redis_client
+        self.db = db
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Any]" = OrderedDict()
+        self.invalidations: "OrderedDict[str, int]" = OrderedDict()
+        self.epoch = 0
+        self.forgotten_epoch = 0  # Newest epoch dropped from `invalidations`
+        self.enabled = False
+        self._listener: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Enables keyspace notifications if needed and starts listening to them."""
+        if not self.max_entries:
+            return
+        try:
+            events = (await self.redis_client.config_get("notify-keyspace-events")).get("notify-keyspace-events", "")
+            missing = "".join(flag for flag in REQUIRED_EVENTS if flag not in events and not ("A" in events and flag in "g$lhxe"))
+            if missing:
+                await self.redis_client.config_set("notify-keyspace-events", events + missing)
+        except Exception as e:
+            print(f"Session cache disabled, keyspace notifications are not available: {e}")
+            return
+
+        ready = asyncio.Event()
+        self._listener = asyncio.create_task(self._listen(ready))
+        await ready.wait()
+
+    async def stop(self):
+        self.enabled = False
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        self.clear()
+
+    async def _listen(self, ready: asyncio.Event):
+        prefix = f"__keyspace@{self.db}__:"
+        while True:
+            pubsub = self.redis_client.pubsub()
+            try:
+                await pubsub.psubscribe(*[prefix + pattern for pattern in CACHED_KEY_PATTERNS])
+                self.enabled = True
+                ready.set()
+                async for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        channel = message["channel"]
+                        if isinstance(channel, bytes):
+                            channel = channel.decode()
+                        self.invalidate(channel[len(prefix):])
+                        metrics.increment("session_cache_remote_invalidations")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Changes made while disconnected were not seen: nothing cached can be trusted
+                print(f"Session cache listener disconnected, clearing the cache: {e}")
+                self.enabled = False
+                self.clear()
+                ready.set()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+    def begin(self) -> int:
+        """Epoch to pass to `put()` for a value read from Redis from now on."""
+        return self.epoch
+
+    def get(self, key: str) -> Any:
+        if not self.enabled:
+            return MISSING
+        metrics.increment("session_cache_lookups")
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            metrics.increment("session_cache_hits")
+            return self.entries[key]
+        metrics.increment("session_cache_misses")
+        return MISSING
+
+    def put(self, key: str, value: Any, epoch: int):
+        if not self.enabled:
+            return
+        if self.invalidations.get(key, 0) > epoch or self.forgotten_epoch > epoch:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            metrics.increment("session_cache_evictions")
+
+    def invalidate(self, *keys: str):
+        for key in keys:
+            self.epoch += 1
+            self.entries.pop(key, None)
+            self.invalidations[key] = self.epoch
+            self.invalidations.move_to_end(key)
+        while len(self.invalidations) > self.max_entries:
+            _, epoch = self.invalidations.popitem(last=False)
+            self.forgotten_epoch = max(self.forgotten_epoch, epoch)
+
+    def clear(self):
+        self.epoch += 1
+        self.forgotten_epoch = self.epoch
+        self.entries.clear()
+        self.invalidations.clear()
@@ -1,230 +1,698 @@
-import redis
+import asyncio
+import hashlib
 import json
+import random
+import re
+
+from redis.exceptions import WatchError
 
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
 from uuid import uuid4
 
-from app.core import config
 from app.core.config import settings
+from app.services.archive_service import conversation_archiver
+from app.services.prompt_service import make_prompt_id, prompt_registry
+from app.services.redis_service import get_pubsub_redis, get_redis
+from app.services.session_cache_service import MISSING, SessionCache
+from app.shared.codec import Codec
+from app.shared.metrics import metrics
+
+BLOCKED_MESSAGE = "El camarero está muy ocupado y no podrá atenderle más por ahora. Por favor, inténtelo de nuevo más tarde."
+
+# Sliding window message limiter, run atomically in Redis.
+# KEYS[1]: sorted set with one member per accepted message, scored by its time in ms
+# KEYS[2]: block flag, expires by itself when the block ends; 'notified' once the user got the notice
+# ARGV: window ms, max messages in the window, block ms, member for this message
+# Returns {allowed, remaining, blocked until (ms, 0 if not blocked), 1 if the user must get the block notice}
+RATE_LIMIT_SCRIPT = """
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local window_ms = tonumber(ARGV[1])
+local limit = tonumber(ARGV[2])
+local block_ms = tonumber(ARGV[3])
+
+local block_ttl = redis.call('PTTL', KEYS[2])
+if block_ttl > 0 then
+    -- Only the first message refused by a block gets the notice
+    if redis.call('GET', KEYS[2]) == 'notified' then
+        return {0, 0, now + block_ttl, 0}
+    end
+    redis.call('SET', KEYS[2], 'notified', 'PX', block_ttl)
+    return {0, 0, now + block_ttl, 1}
+end
+
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window_ms)
+local count = redis.call('ZCARD', KEYS[1])
+if count >= limit then
+    redis.call('SET', KEYS[2], 'notified', 'PX', block_ms)
+    return {0, 0, now + block_ms, 1}
+end
+
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('PEXPIRE', KEYS[1], window_ms)
+count = count + 1
+
+local blocked_until = 0
+if count >= limit then
+    redis.call('SET', KEYS[2], '1', 'PX', block_ms)
+    blocked_until = now + block_ms
+end
+return {1, limit - count, blocked_until, 0}
+"""
+
+
+# Every session mutation runs as one of these scripts and bumps the `version` field of the meta hash.
+# Appends and field writes are atomic by themselves; read-modify-write updates pass the version
+# they read and are rejected (-2) if another writer got there first. -1 means the session does not exist.
+# The order data has a version of its own (`order_version`), so appends to the history do not make
+# an order update fail.
+
+# Every write also refreshes the TTL of the session keys, so idle sessions expire in Redis.
+
+# KEYS[1]: meta hash, KEYS[2]: history list, KEYS[3]: user_session key. ARGV: history entry, last activity, TTL ms
+SESSION_APPEND_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+redis.call('RPUSH', KEYS[2], ARGV[1])
+redis.call('HSET', KEYS[1], 'last_activity', ARGV[2])
+redis.call('HINCRBY', KEYS[1], 'version', 1)
+local turns = redis.call('HINCRBY', KEYS[1], 'turns', 1)
+for i = 1, 3 do
+    redis.call('PEXPIRE', KEYS[i], ARGV[3])
+end
+return turns
+"""
+
+# KEYS[1]: meta hash, KEYS[2]: history list. ARGV: TTL ms, version field of the written fields
+# ('version' or 'order_version', bumped by the write), expected value of that field ('' for any),
+# number of fields to set, the field/value pairs to set, then the fields to delete
+SESSION_UPDATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+if ARGV[3] ~= '' and (redis.call('HGET', KEYS[1], ARGV[2]) or '0') ~= ARGV[3] then
+    return -2
+end
+local set_count = tonumber(ARGV[4])
+for i = 5, 4 + set_count * 2, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+for i = 5 + set_count * 2, #ARGV do
+    redis.call('HDEL', KEYS[1], ARGV[i])
+end
+redis.call('PEXPIRE', KEYS[1], ARGV[1])
+redis.call('PEXPIRE', KEYS[2], ARGV[1])
+if ARGV[2] ~= 'version' then
+    redis.call('HINCRBY', KEYS[1], ARGV[2], 1)
+end
+return redis.call('HINCRBY', KEYS[1], 'version', 1)
+"""
+
+# Starts a session over, keeping its version counters growing so older reads can not match them again.
+# KEYS[1]: meta hash, KEYS[2]: history list, KEYS[3]: user_session key. ARGV: user id, prompt id, last activity, TTL ms
+SESSION_RESET_SCRIPT = """
+local version = tonumber(redis.call('HGET', KEYS[1], 'version') or '0') + 1
+local order_version = tonumber(redis.call('HGET', KEYS[1], 'order_version') or '0') + 1
+redis.call('DEL', KEYS[1], KEYS[2])
+redis.call('HSET', KEYS[1], 'user_id', ARGV[1], 'prompt_id', ARGV[2], 'last_activity', ARGV[3], 'turns', 0,
+           'version', version, 'order_version', order_version)
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+redis.call('PEXPIRE', KEYS[3], ARGV[4])
+return version
+"""
+
+# Removes an archived session, unless it changed after it was read for the archive.
+# KEYS[1]: meta hash, KEYS[2]: history list, KEYS[3]: user_session key. ARGV: version read, session id
+SESSION_DELETE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'version') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+if redis.call('GET', KEYS[3]) == ARGV[2] then
+    redis.call('DEL', KEYS[3])
+end
+return 1
+"""
+
+# Attempts of a read-modify-write update before giving up
+MAX_CAS_RETRIES = 5
+
+# Key families of the memory report, matched in order
+KEY_FAMILIES = [
+    ("session:*:history", re.compile(r"^session:(\{[^}]+\}:)?[^:]+:history$")),
+    ("session:*:meta", re.compile(r"^session:(\{[^}]+\}:)?[^:]+:meta$")),
+    ("session:* (legacy)", re.compile(r"^session:[^:{]+$")),
+    ("user_session:*", re.compile(r"^user_session:")),
+    ("user_limit:*", re.compile(r"^user_limit:")),
+    ("response_cache:*", re.compile(r"^response_cache:")),
+    ("queue:*", re.compile(r"^queue:")),
+]
+
+
+class RateLimit(NamedTuple):
+    allowed: bool
+    remaining: int
+    blocked_until: Optional[float]  # Epoch seconds, None if the user is not blocked
+    notify: bool  # First message refused by the current block: the user gets the notice
 
 
 class SessionManager:
     def __init__(self):
         ###### REDIS CLIENT ######
-        self.redis_client = redis.StrictRedis.from_url(
-            settings.redis_url,
-            decode_responses=True,
-            db=settings.empresa_db
-        )
+        self.redis_client = get_redis()
+        # Encoded values (history entries, order data) are binary, so they are read without decoding
+        self.binary_client = get_redis(decode_responses=False)
+        self.codec = Codec(settings.session_codec, settings.session_compress_min_bytes)
+        # Local copies of the session keys, started with the app (see SessionCache.start)
+        # (not on a cluster, where keyspace notifications are per node)
+        self.cluster = settings.redis_cluster
+        self.cache = SessionCache(get_pubsub_redis(), settings.empresa_db, 0 if self.cluster else settings.session_cache_max_entries)
         self.max_messages_per_hour = 25 # Max messages per hour
-        ###### LOCAL REDIS CLIENT ######
-        # self.redis_client = redis.StrictRedis(
-        #     host="localhost",
-        #     port=6379,
-        #     db=0,
-        #     decode_responses=True
-        # )
-        # self.max_messages_per_hour = 25 # Max messages per hour
-
-    def create_session(self, user_id: str) -> str:
+        self.block_seconds = 3600 # How long a user stays blocked after reaching the limit
+        self.idle_reset_seconds = settings.session_idle_reset_seconds # Inactivity after which the conversation starts over
+        self.session_ttl_ms = settings.session_ttl_seconds * 1000 # Inactivity after which the session keys expire
+        self.rate_limit_script = self.redis_client.register_script(RATE_LIMIT_SCRIPT)
+        self.append_script = self.redis_client.register_script(SESSION_APPEND_SCRIPT)
+        self.update_script = self.redis_client.register_script(SESSION_UPDATE_SCRIPT)
+        self.reset_script = self.redis_client.register_script(SESSION_RESET_SCRIPT)
+        self.delete_script = self.redis_client.register_script(SESSION_DELETE_SCRIPT)
+
+    def _user_tag(self, user_id: str) -> str:
+        """Short hash of the user ID, used as the hash tag of all the keys of the user."""
+        return hashlib.sha1(user_id.encode("utf-8")).hexdigest()[:16]
+
+    def _session_prefix(self, session_id: str) -> str:
+        # Session IDs are "<user tag>.<uuid>": the tag in braces keeps every key of a user on one cluster slot,
+        # so the session scripts can touch the meta, the history and the user mapping at once
+        if "." in session_id:
+            tag, session_uuid = session_id.split(".", 1)
+            return f"session:{{{tag}}}:{session_uuid}"
+        return f"session:{session_id}"  # Sessions created before the hash tags
+
+    def _session_id_from_key(self, key: str) -> str:
+        """Inverse of `_session_prefix` for a session:*:history or session:*:meta key."""
+        parts = key.split(":")
+        if parts[1].startswith("{"):
+            return f"{parts[1][1:-1]}.{parts[2]}"
+        return parts[1]
+
+    def _history_key(self, session_id: str) -> str:
+        return f"{self._session_prefix(session_id)}:history"
+
+    def _meta_key(self, session_id: str) -> str:
+        return f"{self._session_prefix(session_id)}:meta"
+
+    def _user_session_key(self, user_id: str) -> str:
+        return f"user_session:{{{self._user_tag(user_id)}}}"
+
+    def _rate_keys(self, user_id: str) -> List[str]:
+        # Same hash tag, so the limiter script can run on a cluster
+        tag = self._user_tag(user_id)
+        return [f"user_limit:{{{tag}}}:window", f"user_limit:{{{tag}}}:blocked"]
+
+    async def _reset_session(self, session_id: str, user_id: str):
+        """
+        Writes an empty session in the split schema.
+        The history starts empty: the session only keeps the version ID of its prompt.
+        """
+        keys = [self._meta_key(session_id), self._history_key(session_id), self._user_session_key(user_id)]
+        await self.reset_script(keys=keys, args=[user_id, prompt_registry.current_id, datetime.now().isoformat(), self.session_ttl_ms])
+        self.cache.invalidate(*keys)
+
+    async def create_session(self, user_id: str) -> str:
         """Creates a new session and returns the session ID."""
-        if self.redis_client.exists(f"user_session:{user_id}"):
+        session_id = f"{self._user_tag(user_id)}.{uuid4()}"
+        # NX: of two concurrent first messages only one creates the session
+        if not await self.redis_client.set(self._user_session_key(user_id), session_id, nx=True, px=self.session_ttl_ms):
             raise ValueError(f"User {user_id} already has an active session")
+        self.cache.invalidate(self._user_session_key(user_id))
         
-        session_id = str(uuid4())
-        session_data = {
-            "history": [{"bot": config.settings.INITIAL_PROMPT, "user_id": user_id}],
-            "last_activity": datetime.now().isoformat()
-        }
-        
-        self.redis_client.set(f"session:{session_id}", json.dumps(session_data))
-        self.redis_client.set(f"user_session:{user_id}", session_id)
-        
-        if not self.redis_client.exists(f"user_limit:{user_id}"):
-            user_limit = {
-                "message_count": 0,
-                "last_message_time": datetime.now().isoformat(),
-                "blocked": False
-            }
-            self.redis_client.set(f"user_limit:{user_id}", json.dumps(user_limit))
-            
+        await self._reset_session(session_id, user_id)
         return session_id
 
-    def is_within_limit(self, user_id: str) -> Tuple[bool, int]:
-        """Check if the user is within the message limit and clear history if more than 5 minutes have passed."""
-        user_limit_data = self.redis_client.get(f"user_limit:{user_id}")
-        if user_limit_data:
-            user_limit = json.loads(user_limit_data)
-            last_message_time = datetime.fromisoformat(user_limit["last_message_time"])
-            now = datetime.now()
-            time_diff = now - last_message_time
-
-            if time_diff > timedelta(minutes=5):
-                session_id = self.get_session_by_user(user_id)
-                if session_id:
-                    self.clear_session(session_id)
-                user_limit["last_message_time"] = now.isoformat()
-                self.redis_client.set(f"user_limit:{user_id}", json.dumps(user_limit))
-
-                if user_limit["blocked"]:
-                    if time_diff > timedelta(hours=1):
-                        user_limit["blocked"] = False
-                        user_limit["message_count"] = 0
-                        self.redis_client.set(f"user_limit:{user_id}", json.dumps(user_limit))
-                    else:
-                        raise ValueError("El camarero está muy ocupado y no podrá atenderle más por ahora. Por favor, inténtelo de nuevo más tarde.")
-                else:
-                    user_limit["message_count"] = 0
-                    self.redis_client.set(f"user_limit:{user_id}", json.dumps(user_limit))
-
-            if user_limit["blocked"]:
-                if time_diff > timedelta(hours=1):
-                    user_limit["blocked"] = False
-                    user_limit["message_count"] = 0
-                    user_limit["last_message_time"] = now.isoformat()
-                    self.redis_client.set(f"user_limit:{user_id}", json.dumps(user_limit))
-                else:
-                    raise ValueError("El camarero está muy ocupado y no podrá atenderle más por ahora. Por favor, inténtelo de nuevo más tarde.")
-
-            if user_limit["message_count"] < self.max_messages_per_hour:
-                return True, user_limit["message_count"]
-
-        return False, 0
-
-    def increment_message_count(self, user_id: str):
-        """Increment the message count for the user."""
-        user_limit_data = self.redis_client.get(f"user_limit:{user_id}")
-        if user_limit_data:
-            user_limit = json.loads(user_limit_data)
-            user_limit["message_count"] += 1
-            user_limit["last_message_time"] = datetime.now().isoformat()
-            if user_limit["message_count"] >= self.max_messages_per_hour:
-                user_limit["blocked"] = True
-            self.redis_client.set(f"user_limit:{user_id}", json.dumps(user_limit))
-
-    def add_to_session(self, session_id: str, user_id: str, user_message: str, bot_response: str):
-        """Adds a user message and bot response to the session."""
-        if not self.is_within_limit(user_id)[0]:
-            raise ValueError("Message limit exceeded or user is blocked")
+    async def _migrate_legacy_session(self, session_id: str) -> bool:
+        """
+        Converts a session stored as one JSON string (`session:{id}`) into the history list
+        and the meta hash. Returns False if there is no legacy session with that ID.
+        """
+        # Sessions with a hash tag were never stored in the legacy format (nor are there legacy ones on a cluster)
+        if "." in session_id or self.cluster:
+            return False
 
-        session_data = self.redis_client.get(f"session:{session_id}")
-        if not session_data:
-            raise ValueError(f"Invalid session id {session_id}")
-        
-        session = json.loads(session_data)
-        session["history"].append({"user": user_message, "bot": bot_response, "user_id": user_id})
-        session["last_activity"] = datetime.now().isoformat()
+        legacy_key = f"session:{session_id}"
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            try:
+                # WATCH: if another request migrates the session first, this one does not overwrite it
+                await pipe.watch(legacy_key)
+                session_data = await pipe.get(legacy_key)
+                if not session_data:
+                    return False
+
+                pipe.multi()
+                self._queue_migration(pipe, session_id, json.loads(session_data))
+                await pipe.execute()
+            except WatchError:
+                metrics.increment("session_cas_conflicts")
+                return bool(await self.redis_client.exists(self._meta_key(session_id)))
+            finally:
+                self.cache.invalidate(self._meta_key(session_id), self._history_key(session_id))
+        return True
+
+    def _queue_migration(self, pipe, session_id: str, session: Dict):
+        """Queues the commands that rewrite a legacy session in the split schema."""
+        history = session.get("history", [])
+        meta = {
+            "user_id": history[0].get("user_id", "") if history else "",
+            "last_activity": session.get("last_activity", datetime.now().isoformat()),
+            "turns": sum(1 for entry in history if "user" in entry),
+            "summarized_count": session.get("summarized_count", 0),
+            "version": 1,
+        }
+        # Drop the stored copy of the prompt when it is a known version
+        if history and "user" not in history[0] and make_prompt_id(history[0].get("bot", "")) in prompt_registry.prompts:
+            meta["prompt_id"] = make_prompt_id(history.pop(0)["bot"])
+        if session.get("summary"):
+            meta["summary"] = session["summary"]
+        if session.get("payment_link"):
+            meta["payment_link"] = session["payment_link"]
+        if session.get("order_data"):
+            meta["order_data"] = self.codec.encode(session["order_data"])
+
+        pipe.delete(self._history_key(session_id), self._meta_key(session_id))
+        if history:
+            pipe.rpush(self._history_key(session_id), *[self.codec.encode(entry) for entry in history])
+        pipe.hset(self._meta_key(session_id), mapping=meta)
+        pipe.delete(f"session:{session_id}")
+        pipe.pexpire(self._history_key(session_id), self.session_ttl_ms)
+        pipe.pexpire(self._meta_key(session_id), self.session_ttl_ms)
+
+    async def _strip_stored_prompt(self, session_id: str) -> bool:
+        """
+        Replaces the copy of the prompt at the head of a split-schema history by its version ID.
+        Returns False if the history does not start with a known prompt.
+        """
+        if "." in session_id or self.cluster:
+            return False
+
+        async with self.binary_client.pipeline(transaction=True) as pipe:
+            try:
+                # WATCH: a concurrent strip must not pop a second entry
+                await pipe.watch(self._history_key(session_id))
+                first_entry = await pipe.lindex(self._history_key(session_id), 0)
+                if not first_entry:
+                    return False
+                entry = self.codec.decode(first_entry)
+                prompt_id = make_prompt_id(entry.get("bot", ""))
+                if "user" in entry or prompt_id not in prompt_registry.prompts:
+                    return False
+
+                pipe.multi()
+                pipe.lpop(self._history_key(session_id))
+                pipe.hset(self._meta_key(session_id), "prompt_id", prompt_id)
+                pipe.hincrby(self._meta_key(session_id), "version", 1)
+                await pipe.execute()
+            except WatchError:
+                metrics.increment("session_cas_conflicts")
+                return False
+            finally:
+                self.cache.invalidate(self._meta_key(session_id), self._history_key(session_id))
+        return True
+
+    async def migrate_legacy_sessions(self) -> int:
+        """
+        Migrates every session still stored as a single JSON string, and removes the copy
+        of the prompt from the histories that still have one. Returns how many were migrated.
+        """
+        migrated = 0
+        async for key in self.redis_client.scan_iter(match="session:*", count=500):
+            # New keys are session:{tag}:{uuid}:history and :meta (session:{id}:history and :meta before
+            # the hash tags), legacy ones session:{id}
+            if key.endswith((":history", ":meta")):
+                # Keys written before TTLs existed
+                await self.redis_client.pexpire(key, self.session_ttl_ms, nx=True)
+            if key.endswith(":history"):
+                if await self._strip_stored_prompt(self._session_id_from_key(key)):
+                    migrated += 1
+                continue
+            if key.count(":") != 1 or await self.redis_client.type(key) != "string":
+                continue
+            if await self._migrate_legacy_session(key.split(":", 1)[1]):
+                migrated += 1
+
+        async for key in self.redis_client.scan_iter(match="user_session:*", count=500):
+            if key.startswith("user_session:{"):
+                await self.redis_client.pexpire(key, self.session_ttl_ms, nx=True)
+                continue
+            # Mapping keyed by the raw user ID, before the hash tags
+            session_id = await self.redis_client.get(key)
+            if session_id:
+                await self.redis_client.set(self._user_session_key(key.split(":", 1)[1]), session_id, nx=True, px=self.session_ttl_ms)
+            await self.redis_client.delete(key)
+
+        # Message counters of the old limiter, replaced by the sliding window keys
+        async for key in self.redis_client.scan_iter(match="user_limit:*", count=500):
+            if not key.endswith(("}:window", "}:blocked")):
+                await self.redis_client.delete(key)
+        return migrated
+
+    async def _load_meta(self, session_id: str) -> Dict[str, bytes]:
+        """
+        Returns the meta hash of the session, empty if the session does not exist.
+        Served from the local cache when possible; legacy sessions are migrated first.
+        """
+        key = self._meta_key(session_id)
+        meta = self.cache.get(key)
+        if meta is MISSING:
+            epoch = self.cache.begin()
+            raw_meta = await self.binary_client.hgetall(key)
+            if not raw_meta and await self._migrate_legacy_session(session_id):
+                epoch = self.cache.begin()
+                raw_meta = await self.binary_client.hgetall(key)
+            meta = {field.decode(): value for field, value in raw_meta.items()}
+            self.cache.put(key, meta, epoch)
+        return meta
+
+    async def _get_meta_fields(self, session_id: str, *fields: str) -> List[Optional[str]]:
+        meta = await self._load_meta(session_id)
+        return [meta[field].decode() if field in meta else None for field in fields]
+
+    async def _get_binary_fields(self, session_id: str, *fields: str) -> List[Optional[bytes]]:
+        """Like `_get_meta_fields`, for fields holding encoded values."""
+        meta = await self._load_meta(session_id)
+        return [meta.get(field) for field in fields]
+
+    async def _update_meta(self, session_id: str, fields: Optional[Dict[str, Union[str, bytes, int]]] = None, delete: Tuple[str, ...] = (),
+                           expected_version: Optional[int] = None, version_field: str = "version") -> int:
+        """
+        Sets and deletes fields of the session meta in one atomic step, bumping `version_field` ("version"
+        for the whole session, "order_version" for the order data) along with the session version.
+        With `expected_version` the write only happens if `version_field` did not change since it was read.
+        Returns the new session version, -1 if the session does not exist or -2 if the version changed.
+        """
+        args = [self.session_ttl_ms, version_field, "" if expected_version is None else str(expected_version), len(fields or {})]
+        for field, value in (fields or {}).items():
+            args += [field, value]
+        args += list(delete)
+
+        keys = [self._meta_key(session_id), self._history_key(session_id)]
+        result = await self.update_script(keys=keys, args=args)
+        if result == -1 and await self._migrate_legacy_session(session_id):
+            result = await self.update_script(keys=keys, args=args)
+        # Also when the compare-and-set failed: the retry must not read the same stale copy
+        self.cache.invalidate(*keys)
+        return result
+
+    async def _cas_backoff(self, attempt: int):
+        """Counts a lost compare-and-set and waits a little, with jitter, before retrying."""
+        metrics.increment("session_cas_conflicts")
+        await asyncio.sleep(random.uniform(0, 0.01 * (attempt + 1)))
+
+    async def check_rate_limit(self, user_id: str) -> RateLimit:
+        """
+        Counts a new message of the user against the sliding window limit, in one atomic round trip.
+        Reaching the limit blocks the user for `block_seconds`; blocked messages are not counted.
+        """
+        allowed, remaining, blocked_until, notify = await self.rate_limit_script(
+            keys=self._rate_keys(user_id),
+            args=[3600 * 1000, self.max_messages_per_hour, self.block_seconds * 1000, uuid4().hex]
+        )
+        return RateLimit(
+            allowed=bool(allowed),
+            remaining=int(remaining),
+            blocked_until=int(blocked_until) / 1000 if blocked_until else None,
+            notify=bool(notify)
+        )
+
+    async def get_idle_seconds(self, session_id: str) -> Optional[float]:
+        """
+        Seconds since the last turn of the session (or since it started over), None if it does not exist.
+        Taken from the session itself: clearing a session also resets the message window of the user.
+        """
+        last_activity, = await self._get_meta_fields(session_id, "last_activity")
+        if not last_activity:
+            return None
+        return (datetime.now() - datetime.fromisoformat(last_activity)).total_seconds()
+
+    async def add_to_session(self, session_id: str, user_id: str, user_message: str, bot_response: str):
+        """Adds a user message and bot response to the session."""
+        # Append-only: the new turn is pushed to the list, the rest of the history is not read
+        entry = self.codec.encode({"user": user_message, "bot": bot_response, "user_id": user_id})
+        keys = [self._meta_key(session_id), self._history_key(session_id), self._user_session_key(user_id)]
+        args = [entry, datetime.now().isoformat(), self.session_ttl_ms]
         
-        self.redis_client.set(f"session:{session_id}", json.dumps(session))
-        self.increment_message_count(user_id)
+        result = await self.append_script(keys=keys, args=args)
+        if result == -1 and await self._migrate_legacy_session(session_id):
+            result = await self.append_script(keys=keys, args=args)
+        self.cache.invalidate(*keys[:2])
+        if result == -1:
+            raise ValueError(f"Invalid session id {session_id}")
 
-    def get_session(self, session_id: str) -> List[Dict[str, str]]:
-        """Returns the session data for a given session ID."""
-        session_data = self.redis_client.get(f"session:{session_id}")
-        if not session_data:
+    async def get_session(self, session_id: str) -> List[Dict[str, str]]:
+        """
+        Returns the session history for a given session ID.
+        Sessions started before prompt versioning also have the prompt as their first entry.
+        """
+        history_key, meta_key = self._history_key(session_id), self._meta_key(session_id)
+        entries, meta = self.cache.get(history_key), self.cache.get(meta_key)
+        if entries is MISSING or meta is MISSING:
+            # Both keys in one round trip
+            for _ in range(2):
+                epoch = self.cache.begin()
+                async with self.binary_client.pipeline(transaction=False) as pipe:
+                    pipe.lrange(history_key, 0, -1)
+                    pipe.hgetall(meta_key)
+                    raw_entries, raw_meta = await pipe.execute()
+                if raw_meta or not await self._migrate_legacy_session(session_id):
+                    break
+
+            entries = [self.codec.decode(entry) for entry in raw_entries]
+            meta = {field.decode(): value for field, value in raw_meta.items()}
+            self.cache.put(history_key, entries, epoch)
+            self.cache.put(meta_key, meta, epoch)
+        if not meta:
             raise ValueError(f"Invalid session id {session_id}")
         
-        session = json.loads(session_data)
-        return session["history"]
+        return list(entries)
+    
+    async def get_prompt_id(self, session_id: str) -> Optional[str]:
+        """Returns the version ID of the prompt the session was started with."""
+        prompt_id, = await self._get_meta_fields(session_id, "prompt_id")
+        return prompt_id
+    
+    async def get_summary(self, session_id: str) -> Tuple[Optional[str], int]:
+        """Returns the rolling summary of the session and how many turns it covers."""
+        summary, summarized_count = await self._get_meta_fields(session_id, "summary", "summarized_count")
+        return summary or None, int(summarized_count or 0)
+    
+    async def update_summary(self, session_id: str, summary: str, summarized_count: int, expected_count: int):
+        """
+        Stores a new rolling summary, unless the session changed since the summarized turns were read
+        (it was cleared or another summary was stored first).
+        """
+        for attempt in range(MAX_CAS_RETRIES):
+            current_count, turns, version = await self._get_meta_fields(session_id, "summarized_count", "turns", "version")
+            if turns is None:
+                return
+            
+            if int(current_count or 0) != expected_count or int(turns) < summarized_count:
+                return
+            
+            result = await self._update_meta(
+                session_id,
+                {"summary": summary, "summarized_count": summarized_count},
+                expected_version=int(version or 0)
+            )
+            if result != -2:
+                return
+            await self._cas_backoff(attempt)
     
-    def get_session_by_user(self, user_id: str) -> Optional[str]:
+    async def get_session_by_user(self, user_id: str) -> Optional[str]:
         """Returns the session ID for a given user ID, if exists."""
-        session_id = self.redis_client.get(f"user_session:{user_id}")
+        key = self._user_session_key(user_id)
+        session_id = self.cache.get(key)
+        if session_id is MISSING:
+            epoch = self.cache.begin()
+            session_id = await self.redis_client.get(key)
+            if session_id is None and not self.cluster:
+                # Mapping stored before the hash tags: copy it to the new key
+                session_id = await self.redis_client.get(f"user_session:{user_id}")
+                if session_id:
+                    await self.redis_client.set(key, session_id, nx=True, px=self.session_ttl_ms)
+                    self.cache.invalidate(key)
+            self.cache.put(key, session_id, epoch)
         return session_id if session_id else None
             
-    def clear_session(self, session_id: str):
-        """Clears the session data for a given session ID and resets the message count."""
-        session_data = self.redis_client.get(f"session:{session_id}")
-        if session_data:
-            session = json.loads(session_data)
-            user_id = session["history"][0]["user_id"]
-            new_session_data = {
-                "history": [{"bot": config.settings.INITIAL_PROMPT, "user_id": user_id}],
-                "last_activity": datetime.now().isoformat()
-            }
-            self.redis_client.set(f"session:{session_id}", json.dumps(new_session_data))
-
-            # Reset the message count for the user
-            user_limit_data = self.redis_client.get(f"user_limit:{user_id}")
-            if user_limit_data:
-                user_limit = json.loads(user_limit_data)
-                user_limit["message_count"] = 0
-                user_limit["last_message_time"] = datetime.now().isoformat()
-                self.redis_client.set(f"user_limit:{user_id}", json.dumps(user_limit))
+    async def _archive_snapshot(self, session_id: str) -> Optional[Dict]:
+        """
+        Reads the whole session from Redis (not from the local cache) as an archive record.
+        None if the session does not exist.
+        """
+        history_key, meta_key = self._history_key(session_id), self._meta_key(session_id)
+        for _ in range(2):
+            async with self.binary_client.pipeline(transaction=False) as pipe:
+                pipe.lrange(history_key, 0, -1)
+                pipe.hgetall(meta_key)
+                raw_entries, raw_meta = await pipe.execute()
+            if raw_meta or not await self._migrate_legacy_session(session_id):
+                break
+        if not raw_meta:
+            return None
+
+        meta = {field.decode(): value for field, value in raw_meta.items()}
+        text = lambda field: meta[field].decode() if field in meta else None
+        order_data = self.codec.decode(meta["order_data"]) if meta.get("order_data") else None
+        return {
+            "session_id": session_id,
+            "user_id": text("user_id"),
+            "order_ids": [order_data["order_id"]] if order_data and order_data.get("order_id") else [],
+            "version": int(text("version") or 0),
+            "prompt_id": text("prompt_id"),
+            "last_activity": text("last_activity"),
+            "summary": text("summary"),
+            "payment_link": text("payment_link"),
+            "order_data": order_data,
+            "history": [self.codec.decode(entry) for entry in raw_entries],
+        }
+
+    async def clear_session(self, session_id: str, archive_reason: str = "cleared"):
+        """
+        Clears the session data for a given session ID and resets the message count.
+        The conversation is handed to the archiver first, with `archive_reason`.
+        """
+        snapshot = await self._archive_snapshot(session_id)
+        if snapshot is not None:
+            if snapshot["history"]:
+                conversation_archiver.submit(dict(snapshot, reason=archive_reason))
+            user_id = snapshot["user_id"]
+            await self._reset_session(session_id, user_id)
+            # Reset the message count for the user (a block in progress is kept)
+            await self.redis_client.delete(self._rate_keys(user_id)[0])
             
-    def add_payment_link(self, session_id: str, payment_link: str):
+    async def add_payment_link(self, session_id: str, payment_link: str):
         """Adds a payment link to the session."""
-        session_data = self.redis_client.get(f"session:{session_id}")
-        if session_data:
-            session = json.loads(session_data)
-            session["payment_link"] = payment_link
-            self.redis_client.set(f"session:{session_id}", json.dumps(session))
+        await self._update_meta(session_id, {"payment_link": payment_link})
     
-    def get_payment_link(self, session_id: str) -> Optional[str]:
-        session_data = self.redis_client.get(f"session:{session_id}")
-        if session_data:
-            session = json.loads(session_data)
-            return session.get("payment_link")
-        return None
+    async def get_payment_link(self, session_id: str) -> Optional[str]:
+        payment_link, = await self._get_meta_fields(session_id, "payment_link")
+        return payment_link
     
-    def clear_payment_link(self, session_id: str):
+    async def clear_payment_link(self, session_id: str):
         """Clear the payment link from the session."""
-        session_data = self.redis_client.get(f"session:{session_id}")
-        if session_data:
-            session = json.loads(session_data)
-            if "payment_link" in session:
-                del session["payment_link"]
-                self.redis_client.set(f"session:{session_id}", json.dumps(session))
+        await self._update_meta(session_id, delete=("payment_link",))
             
-    def add_order_data(self, session_id: str, order_data: Dict):
+    async def add_order_data(self, session_id: str, order_data: Dict):
         """Adds the order data to the session."""
-        session_data = self.redis_client.get(f"session:{session_id}")
-        if not session_data:
+        if await self._update_meta(session_id, {"order_data": self.codec.encode(order_data)}, version_field="order_version") == -1:
             raise ValueError("Invalid session ID")
         
-        session = json.loads(session_data)
-        session["order_data"] = order_data
-        self.redis_client.set(f"session:{session_id}", json.dumps(session))
-        
-    def get_order_data(self, session_id: str) -> Optional[Dict]:
+    async def get_order_data(self, session_id: str) -> Optional[Dict]:
         """Returns the order data for a given session ID."""
-        session_data = self.redis_client.get(f"session:{session_id}")
-        if session_data:
-            session = json.loads(session_data)
-            return session.get("order_data")
-        return None
+        if not session_id:
+            return None
+        order_data, = await self._get_binary_fields(session_id, "order_data")
+        return self.codec.decode(order_data) if order_data else None
     
-    def update_order_data(self, session_id: str, updated_data: Dict):
+    async def update_order_data(self, session_id: str, updated_data: Dict):
         """
         Updates the order data for a given session ID with new values.
         """
-        # Obtener los datos de la sesión desde Redis
-        session_data = self.redis_client.get(f"session:{session_id}")
-        if not session_data:
-            raise ValueError("Invalid session ID")
-        
-        # Cargar la sesión y los datos del pedido
-        session = json.loads(session_data)
-        order_data = session.get("order_data")
-        if not order_data:
-            raise ValueError("No order data found in the session")
-        
-        # Actualizar los campos del pedido con los datos nuevos
-        order_data.update(updated_data)
+        for attempt in range(MAX_CAS_RETRIES):
+            # Leer solo el campo del pedido y su versión
+            user_id, order_data, order_version = await self._get_binary_fields(session_id, "user_id", "order_data", "order_version")
+            if user_id is None:
+                raise ValueError("Invalid session ID")
+            if not order_data:
+                raise ValueError("No order data found in the session")
+            
+            # Actualizar los campos del pedido con los datos nuevos
+            order_data = self.codec.decode(order_data)
+            order_data.update(updated_data)
+            
+            # Guardar el pedido solo si nadie lo ha cambiado mientras tanto (los mensajes nuevos no cuentan)
+            result = await self._update_meta(
+                session_id,
+                {"order_data": self.codec.encode(order_data)},
+                expected_version=int(order_version or 0),
+                version_field="order_version"
+            )
+            if result == -1:
+                raise ValueError("Invalid session ID")
+            if result != -2:
+                return
+            await self._cas_backoff(attempt)
         
-        # Guardar la sesión actualizada en Redis
-        session["order_data"] = order_data
-        self.redis_client.set(f"session:{session_id}", json.dumps(session))
+        raise ValueError("The order data changed concurrently, try again")
     
-    def clear_order_data(self, session_id: str):
+    async def clear_order_data(self, session_id: str):
         """Clear the order data from the session."""
-        session_data = self.redis_client.get(f"session:{session_id}")
-        if session_data:
-            session = json.loads(session_data)
-            if "order_data" in session:
-                del session["order_data"]
-                self.redis_client.set(f"session:{session_id}", json.dumps(session))
+        await self._update_meta(session_id, delete=("order_data",), version_field="order_version")
             
+    async def archive_idle_sessions(self) -> int:
+        """
+        Archives and removes the sessions without activity for `settings.archive_idle_seconds`,
+        so conversations that never reach the payment do not wait in Redis for their TTL.
+        A session that gets a message while it is archived is kept. Returns how many were archived.
+        """
+        cutoff = datetime.now() - timedelta(seconds=settings.archive_idle_seconds)
+        archived = 0
+        async for key in self.redis_client.scan_iter(match="session:*:meta", count=500):
+            last_activity, = await self.redis_client.hmget(key, "last_activity")
+            if not last_activity or datetime.fromisoformat(last_activity) > cutoff:
+                continue
+            session_id = self._session_id_from_key(key)
+            snapshot = await self._archive_snapshot(session_id)
+            if snapshot is None:
+                continue
+
+            keys = [self._meta_key(session_id), self._history_key(session_id), self._user_session_key(snapshot["user_id"])]
+            removed = await self.delete_script(keys=keys, args=[snapshot["version"], session_id])
+            self.cache.invalidate(*keys)
+            # Sessions without history (started over after a payment) are only removed
+            if removed and snapshot["history"]:
+                conversation_archiver.submit(dict(snapshot, reason="idle"))
+                archived += 1
+        return archived
+
+    async def memory_report(self, sample_size: int = 200) -> Dict[str, Dict]:
+        """
+        Scans every key of the database and groups them by family, with the keys without TTL.
+        MEMORY USAGE is only asked for the first `sample_size` keys of each family, and the
+        total bytes are estimated from their average.
+        """
+        report: Dict[str, Dict] = {}
+        async for key in self.redis_client.scan_iter(count=1000):
+            family = next((name for name, pattern in KEY_FAMILIES if pattern.match(key)), "other")
+            stats = report.setdefault(family, {"keys": 0, "no_ttl": 0, "sampled": 0, "sampled_bytes": 0})
+            stats["keys"] += 1
+            if stats["sampled"] < sample_size:
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    pipe.memory_usage(key)
+                    pipe.pttl(key)
+                    usage, ttl = await pipe.execute()
+                stats["sampled"] += 1
+                stats["sampled_bytes"] += usage or 0
+                stats["no_ttl"] += ttl == -1
+
+        for stats in report.values():
+            average = stats["sampled_bytes"] / stats["sampled"] if stats["sampled"] else 0
+            stats["avg_bytes"] = round(average)
+            stats["estimated_bytes"] = round(average * stats["keys"])
+        return report
+
 # Global instance of the SessionManager
 session_manager = SessionManager()
+
+if __name__ == "__main__":
+    # python -m app.services.session_service: migrates the sessions stored in the legacy format
+    # python -m app.services.session_service memory: memory used by every key family
+    import sys
+    if sys.argv[1:] == ["memory"]:
+        report = asyncio.run(session_manager.memory_report())
+        print(f"{'family':<22}{'keys':>10}{'avg bytes':>12}{'est. total':>14}{'no TTL*':>10}")
+        for family, stats in sorted(report.items(), key=lambda item: -item[1]["estimated_bytes"]):
+            print(f"{family:<22}{stats['keys']:>10}{stats['avg_bytes']:>12}{stats['estimated_bytes']:>14}{stats['no_ttl']:>10}")
+        print("* among the sampled keys")
+        sys.exit(0)
+    print(f"Migrated {asyncio.run(session_manager.migrate_legacy_sessions())} sessions")
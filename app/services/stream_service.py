@@ -0,0 +1,94 @@
+import asyncio
+import re
+from typing import Awaitable, Callable, Optional
+
+# Header of the order summary; from there on the reply is sent as a single message
+ORDER_SUMMARY_HEADER = "Resumen del Pedido"
+
+# Line of dashes that opens and closes the items of the summary
+SUMMARY_DIVIDER_PATTERN = re.compile(r"^-{3,}[ \t]*\n", re.MULTILINE)
+
+PARAGRAPH_SEPARATOR = "\n\n"
+CODE_FENCE = "```"
+
+
+class ParagraphStream:
+    """
+    Splits a streamed reply into paragraphs and sends each one as soon as it is complete.
+    Sends are chained, so the paragraphs reach the user in the order they were written.
+    Once the order summary header shows up the rest of the reply is held back and sent
+    as one message when the stream ends, so the summary is never split.
+    """
+    def __init__(self, send: Callable[[str], Awaitable]):
+        self.send = send
+        self.text = ""
+        self.pending = ""
+        self.summary_started = False
+        self.sent_paragraphs = 0
+        self._last_send: Optional[asyncio.Task] = None
+
+    def feed(self, chunk: str):
+        """Adds a streamed chunk and dispatches the paragraphs it completes."""
+        self.text += chunk
+        self.pending += chunk
+        if self.summary_started:
+            return
+
+        while True:
+            split_at = self._next_split()
+            paragraph = self.pending if split_at is None else self.pending[:split_at]
+            if ORDER_SUMMARY_HEADER in paragraph:
+                self.summary_started = True
+                return
+            if split_at is None:
+                return
+
+            self.pending = self.pending[split_at + len(PARAGRAPH_SEPARATOR):]
+            if paragraph.strip():
+                self._dispatch(paragraph.strip())
+
+    def end_paragraph(self):
+        """Closes the current paragraph, for text that does not continue it (the next tool round)."""
+        if self.text.strip() and not self.text.endswith(PARAGRAPH_SEPARATOR):
+            self.feed(PARAGRAPH_SEPARATOR)
+
+    def completed_summary(self) -> Optional[str]:
+        """The order summary once its closing divider has been streamed, None until then."""
+        if not self.summary_started:
+            return None
+        summary = self.text[self.text.rfind(ORDER_SUMMARY_HEADER):]
+        dividers = list(SUMMARY_DIVIDER_PATTERN.finditer(summary))
+        return summary[:dividers[1].end()] if len(dividers) >= 2 else None
+
+    def _next_split(self) -> Optional[int]:
+        """Position of the first paragraph break that is not inside a code block."""
+        start = 0
+        while True:
+            index = self.pending.find(PARAGRAPH_SEPARATOR, start)
+            if index == -1:
+                return None
+            if self.pending[:index].count(CODE_FENCE) % 2 == 0:
+                return index
+            start = index + len(PARAGRAPH_SEPARATOR)
+
+    def _dispatch(self, text: str):
+        self._last_send = asyncio.create_task(self._send_after(self._last_send, text))
+        self.sent_paragraphs += 1
+
+    async def _send_after(self, previous: Optional[asyncio.Task], text: str):
+        # Wait for the previous paragraph; if it failed, the error is raised here too
+        if previous is not None:
+            await previous
+        await self.send(text)
+
+    async def finish(self, extra: Optional[str] = None):
+        """Sends what is left of the reply (plus `extra`) and waits for every send to finish."""
+        rest = self.pending.strip()
+        if extra:
+            rest = f"{rest}{PARAGRAPH_SEPARATOR}{extra}" if rest else extra
+        self.pending = ""
+        if rest:
+            self._dispatch(rest)
+
+        if self._last_send is not None:
+            await self._last_send
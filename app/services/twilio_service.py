@@ -1,14 +1,132 @@
+import asyncio
+import random
+import time
+from typing import Optional
+
+import aiohttp
+from requests.adapters import HTTPAdapter
+from twilio.http.async_http_client import AsyncTwilioHttpClient
+from twilio.http.http_client import TwilioHttpClient
+from twilio.http.response import Response
 from twilio.rest import Client
+from urllib3.util.retry import Retry
 
 from app.core.config import settings
+from app.shared.metrics import metrics
+
+# Responses retried on reads. A POST (sending a message) is only retried when Twilio certainly did
+# not process it, rate limited (429) or unavailable (503): after a 500 the message may already exist.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+UNPROCESSED_STATUSES = {429, 503}
+
+
+def _retryable(method: str, status: int) -> bool:
+    if method.upper() == "GET":
+        return status in RETRY_STATUSES
+    return status in UNPROCESSED_STATUSES
+
+def _retry_delay(attempt: int, response: Optional[Response]) -> float:
+    """Exponential backoff with full jitter, or the Retry-After of the response when it has one."""
+    retry_after = response.headers.get("Retry-After") if response is not None and response.headers else None
+    if retry_after:
+        try:
+            return min(float(retry_after), settings.twilio_retry_backoff_cap_seconds)
+        except ValueError:
+            pass
+    return random.uniform(0, min(settings.twilio_retry_backoff_cap_seconds, settings.twilio_retry_backoff_base_seconds * 2 ** attempt))
+
+
+class PooledTwilioHttpClient(TwilioHttpClient):
+    """
+    Sync HTTP client of the Twilio SDK on one requests session: bounded pool of keep-alive
+    connections, a default timeout and retries with backoff (see `_retryable`).
+    Connection failures are retried by urllib3, only before anything was sent.
+    """
+    def __init__(self):
+        super().__init__(timeout=settings.twilio_timeout_seconds)
+        adapter = HTTPAdapter(
+            pool_maxsize=settings.twilio_max_connections,
+            pool_block=True,
+            max_retries=Retry(total=None, connect=settings.twilio_retry_attempts, read=0, status=0, redirect=0, other=0,
+                              backoff_factor=settings.twilio_retry_backoff_base_seconds)
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, params=None, data=None, headers=None, auth=None, timeout=None, allow_redirects=False) -> Response:
+        for attempt in range(settings.twilio_retry_attempts + 1):
+            response = super().request(method, url, params, data, headers, auth, timeout, allow_redirects)
+            if attempt == settings.twilio_retry_attempts or not _retryable(method, response.status_code):
+                return response
+            metrics.increment("twilio_retries")
+            time.sleep(_retry_delay(attempt, response))
+
+
+class PooledAsyncTwilioHttpClient(AsyncTwilioHttpClient):
+    """Async counterpart of `PooledTwilioHttpClient`, on one aiohttp session. Create it inside the running loop."""
+    def __init__(self):
+        super().__init__(pool_connections=False, timeout=settings.twilio_timeout_seconds)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=settings.twilio_max_connections, keepalive_timeout=30)
+        )
+
+    async def request(self, method, url, params=None, data=None, headers=None, auth=None, timeout=None, allow_redirects=False) -> Response:
+        # The SDK passes no timeout by default, which aiohttp takes as no timeout at all
+        timeout = timeout or self.timeout
+        for attempt in range(settings.twilio_retry_attempts + 1):
+            try:
+                response = await super().request(method, url, params, data, headers, auth, timeout, allow_redirects)
+            except aiohttp.ClientConnectorError:
+                # The connection could not be opened, so nothing was sent
+                if attempt == settings.twilio_retry_attempts:
+                    raise
+                response = None
+            else:
+                if attempt == settings.twilio_retry_attempts or not _retryable(method, response.status_code):
+                    return response
+            metrics.increment("twilio_retries")
+            await asyncio.sleep(_retry_delay(attempt, response))
 
 
 class TwilioService:
+    """
+    Sends the WhatsApp messages. One instance serves the whole process (`twilio_service`),
+    so every send reuses the pooled connections instead of opening a new session.
+    """
     def __init__(self):
-        # Init Twilio client with credentials
-        self.client = Client(settings.twilio_account_sid, settings.twilio_auth_token) # Twilio client
+        # The clients are created on first use: the app only sends through the async one
+        self.sync_client: Optional[Client] = None
+        self.async_client: Optional[Client] = None
+        self.async_loop: Optional[asyncio.AbstractEventLoop] = None
         self.from_phone = f"whatsapp:{settings.twilio_phone_number}" # Twilio phone number
-        
+
+    def _make_client(self, http_client) -> Client:
+        client = Client(settings.twilio_account_sid, settings.twilio_auth_token, http_client=http_client)
+        if settings.twilio_api_base_url:
+            client.api.base_url = settings.twilio_api_base_url
+        return client
+
+    @property
+    def client(self) -> Client:
+        """Sync Twilio client, for the callers outside an event loop."""
+        if self.sync_client is None:
+            self.sync_client = self._make_client(PooledTwilioHttpClient())
+        return self.sync_client
+
+    def _get_async_client(self) -> Client:
+        # The aiohttp session has to be created inside the running loop, so it is created on first use
+        loop = asyncio.get_running_loop()
+        if self.async_client is None or self.async_loop is not loop:
+            self.async_client = self._make_client(PooledAsyncTwilioHttpClient())
+            self.async_loop = loop
+        return self.async_client
+
+    async def close(self):
+        """Closes the pooled connections of the async client."""
+        if self.async_client is not None:
+            await self.async_client.http_client.close()
+            self.async_client = None
+
     def send_whatsapp_message(self, to_phone: str, message: str):
         # Send message to phone number
         try:
@@ -26,4 +144,26 @@ class TwilioService:
             }
         
         except Exception as e:
-            raise Exception(f"Error sending message: {e}")
\ No newline at end of file
+            raise Exception(f"Error sending message: {e}")
+            
+    async def send_whatsapp_message_async(self, to_phone: str, message: str):
+        # Send message to phone number without blocking the event loop
+        try:
+            message = await self._get_async_client().messages.create_async(
+                body = message,
+                from_ = self.from_phone,
+                to = to_phone
+            )
+            
+            return {
+                "sid": message.sid,
+                "status": message.status,
+                "to": message.to,
+                "body": message.body
+            }
+        
+        except Exception as e:
+            raise Exception(f"Error sending message: {e}")
+
+# Global instance of the TwilioService
+twilio_service = TwilioService()
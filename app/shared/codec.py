@@ -0,0 +1,145 @@
+import json
+import time
+from typing import Any, Dict, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# First byte of every encoded value: the format, plus COMPRESSED_FLAG if the payload is zstd compressed.
+# Values written before the codec existed are plain JSON text and start with "{" or "[", never with a tag.
+FORMAT_TAGS = {"json": 0x01, "orjson": 0x02, "msgpack": 0x03}
+COMPRESSED_FLAG = 0x10
+TAG_FORMATS = {tag: name for name, tag in FORMAT_TAGS.items()}
+
+
+class Codec:
+    """
+    Serializes the values stored in Redis (history entries, order data) to bytes.
+    The format is orjson or msgpack when they are installed, and payloads above
+    `compress_min_bytes` are compressed with zstd (0 disables the compression).
+    Every value is decoded by its tag, so the format can change without migrating data.
+    """
+    def __init__(self, format: str = "orjson", compress_min_bytes: int = 1024):
+        if format not in FORMAT_TAGS:
+            raise ValueError(f"Unknown codec format {format}")
+        if (format == "orjson" and orjson is None) or (format == "msgpack" and msgpack is None):
+            print(f"Codec {format} is not installed, using json")
+            format = "json"
+
+        self.format = format
+        self.compress_min_bytes = compress_min_bytes if zstandard is not None else 0
+        self.compressor = zstandard.ZstdCompressor(level=3) if zstandard is not None else None
+        self.decompressor = zstandard.ZstdDecompressor() if zstandard is not None else None
+
+    def _dumps(self, format: str, value: Any) -> bytes:
+        if format == "orjson":
+            return orjson.dumps(value)
+        if format == "msgpack":
+            return msgpack.packb(value, use_bin_type=True)
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def _loads(self, format: str, payload: bytes) -> Any:
+        if format == "orjson":
+            return orjson.loads(payload)
+        if format == "msgpack":
+            return msgpack.unpackb(payload, raw=False)
+        return json.loads(payload)
+
+    def encode(self, value: Any) -> bytes:
+        tag = FORMAT_TAGS[self.format]
+        payload = self._dumps(self.format, value)
+        if self.compress_min_bytes and len(payload) >= self.compress_min_bytes:
+            payload = self.compressor.compress(payload)
+            tag |= COMPRESSED_FLAG
+        return bytes([tag]) + payload
+
+    def decode(self, data: Union[bytes, str]) -> Any:
+        if isinstance(data, str):
+            return json.loads(data)
+        if not data or data[:1] in (b"{", b"["):
+            return json.loads(data)  # Legacy JSON text
+
+        tag, payload = data[0], data[1:]
+        if tag & COMPRESSED_FLAG:
+            if self.decompressor is None:
+                raise ValueError("Value is zstd compressed but zstandard is not installed")
+            payload = self.decompressor.decompress(payload)
+            tag &= ~COMPRESSED_FLAG
+        if tag not in TAG_FORMATS:
+            raise ValueError(f"Unknown codec tag {tag}")
+        return self._loads(TAG_FORMATS[tag], payload)
+
+
+def sample_session(turns: int = 20) -> Dict:
+    """Session history and order shaped like the real ones, for the benchmark."""
+    reply = (
+        "¡Perfecto! He añadido a tu pedido una Hamburguesa Clásica con extra de queso cheddar y "
+        "sin cebolla. ¿Te gustaría algo de beber? Tenemos Coca Cola, Fanta de naranja, agua "
+        "mineral y cerveza. Recuerda que puedes consultar los alérgenos de cualquier plato. "
+    )
+    history = [
+        {"user": f"Quiero una hamburguesa clásica con queso, mensaje {i}", "bot": reply * 2, "user_id": "whatsapp:+34600000000"}
+        for i in range(turns)
+    ]
+    order = {
+        "order_id": "ORD-20250101-0001",
+        "table_number": 7,
+        "dishes": [
+            {"name": "Hamburguesa Clásica", "price": 9.5, "quantity": 2,
+             "extras": [{"name": "Queso Cheddar", "price": 1.0, "quantity": 1}], "exclusions": [{"name": "Cebolla"}]},
+        ],
+        "drinks": [{"name": "Coca Cola", "price": 2.2, "quantity": 2}],
+        "total": 25.4,
+    }
+    return {"history": history, "order_data": order}
+
+def benchmark(rounds: int = 2000) -> Dict[str, Dict[str, float]]:
+    """
+    Encodes and decodes one history entry, a whole history and an order with every available
+    codec, against the current json.dumps text. Returns bytes stored and µs per encode/decode.
+    """
+    session = sample_session()
+    values = {"entry": session["history"][0], "history": session["history"], "order": session["order_data"]}
+    codecs = {"json text (current)": None}
+    for format in FORMAT_TAGS:
+        if (format == "orjson" and orjson is None) or (format == "msgpack" and msgpack is None):
+            continue
+        codecs[format] = Codec(format, compress_min_bytes=0)
+        if zstandard is not None:
+            codecs[f"{format}+zstd"] = Codec(format, compress_min_bytes=1024)
+
+    results = {}
+    for name, codec in codecs.items():
+        encode = (lambda value: json.dumps(value)) if codec is None else codec.encode
+        decode = json.loads if codec is None else codec.decode
+        for label, value in values.items():
+            encoded = encode(value)
+            start = time.perf_counter()
+            for _ in range(rounds):
+                encode(value)
+            encode_us = (time.perf_counter() - start) / rounds * 1e6
+            start = time.perf_counter()
+            for _ in range(rounds):
+                decode(encoded)
+            decode_us = (time.perf_counter() - start) / rounds * 1e6
+            size = len(encoded.encode("utf-8")) if isinstance(encoded, str) else len(encoded)
+            results[f"{name} / {label}"] = {"bytes": size, "encode_us": round(encode_us, 2), "decode_us": round(decode_us, 2)}
+    return results
+
+if __name__ == "__main__":
+    # python -m app.shared.codec: benchmark of the codecs against the current JSON text
+    print(f"{'codec / value':<34}{'bytes':>10}{'encode µs':>12}{'decode µs':>12}")
+    for name, result in benchmark().items():
+        print(f"{name:<34}{result['bytes']:>10}{result['encode_us']:>12}{result['decode_us']:>12}")
@@ -0,0 +1,26 @@
+from collections import defaultdict
+from typing import Dict
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = defaultdict(int)
+
+    def increment(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def get(self, name: str) -> int:
+        return self.counters.get(name, 0)
+
+    def ratio(self, part: str, total: str) -> float:
+        total_value = self.get(total)
+        if not total_value:
+            return 0.0
+        return round(self.get(part) / total_value, 4)
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(self.counters)
+
+
+# Instancia global del singleton
+metrics = Metrics()
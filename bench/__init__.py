@@ -0,0 +1 @@
+# Archivo vacío para definir `bench` como un paquete: servidores falsos y benchmarks que no forman parte de la app.
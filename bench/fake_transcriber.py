@@ -0,0 +1,96 @@
+import asyncio
+import io
+import time
+from typing import Dict, List, Tuple
+
+from pydub import AudioSegment
+from pydub.generators import Sine
+from pydub.silence import detect_nonsilent
+
+# Vocabulary of the synthetic voice notes: every word is a tone of its own frequency
+WORDS = ["para", "la", "mesa", "siete", "queremos", "tres", "hamburguesas", "una", "sin", "queso"]
+BASE_HZ = 300
+STEP_HZ = 80
+
+
+def make_spoken_note(words: List[str], word_ms: int = 450, pause_ms: int = 400) -> bytes:
+    """Synthetic voice note (ogg/opus) with one tone per word of `WORDS`, separated by pauses."""
+    note = AudioSegment.silent(duration=pause_ms, frame_rate=16000)
+    for word in words:
+        tone = Sine(BASE_HZ + STEP_HZ * WORDS.index(word), sample_rate=16000).to_audio_segment(duration=word_ms, volume=-12)
+        note += tone + AudioSegment.silent(duration=pause_ms, frame_rate=16000)
+    output = io.BytesIO()
+    note.set_channels(1).export(output, format="ogg", codec="libopus", bitrate="32k")
+    return output.getvalue()
+
+
+class LocalTranscriber:
+    """
+    Offline stand-in for the Whisper API, to benchmark the chunked transcription without the network.
+    It "hears" the tones of `make_spoken_note` (by their frequency) and answers after a latency that
+    grows with the duration of the audio, like the real API: `base_ms` + `ms_per_audio_second`.
+    """
+    def __init__(self, base_ms: float = 500, ms_per_audio_second: float = 50, silence_threshold_dbfs: float = -35):
+        self.base_ms = base_ms
+        self.ms_per_audio_second = ms_per_audio_second
+        self.silence_threshold_dbfs = silence_threshold_dbfs
+        self.calls = 0
+
+    def _hear(self, audio: bytes) -> Tuple[List[str], int]:
+        segment = AudioSegment.from_file(io.BytesIO(audio), format="ogg", codec="opus").set_channels(1)
+        words = []
+        for start, end in detect_nonsilent(segment, min_silence_len=150, silence_thresh=self.silence_threshold_dbfs):
+            # 100 ms from the middle of the word are enough to tell its frequency
+            middle = (start + end) // 2
+            samples = segment[middle - 50:middle + 50].get_array_of_samples()
+            crossings = sum(1 for a, b in zip(samples, samples[1:]) if (a < 0) != (b < 0))
+            frequency = crossings / 2 / (len(samples) / segment.frame_rate)
+            index = round((frequency - BASE_HZ) / STEP_HZ)
+            words.append(WORDS[index] if 0 <= index < len(WORDS) else "?")
+        return words, len(segment)
+
+    async def transcribe(self, audio: bytes, filename: str) -> str:
+        self.calls += 1
+        start = time.perf_counter()
+        words, duration_ms = await asyncio.to_thread(self._hear, audio)
+        # The time spent hearing counts as part of the simulated latency
+        latency_ms = self.base_ms + self.ms_per_audio_second * duration_ms / 1000
+        await asyncio.sleep(max(0, latency_ms / 1000 - (time.perf_counter() - start)))
+        return " ".join(words)
+
+
+async def benchmark(repeats: int = 6, chunk_seconds: Tuple[int, ...] = (0, 20, 10), max_parallel: int = 4) -> Dict[str, Dict]:
+    """
+    Prepares and transcribes one long synthetic order with the stand-in backend, whole (0) and in
+    chunks of `chunk_seconds`, and checks that the stitched text keeps every word in order.
+    The transcription latencies are the simulated ones of `LocalTranscriber`, not Whisper's.
+    """
+    from app.core.config import settings
+    from app.services.audio_service import audio_preprocessor
+    from app.services.openai_service import transcribe_audio_chunks
+
+    words = "para la mesa siete queremos tres hamburguesas una sin queso".split() * repeats
+    note = make_spoken_note(words)
+    await audio_preprocessor.start()
+    results = {}
+    try:
+        for seconds in chunk_seconds:
+            settings.transcription_max_parallel = max_parallel
+            transcriber = LocalTranscriber()
+            start = time.perf_counter()
+            chunks = await audio_preprocessor.prepare(note, "order.ogg", seconds * 1000)
+            text = await transcribe_audio_chunks(chunks, transcriber.transcribe)
+            results[f"chunks of {seconds}s" if seconds else "whole note"] = {
+                "calls": transcriber.calls,
+                "seconds": round(time.perf_counter() - start, 3),
+                "in_order": text.split() == words,
+            }
+    finally:
+        audio_preprocessor.shutdown()
+    return results
+
+if __name__ == "__main__":
+    # python -m bench.fake_transcriber: whole vs chunked transcription of a long order, offline (needs ffmpeg;
+    # the latencies are simulated, see LocalTranscriber)
+    for name, result in asyncio.run(benchmark()).items():
+        print(f"{name:<16}{result['calls']:>4} calls{result['seconds']:>9}s  in order: {result['in_order']}")
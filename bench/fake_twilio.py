@@ -0,0 +1,140 @@
+import asyncio
+import random
+import time
+from itertools import count
+from typing import Dict, List, Optional, Set, Tuple
+
+from aiohttp import web
+
+from app.shared.metrics import metrics
+
+
+class FakeTwilioServer:
+    """
+    Local stand-in for the Twilio Messages API, for tests and benchmarks of the senders.
+    It answers `POST /2010-04-01/Accounts/{sid}/Messages.json` like Twilio does, after `latency_ms`,
+    and fails a share of the requests with 429 or 503 (`failure_rate`) to exercise the retries.
+    Point the app at it with TWILIO_API_BASE_URL=http://127.0.0.1:<port>.
+    """
+    def __init__(self, port: int = 8765, latency_ms: float = 20, failure_rate: float = 0.0):
+        self.port = port
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.messages: List[Dict] = []
+        self.peers: Set[Tuple[str, int]] = set()  # Client addresses seen, one per TCP connection
+        self._ids = count(1)
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def connections(self) -> int:
+        """TCP connections opened by the clients; fewer than requests means keep-alive works."""
+        return len(self.peers)
+
+    async def _create_message(self, request: web.Request) -> web.Response:
+        self.peers.add(request.transport.get_extra_info("peername"))
+        await asyncio.sleep(self.latency_ms / 1000)
+        if random.random() < self.failure_rate:
+            status = random.choice([429, 503])
+            return web.json_response({"code": 20429 if status == 429 else 20503, "message": "Fake failure", "status": status},
+                                     status=status, headers={"Retry-After": "0"})
+
+        form = await request.post()
+        sid = f"SM{next(self._ids):032x}"
+        message = {
+            "sid": sid,
+            "account_sid": request.match_info["account_sid"],
+            "from": form.get("From"),
+            "to": form.get("To"),
+            "body": form.get("Body"),
+            "status": "queued",
+            "num_segments": "1",
+            "direction": "outbound-api",
+            "api_version": "2010-04-01",
+            "date_created": time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime()),
+            "uri": f"/2010-04-01/Accounts/{request.match_info['account_sid']}/Messages/{sid}.json",
+        }
+        self.messages.append(message)
+        return web.json_response(message, status=201)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/2010-04-01/Accounts/{account_sid}/Messages.json", self._create_message)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", self.port)
+        await site.start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def benchmark(messages: int = 200, concurrency: int = 20, latency_ms: float = 20) -> Dict[str, Dict[str, float]]:
+    """
+    Sends `messages` through the fake server with a new Twilio client per message (as before)
+    and with the pooled `twilio_service`, `concurrency` at a time. Returns the time and connections of each.
+    """
+    from twilio.http.async_http_client import AsyncTwilioHttpClient
+    from twilio.rest import Client
+
+    from app.core.config import settings
+    from app.services.twilio_service import twilio_service
+
+    server = FakeTwilioServer(latency_ms=latency_ms)
+    await server.start()
+    settings.twilio_api_base_url = server.base_url
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fresh_client(i: int):
+        async with semaphore:
+            client = Client(settings.twilio_account_sid, settings.twilio_auth_token,
+                            http_client=AsyncTwilioHttpClient(pool_connections=False))
+            client.api.base_url = server.base_url
+            await client.messages.create_async(body=f"message {i}", from_="whatsapp:+10000000000", to="whatsapp:+10000000001")
+
+    async def pooled(i: int):
+        async with semaphore:
+            await twilio_service.send_whatsapp_message_async("whatsapp:+10000000001", f"message {i}")
+
+    results = {}
+    try:
+        twilio_service.async_client = None  # Recreated against the fake server
+        for name, send in [("client per message", fresh_client), ("pooled twilio_service", pooled)]:
+            connections_before = server.connections
+            start = time.perf_counter()
+            await asyncio.gather(*[send(i) for i in range(messages)])
+            elapsed = time.perf_counter() - start
+            results[name] = {
+                "seconds": round(elapsed, 3),
+                "messages_per_second": round(messages / elapsed, 1),
+                "connections": server.connections - connections_before,
+            }
+    finally:
+        await twilio_service.close()
+        await server.stop()
+    return results
+
+if __name__ == "__main__":
+    # python -m bench.fake_twilio: benchmark of the senders against the fake server
+    # python -m bench.fake_twilio serve [port] [failure rate]: only runs the fake server
+    import sys
+    if sys.argv[1:2] == ["serve"]:
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+        failure_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+
+        async def serve():
+            server = FakeTwilioServer(port=port, failure_rate=failure_rate)
+            await server.start()
+            print(f"Fake Twilio API on {server.base_url} (failure rate {failure_rate})")
+            await asyncio.Event().wait()
+        asyncio.run(serve())
+    else:
+        print(f"{'sender':<24}{'seconds':>10}{'msg/s':>10}{'connections':>14}")
+        for name, result in asyncio.run(benchmark()).items():
+            print(f"{name:<24}{result['seconds']:>10}{result['messages_per_second']:>10}{result['connections']:>14}")
+        print(f"Retries: {metrics.get('twilio_retries')}")
@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+# Settings has no defaults for the credentials: the tests never reach the real services
+for name in [
+    "OPENAI_API_KEY", "STRIPE_SECRET_KEY", "STRIPE_PUBLISHABLE_KEY", "STRIPE_ENDPOINT_SECRET",
+    "TWILIO_ACCOUNT_SID", "TWILIO_AUTH_TOKEN", "TWILIO_PHONE_NUMBER", "TWILIO_SENDGRID_API_KEY",
+    "REDSYS_SECRET_KEY", "REDSYS_BASE_URL", "REDSYS_SUCCESS_URL", "REDSYS_FAILURE_URL",
+    "REDSYS_NOTIFICATION_URL", "REDSYS_MERCHANT_CODE", "EMAIL_SENDER", "EMAIL_COMPANY",
+]:
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379")
+os.environ.setdefault("EMPRESA_DB", "0")
+
+
+@pytest.fixture
+def session_manager():
+    """SessionManager on an in-memory fakeredis server (its cache stays off, it is never started)."""
+    fakeredis = pytest.importorskip("fakeredis")
+    from app.services import session_service
+
+    server = fakeredis.FakeServer()
+    manager = session_service.SessionManager()
+    manager.redis_client = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+    manager.binary_client = fakeredis.FakeAsyncRedis(server=server)
+    manager.rate_limit_script = manager.redis_client.register_script(session_service.RATE_LIMIT_SCRIPT)
+    manager.append_script = manager.redis_client.register_script(session_service.SESSION_APPEND_SCRIPT)
+    manager.update_script = manager.redis_client.register_script(session_service.SESSION_UPDATE_SCRIPT)
+    manager.reset_script = manager.redis_client.register_script(session_service.SESSION_RESET_SCRIPT)
+    manager.delete_script = manager.redis_client.register_script(session_service.SESSION_DELETE_SCRIPT)
+    return manager
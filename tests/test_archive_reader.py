@@ -0,0 +1,57 @@
+import asyncio
+from datetime import datetime
+
+from app.services.archive_service import ArchiveReader, ConversationArchiver
+
+ALICE = "whatsapp:+34600000001"
+BOB = "whatsapp:+34600000002"
+
+
+def conversation(user_id, day, order_ids=(), text="hola"):
+    return {
+        "user_id": user_id,
+        "session_id": f"{user_id}-{day}",
+        "order_ids": list(order_ids),
+        "history": [{"user": text, "bot": "¡Hola!"}],
+        "archived_at": f"2025-01-{day:02d}T12:00:00",
+    }
+
+
+def archive(directory, batches, **options):
+    archiver = ConversationArchiver(str(directory), **options)
+
+    async def write():
+        for batch in batches:
+            for record in batch:
+                archiver.submit(record)
+            await archiver.flush()
+    asyncio.run(write())
+    return ArchiveReader(str(directory))
+
+
+def test_lookup_by_user_reads_every_batch_oldest_first(tmp_path):
+    reader = archive(tmp_path, [
+        [conversation(ALICE, 3, text="segunda"), conversation(BOB, 1)],
+        [conversation(ALICE, 1, ["ORD-1"], text="primera")],
+    ])
+    assert [record["history"][0]["user"] for record in reader.find_by_user(ALICE)] == ["primera", "segunda"]
+    assert [record["user_id"] for record in reader.find_by_order("ORD-1")] == [ALICE]
+    assert reader.find_by_user("whatsapp:+34600000009") == []
+
+
+def test_lookup_by_date_includes_the_start_and_excludes_the_end(tmp_path):
+    reader = archive(tmp_path, [[conversation(ALICE, day) for day in (1, 2, 3)], [conversation(BOB, 2)]])
+    found = reader.find_by_date(datetime(2025, 1, 2), datetime(2025, 1, 3, 12))
+    assert [(record["user_id"], record["archived_at"][:10]) for record in found] == [
+        (ALICE, "2025-01-02"), (BOB, "2025-01-02")
+    ]
+
+
+def test_full_segments_roll_over_and_stay_readable(tmp_path):
+    reader = archive(tmp_path, [[conversation(ALICE, day, text="x" * 2000)] for day in range(1, 5)], segment_max_bytes=100)
+    assert len(list(tmp_path.glob("segment-*.jsonl.gz"))) == 4
+    assert len(reader.find_by_user(ALICE)) == 4
+    # A line cut by a crash in the index is skipped
+    with next(tmp_path.glob("index-*.jsonl")).open("a") as index_file:
+        index_file.write('{"user_id": "whatsapp:+346')
+    assert len(reader.find_by_date(datetime(2025, 1, 1), datetime(2025, 2, 1))) == 4
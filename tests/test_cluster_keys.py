@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+from redis.crc import key_slot
+
+from app.services.queue_service import MessageQueue
+
+USER_ID = "whatsapp:+34600000001"
+
+
+def test_every_key_of_a_user_is_on_one_slot(session_manager):
+    session_id = asyncio.run(session_manager.create_session(USER_ID))
+    keys = [
+        session_manager._meta_key(session_id),
+        session_manager._history_key(session_id),
+        session_manager._user_session_key(USER_ID),
+        *session_manager._rate_keys(USER_ID),
+    ]
+    assert len({key_slot(key.encode()) for key in keys}) == 1
+    # Another user lands on its own tag
+    assert session_manager._user_session_key("whatsapp:+34600000002") != session_manager._user_session_key(USER_ID)
+
+
+def test_session_ids_and_keys_map_both_ways(session_manager):
+    session_id = asyncio.run(session_manager.create_session(USER_ID))
+    tag, _ = session_id.split(".", 1)
+    assert tag == session_manager._user_tag(USER_ID)
+    for key in (session_manager._meta_key(session_id), session_manager._history_key(session_id)):
+        assert key.startswith(f"session:{{{tag}}}:")
+        assert session_manager._session_id_from_key(key) == session_id
+
+    # Sessions created before the hash tags keep their keys
+    legacy_id = "0b5e6f2c-1111-4222-8333-944455556666"
+    assert session_manager._history_key(legacy_id) == f"session:{legacy_id}:history"
+    assert session_manager._session_id_from_key(session_manager._meta_key(legacy_id)) == legacy_id
+
+
+def test_the_queue_dedupe_keys_share_the_slot_of_the_stream():
+    fakeredis = pytest.importorskip("fakeredis")
+    queue = MessageQueue(fakeredis.FakeAsyncRedis(decode_responses=True))
+
+    async def scenario():
+        await queue.enqueue({"Body": "hola"}, dedupe_id="SM1")
+        return [key async for key in queue.redis_client.scan_iter("*seen*")]
+
+    seen_keys = asyncio.run(scenario())
+    assert len(seen_keys) == 1 and key_slot(seen_keys[0].encode()) == key_slot(queue.stream.encode())
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from app.shared import codec as codec_module
+from app.shared.codec import COMPRESSED_FLAG, FORMAT_TAGS, Codec, sample_session
+
+ORDER = {"dishes": [{"name": "Hamburguesa Clásica", "price": 9.5, "quantity": 2, "extras": []}], "total": 19.0, "paid": False}
+
+
+@pytest.mark.parametrize("format", ["json", "orjson", "msgpack"])
+def test_every_format_round_trips_and_is_tagged(format):
+    if format != "json" and getattr(codec_module, format) is None:
+        pytest.skip(f"{format} is not installed")
+    codec = Codec(format, compress_min_bytes=0)
+    encoded = codec.encode(ORDER)
+    assert encoded[0] == FORMAT_TAGS[format]
+    assert codec.decode(encoded) == ORDER
+    # Any codec reads what another one wrote: the tag says the format
+    assert Codec("json").decode(encoded) == ORDER
+
+
+def test_large_values_are_compressed():
+    if codec_module.zstandard is None:
+        pytest.skip("zstandard is not installed")
+    session = sample_session(turns=40)
+    codec = Codec("json", compress_min_bytes=1024)
+    encoded = codec.encode(session)
+    assert encoded[0] == FORMAT_TAGS["json"] | COMPRESSED_FLAG
+    assert len(encoded) < len(json.dumps(session))
+    assert codec.decode(encoded) == session
+    assert Codec("json", compress_min_bytes=1024).encode({"a": 1})[0] == FORMAT_TAGS["json"]
+
+
+def test_legacy_json_text_is_still_read():
+    codec = Codec()
+    assert codec.decode(json.dumps(ORDER)) == ORDER
+    assert codec.decode(json.dumps(ORDER).encode("utf-8")) == ORDER
+    assert codec.decode(b'[{"user": "hola"}]') == [{"user": "hola"}]
+
+
+def test_unknown_formats_and_tags_are_rejected():
+    with pytest.raises(ValueError):
+        Codec("pickle")
+    with pytest.raises(ValueError, match="Unknown codec tag"):
+        Codec().decode(bytes([0x07]) + b"{}")
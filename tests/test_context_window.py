@@ -0,0 +1,72 @@
+import asyncio
+
+from app.services.context_service import (
+    build_context, count_message_tokens, count_tokens, select_turns_to_fold, split_history
+)
+
+SYSTEM_PROMPT = "Eres el camarero del restaurante."
+TURNS = [{"user": f"pregunta número {i} sobre la carta", "bot": f"respuesta número {i} con todos los detalles"} for i in range(10)]
+TURN_TOKENS = sum(count_message_tokens({"content": text}) for text in (TURNS[0]["user"], TURNS[0]["bot"]))
+
+
+def context_tokens(messages):
+    return sum(count_message_tokens(message) for message in messages)
+
+
+def test_token_estimate():
+    assert count_tokens("") == 0
+    assert count_tokens("hola, ¿qué tal?") == 6  # 3 words and 3 punctuation marks
+    assert count_tokens("hamburguesas") == 3  # One token per 4 characters
+
+
+def test_history_is_split_into_prompt_and_turns():
+    assert split_history([{"bot": SYSTEM_PROMPT}, *TURNS[:2]]) == (SYSTEM_PROMPT, TURNS[:2])
+    assert split_history(TURNS[:2]) == (None, TURNS[:2])
+
+
+def test_the_whole_conversation_is_sent_while_it_fits():
+    messages = build_context(SYSTEM_PROMPT, TURNS, None, "¿y de postre?", budget=10000, keep_turns=2)
+    assert len(messages) == 1 + 2 * len(TURNS) + 1
+    assert messages[0] == {"role": "system", "content": SYSTEM_PROMPT}
+    assert messages[-1] == {"role": "user", "content": "¿y de postre?"}
+
+
+def test_older_turns_are_dropped_to_fit_the_budget():
+    budget = 200
+    messages = build_context(SYSTEM_PROMPT, TURNS, "Pidió dos hamburguesas.", "¿y de postre?", budget=budget, keep_turns=2)
+    assert context_tokens(messages) <= budget
+    assert messages[1]["content"].endswith("Pidió dos hamburguesas.")
+    window = messages[2:-1]
+    # The newest turns, in their order, and as many as fit
+    assert window[-2:] == [{"role": "user", "content": TURNS[-1]["user"]}, {"role": "assistant", "content": TURNS[-1]["bot"]}]
+    assert [message["content"] for message in window[::2]] == [turn["user"] for turn in TURNS[-len(window) // 2:]]
+    assert context_tokens(messages) + TURN_TOKENS > budget
+
+
+def test_the_last_turns_are_kept_even_over_the_budget():
+    messages = build_context(SYSTEM_PROMPT, TURNS, None, "¿y de postre?", budget=10, keep_turns=3)
+    assert len(messages) == 1 + 2 * 3 + 1
+
+
+def test_turns_are_folded_only_once_the_budget_is_exceeded():
+    total = count_message_tokens({"content": SYSTEM_PROMPT}) + TURN_TOKENS * len(TURNS)
+    assert select_turns_to_fold(SYSTEM_PROMPT, TURNS, None, budget=total, keep_turns=4) == 0
+    assert select_turns_to_fold(SYSTEM_PROMPT, TURNS, None, budget=total - 1, keep_turns=4) == 6
+    assert select_turns_to_fold(SYSTEM_PROMPT, TURNS[:4], None, budget=1, keep_turns=4) == 0
+    # The summary takes part of the budget too
+    assert select_turns_to_fold(SYSTEM_PROMPT, TURNS, "Pidió dos hamburguesas.", budget=total, keep_turns=4) == 6
+
+
+def test_a_summary_of_stale_turns_is_not_stored(session_manager):
+    user_id = "whatsapp:+34600000001"
+
+    async def scenario():
+        session_id = await session_manager.create_session(user_id)
+        for turn in TURNS[:4]:
+            await session_manager.add_to_session(session_id, user_id, turn["user"], turn["bot"])
+        await session_manager.update_summary(session_id, "Resumen de 2", summarized_count=2, expected_count=0)
+        # Written from the same read as the first one: it no longer follows the stored summary
+        await session_manager.update_summary(session_id, "Resumen de 3", summarized_count=3, expected_count=0)
+        return await session_manager.get_summary(session_id)
+
+    assert asyncio.run(scenario()) == ("Resumen de 2", 2)
@@ -0,0 +1,55 @@
+import asyncio
+
+from app.services import openai_service, session_service
+
+USER_ID = "whatsapp:+34600000001"
+
+
+class RecordingArchiver:
+    def __init__(self):
+        self.records = []
+
+    def submit(self, record):
+        self.records.append(record)
+
+
+class SentMessages:
+    def __init__(self):
+        self.messages = []
+
+    def enqueue(self, to_phone, message):
+        self.messages.append((to_phone, message))
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(None)
+        return future
+
+    async def send(self, to_phone, message):
+        self.enqueue(to_phone, message)
+
+
+def test_two_messages_after_an_idle_reset_keep_the_new_conversation(monkeypatch, session_manager):
+    archiver = RecordingArchiver()
+    monkeypatch.setattr(session_service, "conversation_archiver", archiver)
+    monkeypatch.setattr(openai_service, "session_manager", session_manager)
+    monkeypatch.setattr(openai_service, "outbound_dispatcher", SentMessages())
+    session_manager.idle_reset_seconds = 0.2
+
+    async def fake_generate_response(messages):
+        return "Marchando", None
+    monkeypatch.setattr(openai_service, "generate_response", fake_generate_response)
+
+    async def scenario():
+        await openai_service.process_incoming_message(USER_ID, "mesa 2")
+        await asyncio.sleep(0.3)
+        await openai_service.process_incoming_message(USER_ID, "mesa 3 after idle")
+        session_id = await session_manager.get_session_by_user(USER_ID)
+        await session_manager.add_order_data(session_id, {"order_id": "123456789012", "total": 2.5})
+        await openai_service.process_incoming_message(USER_ID, "gracias")
+        session_id = await session_manager.get_session_by_user(USER_ID)
+        return await session_manager.get_session(session_id), await session_manager.get_order_data(session_id)
+
+    history, order_data = asyncio.run(scenario())
+    assert [turn["user"] for turn in history] == ["mesa 3 after idle", "gracias"]
+    assert order_data["order_id"] == "123456789012"
+    assert [record["reason"] for record in archiver.records] == ["idle_reset"]
+    assert [turn["user"] for turn in archiver.records[0]["history"]] == ["mesa 2"]
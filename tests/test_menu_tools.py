@@ -0,0 +1,50 @@
+import json
+
+from app.services.menu_service import MenuCatalog, normalize_name, run_menu_tool
+
+MENU = {
+    "categories": [
+        {"name": "Hamburguesas", "items": [
+            {"name": "Hamburguesa Clásica", "ingredients": "ternera, lechuga", "price": 9.5, "allergens": ["gluten"],
+             "extras": [{"name": "Bacon", "price": 1.5}, {"name": "Queso de cabra", "price": 2, "available": False}]},
+            {"name": "Hamburguesa Vegana", "price": 10, "available": False, "extras": [{"name": "Aguacate", "price": 1}]},
+        ]},
+        {"name": "Bebidas", "items": [{"name": "Agua", "price": 1.8}]},
+    ]
+}
+
+
+def call(tool, **arguments):
+    return run_menu_tool(MenuCatalog(MENU), tool, json.dumps(arguments))
+
+
+def test_names_are_matched_without_case_accents_or_extra_spaces():
+    assert normalize_name("  Hamburguesa  Clásica") == "hamburguesa clasica"
+    assert call("find_menu_item", name="HAMBURGUESA clasica")["items"][0]["name"] == "Hamburguesa Clásica"
+    assert [item["name"] for item in call("find_menu_item", name="hamburguesa")["items"]] == ["Hamburguesa Clásica", "Hamburguesa Vegana"]
+    assert call("find_menu_item", name="pizza") == {"error": "No está en el menú"}
+
+
+def test_categories_count_only_available_items():
+    assert call("list_menu_categories") == {"categories": [
+        {"name": "Hamburguesas", "available_items": 1}, {"name": "Bebidas", "available_items": 1}
+    ]}
+    items = call("get_category_items", category="hamburguesas")["items"]
+    assert items[0]["extras"][0] == {"name": "Bacon", "price": 1.5, "available": True}
+    assert call("get_category_items", category="postres")["categories"] == ["Hamburguesas", "Bebidas"]
+
+
+def test_check_extra():
+    assert call("check_extra", item="hamburguesa clasica", extra="BACON") == {
+        "valid": True, "item": "Hamburguesa Clásica", "extra": "Bacon", "price": 1.5
+    }
+    assert call("check_extra", item="hamburguesa clasica", extra="queso de cabra")["reason"] == "Ese extra no está disponible ahora"
+    assert call("check_extra", item="hamburguesa clasica", extra="piña")["extras"][0]["name"] == "Bacon"
+    assert call("check_extra", item="hamburguesa vegana", extra="aguacate")["reason"] == "Ese plato no está disponible ahora"
+    assert call("check_extra", item="pizza", extra="bacon")["valid"] is False
+
+
+def test_bad_calls_return_an_error_to_the_model():
+    catalog = MenuCatalog(MENU)
+    assert run_menu_tool(catalog, "find_menu_item", "{not json") == {"error": "Argumentos no válidos"}
+    assert run_menu_tool(catalog, "order_pizza", "{}") == {"error": "Herramienta desconocida: order_pizza"}
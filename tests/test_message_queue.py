@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.services.queue_service import MessageQueue
+
+
+def test_a_retried_webhook_is_queued_once():
+    async def scenario():
+        queue = MessageQueue(fakeredis.FakeAsyncRedis(decode_responses=True))
+        first = await queue.enqueue({"Body": "hola"}, dedupe_id="SM1")
+        retry = await queue.enqueue({"Body": "hola"}, dedupe_id="SM1")
+        other = await queue.enqueue({"Body": "adiós"}, dedupe_id="SM2")
+        ttl = await queue.redis_client.ttl(f"{{{queue.stream}}}:seen:SM1")
+        return first, retry, other, await queue.redis_client.xlen(queue.stream), ttl
+
+    first, retry, other, queued, ttl = asyncio.run(scenario())
+    assert first and other and retry is None
+    assert queued == 2
+    assert 0 < ttl <= 24 * 60 * 60
+
+
+def test_a_job_that_keeps_failing_is_dead_lettered_after_max_deliveries():
+    handled = []
+
+    async def failing_handler(payload):
+        handled.append(payload)
+        raise RuntimeError("boom")
+
+    async def scenario():
+        queue = MessageQueue(fakeredis.FakeAsyncRedis(decode_responses=True))
+        queue.visibility_timeout_ms = 0  # Failed jobs can be reclaimed right away
+        queue.max_deliveries = 3
+        await queue.enqueue({"Body": "hola"}, dedupe_id="SM1")
+        for _ in range(5):
+            for entry_id, fields in await queue.claim("worker", block_ms=1):
+                await queue.process("worker", entry_id, fields, failing_handler)
+        pending = await queue.redis_client.xpending(queue.stream, queue.group)
+        dead = await queue.redis_client.lrange(queue.dead_letter_key, 0, -1)
+        return pending["pending"], await queue.redis_client.xlen(queue.stream), dead
+
+    pending, left_in_stream, dead = asyncio.run(scenario())
+    assert len(handled) == 3
+    assert pending == 0 and left_in_stream == 0
+    assert [json.loads(job)["error"] for job in dead] == ["boom"]
+    assert json.loads(json.loads(dead[0])["payload"]) == {"Body": "hola"}
+
+
+def test_a_job_finished_in_the_background_is_acknowledged_or_retried_with_its_future():
+    async def scenario():
+        queue = MessageQueue(fakeredis.FakeAsyncRedis(decode_responses=True))
+        futures = []
+
+        async def deferring_handler(payload):
+            future = asyncio.get_running_loop().create_future()
+            futures.append(future)
+            return future
+
+        await queue.enqueue({"Body": "uno"}, dedupe_id="SM1")
+        await queue.enqueue({"Body": "dos"}, dedupe_id="SM2")
+        for entry_id, fields in await queue.claim("worker", count=2, block_ms=1):
+            await queue.process("worker", entry_id, fields, deferring_handler)
+        # Accepted but not finished: both jobs are still pending
+        before = (await queue.redis_client.xpending(queue.stream, queue.group))["pending"]
+        futures[0].set_result(None)
+        futures[1].set_exception(RuntimeError("boom"))
+        await asyncio.gather(*queue._deferred)
+        after = await queue.redis_client.xpending_range(queue.stream, queue.group, min="-", max="+", count=10)
+        return before, after
+
+    before, after = asyncio.run(scenario())
+    assert before == 2
+    # The finished job was acknowledged, the failed one waits for a retry
+    assert len(after) == 1 and after[0]["times_delivered"] == 1
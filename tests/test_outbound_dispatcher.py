@@ -0,0 +1,82 @@
+import asyncio
+import random
+import time
+
+import pytest
+
+from app.services.outbound_service import MERGE_SEPARATOR, OutboundDispatcher, TokenBucket
+
+
+class RecordingSender:
+    """Stand-in for Twilio that takes a random time per send and records what it sent, in order."""
+    def __init__(self, fail_on=()):
+        self.sent = []
+        self.fail_on = set(fail_on)
+
+    async def send(self, to_phone, message):
+        await asyncio.sleep(random.uniform(0, 0.005))
+        if message in self.fail_on:
+            raise RuntimeError(f"Error sending message: {message}")
+        self.sent.append((to_phone, message))
+        return {"to": to_phone, "body": message}
+
+
+def test_each_recipient_gets_its_messages_in_order():
+    random.seed(3)
+    sender = RecordingSender()
+
+    async def scenario():
+        dispatcher = OutboundDispatcher(sender.send, rate_per_second=10000, burst=100)
+        futures = [dispatcher.enqueue(f"whatsapp:+3460000000{r}", f"message {i}") for i in range(10) for r in range(5)]
+        await asyncio.gather(*futures)
+        return dispatcher
+
+    dispatcher = asyncio.run(scenario())
+    for r in range(5):
+        assert [message for to, message in sender.sent if to == f"whatsapp:+3460000000{r}"] == [f"message {i}" for i in range(10)]
+    assert dispatcher.queues == {} and dispatcher.workers == {}
+
+
+def test_a_failed_send_does_not_stop_the_queue_of_the_recipient():
+    sender = RecordingSender(fail_on={"message 1"})
+
+    async def scenario():
+        dispatcher = OutboundDispatcher(sender.send, rate_per_second=10000, burst=100)
+        futures = [dispatcher.enqueue("whatsapp:+34600000001", f"message {i}") for i in range(3)]
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert isinstance(results[1], RuntimeError)
+    assert [message for _, message in sender.sent] == ["message 0", "message 2"]
+
+
+def test_merged_messages_keep_their_order_and_the_length_limit():
+    sender = RecordingSender()
+
+    async def scenario():
+        dispatcher = OutboundDispatcher(sender.send, rate_per_second=10000, burst=100, merge=True, max_length=20)
+        futures = [dispatcher.enqueue("whatsapp:+34600000001", f"message {i}") for i in range(4)]
+        return await asyncio.gather(*futures)
+
+    results = asyncio.run(scenario())
+    bodies = [message for _, message in sender.sent]
+    assert all(len(body) <= 20 for body in bodies) and len(bodies) < 4
+    assert MERGE_SEPARATOR.join(bodies).split(MERGE_SEPARATOR) == [f"message {i}" for i in range(4)]
+    # Every caller gets the result of the send its message went in
+    assert results[0] is results[1]
+
+
+def test_the_bucket_allows_a_burst_and_then_the_rate():
+    async def scenario():
+        bucket = TokenBucket(rate=50, capacity=5)
+        start = time.monotonic()
+        times = []
+        for _ in range(15):
+            await bucket.acquire()
+            times.append(time.monotonic() - start)
+        return times
+
+    times = asyncio.run(scenario())
+    assert times[4] < 0.02  # The burst goes out at once
+    # The other 10 at 50 per second
+    assert times[-1] == pytest.approx(10 / 50, abs=0.05)
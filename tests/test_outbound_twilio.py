@@ -0,0 +1,72 @@
+import asyncio
+import random
+import socket
+
+import pytest
+
+from app.core.config import settings
+from app.services.outbound_service import OutboundDispatcher
+from app.services.twilio_service import TwilioService
+from app.shared.metrics import metrics
+from bench.fake_twilio import FakeTwilioServer
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def fake_twilio_settings(monkeypatch):
+    monkeypatch.setattr(settings, "twilio_account_sid", "AC" + "0" * 32)
+    monkeypatch.setattr(settings, "twilio_retry_attempts", 8)
+    monkeypatch.setattr(settings, "twilio_retry_backoff_base_seconds", 0.001)
+
+
+def test_dispatcher_delivers_every_message_in_order_through_failures(monkeypatch, fake_twilio_settings):
+    random.seed(7)
+    server = FakeTwilioServer(port=free_port(), latency_ms=1, failure_rate=0.3)
+    monkeypatch.setattr(settings, "twilio_api_base_url", server.base_url)
+    twilio_service = TwilioService()
+    retries_before = metrics.get("twilio_retries")
+
+    async def scenario():
+        await server.start()
+        dispatcher = OutboundDispatcher(twilio_service.send_whatsapp_message_async, rate_per_second=1000, burst=50)
+        try:
+            results = await asyncio.gather(*[
+                dispatcher.enqueue(f"whatsapp:+3460000000{r}", f"message {i}") for i in range(5) for r in range(4)
+            ])
+        finally:
+            await twilio_service.close()
+            await server.stop()
+        return results
+
+    results = asyncio.run(scenario())
+    assert len(results) == 20 and all(result["sid"].startswith("SM") for result in results)
+    received = {}
+    for message in server.messages:
+        received.setdefault(message["to"], []).append(message["body"])
+    assert received == {f"whatsapp:+3460000000{r}": [f"message {i}" for i in range(5)] for r in range(4)}
+    assert metrics.get("twilio_retries") > retries_before
+
+
+def test_a_send_that_keeps_failing_reaches_its_caller(monkeypatch, fake_twilio_settings):
+    monkeypatch.setattr(settings, "twilio_retry_attempts", 1)
+    server = FakeTwilioServer(port=free_port(), latency_ms=1, failure_rate=1.0)
+    monkeypatch.setattr(settings, "twilio_api_base_url", server.base_url)
+    twilio_service = TwilioService()
+
+    async def scenario():
+        await server.start()
+        dispatcher = OutboundDispatcher(twilio_service.send_whatsapp_message_async, rate_per_second=1000, burst=50)
+        try:
+            with pytest.raises(Exception, match="Error sending message"):
+                await dispatcher.send("whatsapp:+34600000001", "hola")
+        finally:
+            await twilio_service.close()
+            await server.stop()
+
+    asyncio.run(scenario())
+    assert server.messages == [] and twilio_service.sync_client is None
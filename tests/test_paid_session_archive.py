@@ -0,0 +1,55 @@
+import asyncio
+import base64
+import json
+from urllib.parse import quote, urlencode
+
+from app.routes import payment_routes
+from app.services import session_service
+
+USER_ID = "whatsapp:+34600000001"
+ORDER_ID = "123456789012"
+
+
+class RecordingArchiver:
+    def __init__(self):
+        self.records = []
+
+    def submit(self, record):
+        self.records.append(record)
+
+
+class SentMessages:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, to_phone, message):
+        self.messages.append((to_phone, message))
+
+
+def test_paid_session_is_archived_with_its_order(monkeypatch, session_manager):
+    archiver = RecordingArchiver()
+    monkeypatch.setattr(session_service, "conversation_archiver", archiver)
+    monkeypatch.setattr(payment_routes, "session_manager", session_manager)
+    monkeypatch.setattr(payment_routes, "outbound_dispatcher", SentMessages())
+    monkeypatch.setattr(payment_routes.pending_tickets_store, "add_ticket", lambda order_data: None)
+
+    async def no_email(to_email, order_data):
+        return None
+    monkeypatch.setattr(payment_routes, "send_payment_confirmation", no_email)
+
+    parameters = base64.b64encode(json.dumps({"Ds_MerchantData": quote(USER_ID)}).encode()).decode()
+    body = urlencode({"Ds_MerchantParameters": parameters, "Ds_Signature": "signature"}).encode()
+
+    async def scenario():
+        session_id = await session_manager.create_session(USER_ID)
+        await session_manager.add_to_session(session_id, USER_ID, "Una coca cola para la mesa 7", "🍽️ *Resumen del Pedido:* 🍽️")
+        await session_manager.add_order_data(session_id, {"order_id": ORDER_ID, "table_number": 7, "total": 2.5})
+        result = await payment_routes.payment_response_success(body)
+        return session_id, result, await session_manager.get_order_data(session_id)
+
+    session_id, result, order_data_left = asyncio.run(scenario())
+    assert result["status"] == "success"
+    assert [record["session_id"] for record in archiver.records] == [session_id]
+    assert archiver.records[0]["order_ids"] == [ORDER_ID]
+    assert archiver.records[0]["reason"] == "paid"
+    assert order_data_left is None
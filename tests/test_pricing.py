@@ -0,0 +1,63 @@
+from app.services.menu_service import MenuCatalog
+from app.services.pricing_service import PricingEngine, format_corrections, to_cents
+
+MENU = {
+    "categories": [
+        {"name": "Raciones", "items": [
+            {"name": "Croquetas", "price": {"half": 4.35, "full": 7.9}},
+            {"name": "Patatas Bravas", "price": 5.1, "extras": [{"name": "Alioli", "price": 0.7}, {"name": "Trufa", "price": 2, "available": False}]},
+            {"name": "Calamares", "price": 8, "available": False},
+        ]},
+        {"name": "Bebidas", "items": [{"name": "Caña", "price": 1.1}]},
+    ]
+}
+
+
+def price(order):
+    return PricingEngine(MenuCatalog(MENU)).price_order(order)
+
+
+def test_totals_are_exact_to_the_cent():
+    order, corrections = price({
+        "dishes": [{"name": "Patatas bravas", "price": 5.1, "quantity": 3, "extras": [{"name": "alioli", "price": 0.7}]}],
+        "drinks": [{"name": "caña", "price": 1.1, "quantity": 3}],
+    })
+    # In floats 5.1 * 3 + 0.7 + 1.1 * 3 is 19.299999999999997
+    assert order["total"] == 19.3 and to_cents(order["total"]) == 1930
+    assert corrections == []
+    assert order["dishes"][0]["extras"] == [{"name": "Alioli", "price": 0.7, "quantity": 1}]
+
+
+def test_portions_of_items_priced_by_size():
+    order, corrections = price({"dishes": [
+        {"name": "Croquetas (media)", "price": 4.35, "quantity": 1},
+        {"name": "Ración de croquetas", "price": 7.9, "quantity": 2},
+    ]})
+    assert [(dish["name"], dish["price"]) for dish in order["dishes"]] == [("Croquetas (media)", 4.35), ("Ración de croquetas", 7.9)]
+    assert order["total"] == 20.15 and corrections == []
+
+
+def test_wrong_prices_and_items_that_can_not_be_served_are_corrected():
+    order, corrections = price({
+        "dishes": [
+            {"name": "Patatas bravas", "price": 4, "quantity": 1, "extras": [{"name": "trufa", "price": 2}]},
+            {"name": "Calamares", "price": 8},
+            {"name": "Paella", "price": 12},
+        ],
+        "drinks": [{"name": "Caña", "price": "1.10", "quantity": "x"}],
+    })
+    assert order["total"] == 6.2
+    assert order["drinks"] == [{"name": "Caña", "price": 1.1, "quantity": 1}]
+    assert corrections == [
+        "El precio de Patatas Bravas es 5.10€.",
+        "trufa no es un extra disponible para Patatas Bravas y se ha quitado.",
+        "Calamares no está disponible y se ha quitado del pedido.",
+        "Paella no está en la carta y se ha quitado del pedido.",
+    ]
+    assert format_corrections(corrections, order).endswith("*Total a pagar*: 6.20€")
+
+
+def test_an_order_left_empty_asks_again():
+    order, corrections = price({"dishes": [{"name": "Paella", "price": 12}]})
+    assert order["total"] == 0 and order["dishes"] == []
+    assert format_corrections(corrections, order).endswith("¿Qué te gustaría pedir?")
@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.routes import openai_routes
+from app.services.coalesce_service import MessageCoalescer
+from app.services.queue_service import MessageQueue
+
+
+def test_burst_larger_than_the_workers_is_one_turn(monkeypatch):
+    turns = []
+
+    async def fake_turn(user_id, message, session_id=None):
+        turns.append((user_id, message))
+        return {"response": "ok"}
+
+    monkeypatch.setattr(openai_routes, "process_incoming_message", fake_turn)
+    monkeypatch.setattr(openai_routes, "message_coalescer", MessageCoalescer(window_ms=300, max_wait_ms=3000))
+
+    async def scenario():
+        queue = MessageQueue(fakeredis.FakeAsyncRedis(decode_responses=True))
+        claim = queue.claim
+
+        async def polling_claim(consumer, count=1, block_ms=5000):
+            entries = await claim(consumer, count, block_ms)
+            if not entries:
+                await asyncio.sleep(0.01)  # fakeredis returns at once instead of blocking the read
+            return entries
+        queue.claim = polling_claim
+        workers = queue.start_workers(openai_routes.process_queued_message, count=2)
+        bodies = [f"mensaje {i}" for i in range(6)]
+        for i, body in enumerate(bodies):
+            await queue.enqueue({"From": "whatsapp:+34600000001", "Body": body}, dedupe_id=f"SM{i}")
+            await asyncio.sleep(0.05)
+
+        for _ in range(60):
+            if turns and not queue._deferred:
+                break
+            await asyncio.sleep(0.05)
+        await queue.stop_workers(workers)
+        return bodies, await queue.redis_client.xlen(queue.stream)
+
+    bodies, left_in_stream = asyncio.run(scenario())
+    assert turns == [("whatsapp:+34600000001", "\n".join(bodies))]
+    assert left_in_stream == 0  # Every job of the burst was acknowledged
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+USER_ID = "whatsapp:+34600000001"
+
+
+def test_limit_blocks_and_the_notice_goes_once_per_block(session_manager):
+    session_manager.max_messages_per_hour = 3
+    session_manager.block_seconds = 0.5
+
+    async def scenario():
+        results = [await session_manager.check_rate_limit(USER_ID) for _ in range(5)]
+        await asyncio.sleep(0.6)
+        # The block is over but the window still holds 3 messages: blocked again, notified again
+        results.append(await session_manager.check_rate_limit(USER_ID))
+        return results
+
+    results = asyncio.run(scenario())
+    assert [result.allowed for result in results] == [True, True, True, False, False, False]
+    assert [result.remaining for result in results[:3]] == [2, 1, 0]
+    assert results[1].blocked_until is None and results[2].blocked_until is not None  # The last allowed one starts the block
+    assert [result.notify for result in results] == [False, False, False, True, False, True]
+
+
+def test_messages_older_than_an_hour_leave_the_window(session_manager):
+    session_manager.max_messages_per_hour = 2
+    window_key, _ = session_manager._rate_keys(USER_ID)
+
+    async def scenario():
+        two_hours_ago = (time.time() - 7200) * 1000
+        await session_manager.redis_client.zadd(window_key, {"old-1": two_hours_ago, "old-2": two_hours_ago + 1})
+        first = await session_manager.check_rate_limit(USER_ID)
+        return first, await session_manager.redis_client.zcard(window_key)
+
+    first, in_window = asyncio.run(scenario())
+    assert first.allowed and first.remaining == 1
+    assert in_window == 1
+
+
+def test_concurrent_messages_never_exceed_the_limit(session_manager):
+    session_manager.max_messages_per_hour = 10
+
+    async def scenario():
+        return await asyncio.gather(*[session_manager.check_rate_limit(USER_ID) for _ in range(30)])
+
+    results = asyncio.run(scenario())
+    assert sum(result.allowed for result in results) == 10
+    assert sum(result.notify for result in results) == 1
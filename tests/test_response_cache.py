@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from app.core.config import settings
+from app.services.response_cache_service import ResponseCache
+
+FAQ_QUESTIONS = [
+    "¿Me enseñas la carta?",
+    "¿Qué hay en el menú?",
+    "¿Qué bebidas tenéis?",
+    "¿Qué hamburguesas hay sin gluten?",
+    "¿Se puede pagar en efectivo?",
+    "¿Aceptáis tarjeta?",
+    "¿Puedo pagar con la tarjeta?",
+    "¿Cómo se paga?",
+]
+
+# Their reply depends on the basket or on what was said before
+SESSION_QUESTIONS = ["¿Cuánto es en total?", "que llevo pedido?", "¿Me pones otra coca cola?", "¿Qué extras tiene?"]
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(max_entries=16, ttl_seconds=60, use_redis=False)
+
+
+@pytest.mark.parametrize("question", FAQ_QUESTIONS)
+def test_faq_questions_are_cached_in_every_stage(cache, question):
+    assert cache.make_key(question, "ordering") is not None
+    assert cache.make_key(question, "welcome") is not None
+
+
+@pytest.mark.parametrize("question", SESSION_QUESTIONS)
+def test_questions_about_the_session_are_only_cached_before_it_starts(cache, question):
+    assert cache.make_key(question, "ordering") is None
+    assert cache.make_key(question, "welcome") is not None
+
+
+def test_welcome_stage_skips_numbers_long_messages_and_statements(cache):
+    assert cache.make_key("¿Tenéis mesa para 4?", "welcome") is None
+    assert cache.make_key("¿" + " ".join(["que"] * 11) + "?", "welcome") is None
+    assert cache.make_key("Quiero una hamburguesa", "welcome") is None
+
+
+def test_stage_and_spelling(cache):
+    assert cache.make_key("¿Qué bebidas tenéis?", "welcome") != cache.make_key("¿Qué bebidas tenéis?", "ordering")
+    assert cache.make_key("¿Qué bebidas tenéis?", "ordering") == cache.make_key("que BEBIDAS teneis", "ordering")
+
+
+def test_a_menu_change_invalidates_the_shared_entries(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    shared = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+    def new_cache():
+        cache = ResponseCache(max_entries=16, ttl_seconds=60, use_redis=False)
+        cache.redis_client = shared
+        return cache
+
+    async def scenario():
+        before = new_cache()
+        await before.set(before.make_key("¿Qué bebidas tenéis?", "ordering"), "Coca Cola y agua")
+        same_menu = new_cache()
+        hit = await same_menu.get(same_menu.make_key("¿Qué bebidas tenéis?", "ordering"))
+
+        monkeypatch.setattr(settings, "MENU_JSON", settings.MENU_JSON.replace("Coca Cola", "Pepsi"))
+        new_menu = new_cache()
+        miss = await new_menu.get(new_menu.make_key("¿Qué bebidas tenéis?", "ordering"))
+        return before.version, new_menu.version, hit, miss
+
+    old_version, new_version, hit, miss = asyncio.run(scenario())
+    assert old_version != new_version
+    assert hit == "Coca Cola y agua"
+    assert miss is None
@@ -0,0 +1,96 @@
+import asyncio
+
+from app.shared.metrics import metrics
+
+USER_ID = "whatsapp:+34600000001"
+
+
+def test_concurrent_appends_and_order_updates_lose_nothing(monkeypatch, session_manager):
+    # fakeredis answers without yielding: give the appends a chance to run between the read and the write of the order
+    read_fields = session_manager._get_binary_fields
+
+    async def slow_read(*args):
+        values = await read_fields(*args)
+        await asyncio.sleep(0)
+        return values
+    monkeypatch.setattr(session_manager, "_get_binary_fields", slow_read)
+
+    async def scenario():
+        session_id = await session_manager.create_session(USER_ID)
+        await session_manager.add_order_data(session_id, {"order_id": "A1"})
+        conflicts_before = metrics.get("session_cas_conflicts")
+
+        async def update_order():
+            # One writer of the order racing 200 appends: the appends must never make it conflict
+            for i in range(20):
+                await session_manager.update_order_data(session_id, {f"item_{i}": i})
+
+        await asyncio.gather(
+            update_order(),
+            *[session_manager.add_to_session(session_id, USER_ID, f"message {i}", f"reply {i}") for i in range(200)],
+        )
+        history = await session_manager.get_session(session_id)
+        turns, = await session_manager._get_meta_fields(session_id, "turns")
+        order_data = await session_manager.get_order_data(session_id)
+        return history, turns, order_data, metrics.get("session_cas_conflicts") - conflicts_before
+
+    history, turns, order_data, conflicts = asyncio.run(scenario())
+    assert len(history) == 200 and int(turns) == 200
+    assert sorted(entry["user"] for entry in history) == sorted(f"message {i}" for i in range(200))
+    assert order_data == {"order_id": "A1", **{f"item_{i}": i for i in range(20)}}
+    assert conflicts == 0
+
+
+def test_concurrent_order_updates_keep_every_accepted_change(session_manager):
+    async def scenario():
+        session_id = await session_manager.create_session(USER_ID)
+        await session_manager.add_order_data(session_id, {"order_id": "A1"})
+
+        async def update_order(i):
+            try:
+                await session_manager.update_order_data(session_id, {f"item_{i}": i})
+                return True
+            except ValueError:
+                return False  # Out of retries: rejected, never half written
+
+        accepted = await asyncio.gather(*[update_order(i) for i in range(10)])
+        return accepted, await session_manager.get_order_data(session_id)
+
+    accepted, order_data = asyncio.run(scenario())
+    assert any(accepted)
+    assert order_data == {"order_id": "A1", **{f"item_{i}": i for i, ok in enumerate(accepted) if ok}}
+
+
+def test_only_order_writes_invalidate_an_order_read(session_manager):
+    async def scenario():
+        session_id = await session_manager.create_session(USER_ID)
+        await session_manager.add_order_data(session_id, {"order_id": "A1"})
+        order_version, = await session_manager._get_meta_fields(session_id, "order_version")
+
+        await session_manager.add_to_session(session_id, USER_ID, "hola", "hola!")
+        after_append = await session_manager._update_meta(
+            session_id, {"order_data": session_manager.codec.encode({"order_id": "A2"})},
+            expected_version=int(order_version), version_field="order_version"
+        )
+        # Same version read before the write above: now it is stale
+        stale = await session_manager._update_meta(
+            session_id, {"order_data": session_manager.codec.encode({"order_id": "A3"})},
+            expected_version=int(order_version), version_field="order_version"
+        )
+        # A reset followed by a new order does not bring the old version back
+        await session_manager.clear_session(session_id)
+        await session_manager.add_order_data(session_id, {"order_id": "B1"})
+        after_reset = await session_manager._update_meta(
+            session_id, {"order_data": session_manager.codec.encode({"order_id": "A4"})},
+            expected_version=int(order_version) + 1, version_field="order_version"
+        )
+        return after_append, stale, after_reset, await session_manager.get_order_data(session_id)
+
+    after_append, stale, after_reset, order_data = asyncio.run(scenario())
+    assert after_append > 0
+    assert stale == -2 and after_reset == -2
+    assert order_data == {"order_id": "B1"}
+
+
+def test_order_data_of_no_session_is_none(session_manager):
+    assert asyncio.run(session_manager.get_order_data(None)) is None
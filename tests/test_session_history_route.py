@@ -0,0 +1,21 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.routes import openai_routes
+
+
+def test_new_session_has_an_empty_history_and_unknown_ones_are_404(monkeypatch, session_manager):
+    monkeypatch.setattr(openai_routes, "session_manager", session_manager)
+
+    async def scenario():
+        session_id = await session_manager.create_session("whatsapp:+34600000001")
+        found = await openai_routes.get_session_history(session_id)
+        with pytest.raises(HTTPException) as missing:
+            await openai_routes.get_session_history("whatsapp:+34600000002.unknown")
+        return session_id, found, missing.value
+
+    session_id, found, missing = asyncio.run(scenario())
+    assert found == {"session_id": session_id, "history": []}
+    assert missing.status_code == 404
@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.services import openai_service
+from app.services.stream_service import ParagraphStream
+
+SUMMARY_CHUNKS = [
+    "🍽️ *Resumen del Pedido:* 🍽️\n", "--------------------\n", "- *Numero de Mesa*: 7\n\n",
+    "- *Bebida*: Coca Cola - 2.5€ x1\n", "--------------------\n", "** Muchas gracias ", "por su pedido <3 **",
+]
+
+
+def _chunk(content=None, tool_call=None):
+    delta = SimpleNamespace(content=content, tool_calls=[tool_call] if tool_call else None)
+    return SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=delta)])
+
+
+class FakeCompletions:
+    """Streams the scripted rounds, and records what had happened when each chunk was sent."""
+    def __init__(self, rounds):
+        self.rounds = list(rounds)
+        self.prepared = []
+        self.prepared_before_end = None
+
+    async def create(self, **kwargs):
+        chunks = self.rounds.pop(0)
+
+        async def stream():
+            for chunk in chunks:
+                yield chunk
+                await asyncio.sleep(0.01)
+            if not self.rounds:
+                self.prepared_before_end = list(self.prepared)
+        return stream()
+
+
+def test_summary_order_is_prepared_while_streaming_and_tool_round_text_is_dropped(monkeypatch):
+    lookup = SimpleNamespace(index=0, id="call_1", function=SimpleNamespace(name="list_menu_categories", arguments="{}"))
+    completions = FakeCompletions([
+        [_chunk("Voy a mirar la carta."), _chunk(tool_call=lookup)],
+        [_chunk("Tenemos Coca Cola.\n\n")] + [_chunk(text) for text in SUMMARY_CHUNKS],
+    ])
+    monkeypatch.setattr(openai_service, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+    async def fake_prepare_order(order_data, user_id, session_id):
+        completions.prepared.append(order_data)
+        return order_data, "https://pay", []
+    monkeypatch.setattr(openai_service, "prepare_order", fake_prepare_order)
+
+    async def scenario():
+        sent = []
+
+        async def send(text):
+            sent.append(text)
+        paragraphs = ParagraphStream(send)
+        text, order_task = await openai_service.stream_response([], paragraphs, "whatsapp:+34600000001", "session")
+        await paragraphs.finish()
+        return text, sent, await order_task
+
+    text, sent, (order_data, _, _) = asyncio.run(scenario())
+    assert len(completions.prepared_before_end) == 1  # Started before the thanks line was streamed
+    assert order_data["table_number"] == 7
+    # The preamble of the menu lookup is neither sent nor stored, like in generate_response
+    assert sent[0] == "Tenemos Coca Cola."
+    assert "Voy a mirar la carta" not in text
+
+
+def test_tool_round_text_after_a_whole_paragraph_starts_its_own_paragraph(monkeypatch):
+    lookup = SimpleNamespace(index=0, id="call_1", function=SimpleNamespace(name="list_menu_categories", arguments="{}"))
+    completions = FakeCompletions([
+        [_chunk("Hola, bienvenido.\n\n"), _chunk("Un momento."), _chunk(tool_call=lookup)],
+        [_chunk("Tenemos Coca Cola.")],
+    ])
+    monkeypatch.setattr(openai_service, "client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+
+    async def scenario():
+        sent = []
+
+        async def send(text):
+            sent.append(text)
+        paragraphs = ParagraphStream(send)
+        text, _ = await openai_service.stream_response([], paragraphs, "whatsapp:+34600000001", "session")
+        await paragraphs.finish()
+        return text, sent
+
+    text, sent = asyncio.run(scenario())
+    # Text already streamed when the tool call shows up was sent, so it stays
+    assert sent == ["Hola, bienvenido.", "Un momento.", "Tenemos Coca Cola."]
+    assert text == "Hola, bienvenido.\n\nUn momento.\n\nTenemos Coca Cola."